@@ -0,0 +1,165 @@
+#!/usr/bin/env python3
+"""
+puppet_apis client hot paths benchmarks
+
+Runs against the in-process Puppet CA and PuppetDB emulator (puppet_apis.testing),
+so only the client side cost (and loopback HTTP) is measured.
+
+    python benchmarks/bench_puppet_apis.py --output results.json
+    python benchmarks/bench_puppet_apis.py --compare results.json
+
+Results are saved as JSON with the git commit, to be compared across commits.
+"""
+import argparse
+import functools
+import itertools
+import json
+import platform
+import statistics
+import subprocess
+import sys
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+
+from OpenSSL import crypto
+from puppet_apis import PuppetCa, PuppetDb
+from puppet_apis.keypool import generate_private_key
+from puppet_apis.puppetcacli import create_csr
+from puppet_apis.testing import PuppetEmulator
+
+
+# == Benchmarks
+#
+def run(fn, requests, concurrency):
+    """
+    Call fn(i) 'requests' times from 'concurrency' threads
+
+    Returns throughput and latency percentiles, and the number of calls
+    which returned a false value (failed operations)
+    """
+    def timed(i):
+        start = time.perf_counter()
+        ok = bool(fn(i))
+        return time.perf_counter() - start, ok
+
+    start = time.perf_counter()
+    if concurrency > 1:
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            calls = list(pool.map(timed, range(requests)))
+    else:
+        calls = [timed(i) for i in range(requests)]
+    elapsed = time.perf_counter() - start
+
+    latencies = sorted(latency for latency, _ in calls)
+    return {
+        'errors': sum(not ok for _, ok in calls),
+        'ops_per_s': round(requests / elapsed, 1),
+        'p50_ms': round(latencies[len(latencies) // 2] * 1000, 3),
+        'p99_ms': round(latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))] * 1000, 3),
+        'mean_ms': round(statistics.mean(latencies) * 1000, 3),
+    }
+
+
+def benchmarks(emulator, requests, concurrency, keys):
+    puppetca = PuppetCa(server=emulator.host, scheme='http', port=emulator.port, pool_maxsize=concurrency)
+    puppetdb = PuppetDb(server=emulator.host, scheme='http', port=emulator.port, pool_maxsize=concurrency)
+
+    key = generate_private_key('rsa', 2048)
+    csr = crypto.dump_certificate_request(crypto.FILETYPE_PEM, create_csr('node.mydomain.com', key)).decode()
+
+    def node(i, prefix='node'):
+        return '{}{:06d}.mydomain.com'.format(prefix, i)
+
+    def add_csrs(prefix):
+        for i in range(requests):
+            emulator.add_csr(node(i, prefix))
+
+    # name: (setup(prefix), fn(prefix, i))
+    # Writes act on hostnames unique to each run, prepared by setup: they measure
+    # signing and submitting, not the error paths of already signed nodes
+    http = {
+        'PuppetCa.status': (None, lambda prefix, i: puppetca.status(node(i))),
+        'PuppetCa.sign': (add_csrs, lambda prefix, i: puppetca.sign(node(i, prefix))),
+        'PuppetCa.get_cert': (None, lambda prefix, i: puppetca.get_cert(node(i))),
+        'PuppetCa.submit_csr': (None, lambda prefix, i: puppetca.submit_csr(node(i, prefix), csr)),
+        'PuppetDb.status': (None, lambda prefix, i: puppetdb.status(node(i))),
+        'PuppetDb.deactivate': (None, lambda prefix, i: puppetdb.deactivate(node(i))),
+    }
+    local = {
+        'PuppetCaCli.generate_key rsa-2048': lambda i: generate_private_key('rsa', 2048),
+        'PuppetCaCli.generate_key ec-P-256': lambda i: generate_private_key('ec', 'P-256'),
+        'PuppetCaCli.create_csr': lambda i: create_csr(node(i), key),
+    }
+
+    results = {}
+    runs = itertools.count()
+    for name, (setup, fn) in http.items():
+        for label, threads in ((name, 1), ('{} x{}'.format(name, concurrency), concurrency)):
+            prefix = 'run{}-'.format(next(runs))
+            if setup is not None:
+                setup(prefix)
+            results[label] = run(functools.partial(fn, prefix), requests, threads)
+    for name, fn in local.items():
+        results[name] = run(fn, keys, 1)
+    return results
+
+
+# == Reporting
+#
+def git_commit():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'], stderr=subprocess.DEVNULL
+        ).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ''
+
+
+def print_results(results, baseline=None):
+    print("{:45} {:>12} {:>10} {:>10}{}".format(
+        'benchmark', 'ops/s', 'p50 ms', 'p99 ms', '   vs baseline' if baseline else ''))
+    for name, result in results.items():
+        line = "{:45} {:>12} {:>10} {:>10}".format(
+            name, result['ops_per_s'], result['p50_ms'], result['p99_ms'])
+        if baseline and name in baseline:
+            line += "   {:+.1%}".format(result['ops_per_s'] / baseline[name]['ops_per_s'] - 1)
+        if result.get('errors'):
+            line += "   ({} failed)".format(result['errors'])
+        print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='puppet_apis client benchmarks')
+    parser.add_argument("--requests", help="Calls per HTTP benchmark", type=int, default=2000)
+    parser.add_argument("--concurrency", help="Threads for concurrent HTTP benchmarks", type=int, default=16)
+    parser.add_argument("--keys", help="Calls per key/CSR generation benchmark", type=int, default=20)
+    parser.add_argument("--output", help="Save results to this JSON file", default="")
+    parser.add_argument("--compare", help="Compare with results saved by --output", default="")
+    args = parser.parse_args()
+
+    with PuppetEmulator() as emulator:
+        emulator.populate(args.requests)
+        results = benchmarks(emulator, args.requests, args.concurrency, args.keys)
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)['results']
+    print_results(results, baseline)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({
+                'commit': git_commit(),
+                'python': platform.python_version(),
+                'machine': platform.machine(),
+                'time': int(time.time()),
+                'parameters': vars(args),
+                'results': results,
+            }, f, indent=2)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -6,10 +6,48 @@ Puppet client
 * PuppetDB
 
 From: https://gist.github.com/jessereynolds/b666a48674908b2c2fbeac447f6c4c0b
+
+Submodules are imported on first access (PEP 562): 'import puppet_apis' is cheap,
+and API clients do not load pyOpenSSL, aiohttp or the CLI.
 """
 
-from .puppetbase import PuppetBaseAPI
-from .puppetca import PuppetCa, PuppetCaException
-from .puppetdb import PuppetDb
+import importlib
+
+# Public name -> submodule
+_EXPORTS = {
+    'PuppetBaseAPI': 'puppetbase',
+    'PuppetCa': 'puppetca',
+    'PuppetCaException': 'puppetca',
+    'PuppetCaIndex': 'puppetca',
+    'PuppetDb': 'puppetdb',
+    'PuppetDbException': 'puppetdb',
+    'PuppetDbCommands': 'commands',
+    'RevocationList': 'crl',
+    'Decommission': 'decommission',
+    'CaInventory': 'inventory',
+    'Metrics': 'metrics',
+    # aiohttp is optional: pip install puppet_apis[async]
+    'AsyncPuppetBaseAPI': 'puppetasync',
+    'AsyncPuppetCa': 'puppetasync',
+    'AsyncPuppetDb': 'puppetasync',
+    'KeyPool': 'keypool',
+    'PuppetCaCli': 'puppetcacli',
+}
+
+__all__ = list(_EXPORTS)
+
+
+def __getattr__(name):
+    try:
+        module = _EXPORTS[name]
+    except KeyError:
+        raise AttributeError("module {!r} has no attribute {!r}".format(__name__, name)) from None
+
+    value = getattr(importlib.import_module('.' + module, __name__), name)
+    # Next accesses do not go through __getattr__
+    globals()[name] = value
+    return value
+
 
-from .puppetcacli import PuppetCaCli
+def __dir__():
+    return sorted(set(globals()) | set(__all__))
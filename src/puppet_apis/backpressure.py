@@ -0,0 +1,137 @@
+"""
+PuppetDB command queue backpressure
+
+Mass operations (decommissions, fact imports) can fill PuppetDB command queue,
+delaying reports and facts of the whole fleet. Command submission is paused
+while the queue is deeper than 'max_depth', until it drains below 'resume_depth'.
+
+    puppetdb = PuppetDb(server='puppetdb', max_queue_depth=1000)
+"""
+import logging
+import threading
+import time
+
+from time import monotonic
+
+
+class CommandBackpressure:
+    """
+    Thread safe gate in front of PuppetDB command submission
+
+    puppetdb: PuppetDb client, for queue_depth() and command_rate()
+    max_depth: queue depth above which submissions pause
+    resume_depth: queue depth below which they resume, default to max_depth / 2
+    interval: max age of the queue depth reading, in seconds,
+        and max sleep between two readings while paused
+
+    While paused, the sleep is the time PuppetDB needs to drain the queue
+    below 'resume_depth' at its current processing rate, up to 'interval'.
+    Queue depth reading errors do not block submissions.
+    """
+    def __init__(self, puppetdb, max_depth=1000, resume_depth=None, interval=5,
+                 clock=monotonic, sleep=time.sleep):
+        self.logger = logging.getLogger()
+
+        self.puppetdb = puppetdb
+        self.max_depth = max_depth
+        self.resume_depth = max_depth // 2 if resume_depth is None else resume_depth
+        self.interval = interval
+        self.clock = clock
+        self.sleep = sleep
+
+        # Last reading
+        self.depth = None
+        self.rate = None
+        self._checked_at = None
+        self.paused = False
+
+        # Counters
+        self.pauses = 0
+        self.paused_seconds = 0.0
+
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+
+
+    def stats(self):
+        with self._lock:
+            return {
+                'depth': self.depth,
+                'rate': self.rate,
+                'paused': self.paused,
+                'pauses': self.pauses,
+                'paused_seconds': self.paused_seconds,
+            }
+
+
+    def check(self, max_age=None):
+        """
+        Queue depth, read from PuppetDB if the last reading is older than 'max_age' seconds
+        (default: interval). None when it can not be read.
+        """
+        max_age = self.interval if max_age is None else max_age
+
+        # One thread reads, the others wait for its reading
+        with self._refresh_lock:
+            if self._checked_at is not None and self.clock() - self._checked_at < max_age:
+                return self.depth
+
+            try:
+                depth = self.puppetdb.queue_depth()
+            except Exception as e:
+                self.logger.warning("{}: Can not read PuppetDB queue depth: {}".format(__name__, e))
+                depth = None
+
+            rate = None
+            if depth is not None and depth > self.resume_depth:
+                try:
+                    rate = self.puppetdb.command_rate()
+                except Exception as e:
+                    self.logger.debug("{}: Can not read PuppetDB command rate: {}".format(__name__, e))
+
+            with self._lock:
+                self.depth, self.rate = depth, rate
+                self._checked_at = self.clock()
+            return depth
+
+
+    def wait(self, deadline=None):
+        """
+        Block while PuppetDB queue is too deep
+
+        deadline: puppet_apis.deadline.Deadline, raise DeadlineExceeded instead of waiting past it
+
+        Returns the seconds waited
+        """
+        waited = 0.0
+        max_age = None
+        while True:
+            depth = self.check(max_age)
+            with self._lock:
+                threshold = self.resume_depth if self.paused else self.max_depth
+                if depth is None or depth <= threshold:
+                    if self.paused:
+                        self.logger.info("{}: PuppetDB queue depth {}, resuming commands".format(__name__, depth))
+                    self.paused = False
+                    return waited
+
+                if not self.paused:
+                    self.logger.warning("{}: PuppetDB queue depth {} > {}, pausing commands".format(
+                        __name__, depth, self.max_depth))
+                    self.pauses += 1
+                self.paused = True
+
+                delay = self.interval
+                if self.rate:
+                    delay = min(delay, max((depth - self.resume_depth) / self.rate, 0.1))
+
+            if deadline is not None:
+                deadline.check('PuppetDB command')
+                delay = min(delay, deadline.remaining())
+
+            self.sleep(delay)
+            waited += delay
+            with self._lock:
+                self.paused_seconds += delay
+            # Paused: read the queue depth again after the sleep
+            max_age = delay
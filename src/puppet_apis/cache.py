@@ -0,0 +1,117 @@
+"""
+TTL + LRU cache
+"""
+import threading
+
+from collections import OrderedDict
+from time import monotonic
+
+
+class TTLCache:
+    """
+    Thread safe cache: entries expire after 'ttl' seconds,
+    the least recently used entries are evicted above 'maxsize' entries.
+
+    'hits' and 'misses' count get() calls.
+
+    Values read from a server while the key is invalidated are outdated: get generation()
+    before the read, and pass it to set(), which then ignores values read before an invalidation.
+    """
+    def __init__(self, ttl, maxsize=1024, clock=monotonic):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self.clock = clock
+
+        self.hits = 0
+        self.misses = 0
+
+        # key -> (expires_at, value), ordered from least to most recently used
+        self._data = OrderedDict()
+        # key -> generation of its last invalidation, the 'maxsize' most recent ones.
+        # Older ones are summarized by '_floor': the most recent generation forgotten.
+        self._generation = 0
+        self._invalidated = OrderedDict()
+        self._floor = 0
+        self._lock = threading.Lock()
+
+
+    def get(self, key, default=None):
+        """
+        Value for 'key', or 'default' when missing or expired
+        """
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None:
+                if entry[0] > self.clock():
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return entry[1]
+                del self._data[key]
+
+            self.misses += 1
+            return default
+
+
+    def generation(self):
+        """
+        Current generation, bumped by each invalidation
+        """
+        with self._lock:
+            return self._generation
+
+
+    def set(self, key, value, generation=None):
+        """
+        generation: generation() before 'value' was read, ignore it if 'key' was invalidated since
+        """
+        with self._lock:
+            if generation is not None and (
+                    generation < self._floor or self._invalidated.get(key, -1) > generation):
+                return
+            self._data[key] = (self.clock() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+
+    def invalidate(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+            self._generation += 1
+            self._invalidated[key] = self._generation
+            self._invalidated.move_to_end(key)
+            while len(self._invalidated) > self.maxsize:
+                _, self._floor = self._invalidated.popitem(last=False)
+
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            # Every value read before is outdated
+            self._generation += 1
+            self._floor = self._generation
+            self._invalidated.clear()
+
+
+    def stats(self):
+        """
+        Counters to tune ttl and maxsize
+        """
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'size': len(self._data),
+                'maxsize': self.maxsize,
+                'ttl': self.ttl,
+            }
+
+
+    def __contains__(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            return entry is not None and entry[0] > self.clock()
+
+
+    def __len__(self):
+        return len(self._data)
@@ -0,0 +1,146 @@
+"""
+PuppetDB command submission
+
+Queue many commands, then submit them concurrently:
+
+    commands = PuppetDbCommands(puppetdb, workers=20)
+    for node_fqdn in nodes:
+        commands.deactivate(node_fqdn)
+    results = commands.submit(wait=30)
+"""
+import logging
+
+from concurrent.futures import ThreadPoolExecutor
+
+from .deadline import DeadlineExceeded
+from .puppetdb import producer_timestamp
+
+
+class PuppetDbCommands:
+    """
+    Batch of PuppetDB commands, submitted with a pool of workers
+    """
+    def __init__(self, puppetdb, workers=10):
+        self.logger = logging.getLogger()
+
+        self.puppetdb = puppetdb
+        self.workers = workers
+        self.queue = []
+
+
+    def __len__(self):
+        return len(self.queue)
+
+
+    def add(self, command, version, certname, payload):
+        """
+        Queue any command
+        """
+        self.queue.append({
+            'command': command,
+            'version': version,
+            'certname': certname,
+            'payload': payload,
+        })
+
+
+    # === Commands
+    #
+    # https://puppet.com/docs/puppetdb/5.2/api/command/v1/commands.html
+    #
+    def deactivate(self, certname):
+        """
+        Queue a 'deactivate node' command
+        """
+        payload = {
+            "certname": certname,
+            "producer_timestamp": producer_timestamp()
+        }
+        self.add('deactivate node', 3, certname, payload)
+
+
+    def replace_facts(self, certname, values, environment='production', producer=None):
+        """
+        Queue a 'replace facts' command
+        """
+        payload = {
+            "certname": certname,
+            "environment": environment,
+            "producer_timestamp": producer_timestamp(),
+            "producer": producer,
+            "values": values
+        }
+        self.add('replace facts', 5, certname, payload)
+
+
+    def store_report(self, certname, report):
+        """
+        Queue a 'store report' command, report being a full version 8 wire format report
+        """
+        self.add('store report', 8, report.get('certname', certname), report)
+
+
+    def submit(self, wait=None, deadline=None):
+        """
+        Submit all queued commands, and empty the queue
+
+        wait: seconds to wait for each command to be processed
+        deadline: puppet_apis.deadline.Deadline, each submission gets at most the remaining time.
+            Commands not submitted when it expires have the 'skipped' outcome.
+
+        Returns one result per command, in the queue order:
+
+            {
+                'command': 'deactivate node',
+                'certname': 'node01.mydomain.com',
+                'uuid': '<command uuid>',
+                'outcome': 'queued',    # or 'processed', 'timed_out', 'failed', 'error', 'skipped'
+                'error': None
+            }
+        """
+        queue, self.queue = self.queue, []
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            return list(pool.map(lambda command: self._submit(command, wait, deadline), queue))
+
+
+    def _submit(self, command, wait, deadline):
+        result = {
+            'command': command['command'],
+            'certname': command['certname'],
+            'uuid': None,
+            'outcome': 'error',
+            'error': None,
+        }
+
+        kwargs = {'wait': wait}
+        if deadline is not None:
+            if deadline.expired():
+                result['outcome'] = 'skipped'
+                return result
+            kwargs['timeout'] = deadline
+
+        try:
+            response = self.puppetdb.submit_command(
+                command['command'], command['version'], command['certname'], command['payload'],
+                **kwargs
+            )
+        except DeadlineExceeded:
+            # Held back (e.g. by the command queue backpressure) until the deadline: never sent
+            result['outcome'] = 'skipped'
+            return result
+        except Exception as e:
+            self.logger.error("{}: {} {}: {}".format(__name__, command['command'], command['certname'], e))
+            result['error'] = repr(e)
+            return result
+
+        result['uuid'] = response.get('uuid')
+        if response.get('error'):
+            result['outcome'] = 'failed'
+            result['error'] = response['error']
+        elif response.get('timed_out'):
+            result['outcome'] = 'timed_out'
+        elif response.get('processed'):
+            result['outcome'] = 'processed'
+        elif result['uuid']:
+            result['outcome'] = 'queued'
+        return result
@@ -0,0 +1,96 @@
+"""
+Certificate Revocation List
+
+Revoked serial numbers are kept in a sorted array: lookups are local binary searches.
+"""
+from array import array
+from bisect import bisect_left
+
+
+class RevocationList:
+    """
+    Revoked serial numbers of a CRL
+    """
+    def __init__(self, serials=(), last_update=None, next_update=None, last_modified=None):
+        serials = sorted(set(serials))
+
+        # 'Q' items are 8 bytes, fall back on a list for larger serials
+        if not serials or serials[-1] < 2 ** 64:
+            self.serials = array('Q', serials)
+        else:
+            self.serials = serials
+
+        self.last_update = last_update
+        self.next_update = next_update
+        # HTTP Last-Modified of the CRL, for conditional refresh
+        self.last_modified = last_modified
+
+
+    @classmethod
+    def from_pem(cls, pem, last_modified=None):
+        """
+        Parse a PEM encoded CRL
+        """
+        # Only needed to parse CRLs
+        from cryptography import x509
+
+        if isinstance(pem, str):
+            pem = pem.encode()
+
+        crl = x509.load_pem_x509_crl(pem)
+        return cls(
+            (revoked.serial_number for revoked in crl),
+            last_update=crl.last_update,
+            next_update=crl.next_update,
+            last_modified=last_modified
+        )
+
+
+    def is_revoked(self, serial_or_cert):
+        """
+        Check if a certificate is revoked
+
+        serial_or_cert: serial number as int or hex string ('0x0004', '04', '00:04'),
+            PEM certificate (str or bytes), pyOpenSSL X509, cryptography Certificate,
+            or an object with a 'serial' attribute (CaInventory entries)
+        """
+        serial = self._serial(serial_or_cert)
+        i = bisect_left(self.serials, serial)
+        return i < len(self.serials) and self.serials[i] == serial
+
+
+    def __contains__(self, serial_or_cert):
+        return self.is_revoked(serial_or_cert)
+
+
+    def __len__(self):
+        return len(self.serials)
+
+
+    @staticmethod
+    def _serial(serial_or_cert):
+        value = serial_or_cert
+
+        if isinstance(value, bytes):
+            value = value.decode()
+
+        if isinstance(value, int):
+            return value
+
+        if isinstance(value, str):
+            if '-----BEGIN' in value:
+                from cryptography import x509
+                return x509.load_pem_x509_certificate(value.encode()).serial_number
+            return int(value.replace(':', ''), 16)
+
+        # cryptography Certificate
+        if hasattr(value, 'serial_number'):
+            return value.serial_number
+        # pyOpenSSL X509
+        if hasattr(value, 'get_serial_number'):
+            return value.get_serial_number()
+        # CaInventory entry
+        if hasattr(value, 'serial'):
+            return value.serial
+
+        raise TypeError("Can not get a serial number from {!r}".format(serial_or_cert))
@@ -0,0 +1,74 @@
+"""
+Time budgets
+
+A Deadline is shared by all the steps of a batch operation: each HTTP call
+gets at most the remaining time, and steps not started when the budget is
+spent are skipped and reported.
+
+    deadline = Deadline(300)
+    report = Decommission(puppetca, puppetdb).run(fqdns, deadline=deadline)
+
+Any client call also accepts it as timeout: puppetca.revoke(fqdn, timeout=deadline)
+"""
+from time import monotonic
+
+
+class DeadlineExceeded(Exception):
+    pass
+
+
+def split_timeout(timeout):
+    """
+    (connect, read) seconds from a requests timeout: number, tuple or None
+    """
+    if isinstance(timeout, tuple):
+        return timeout
+    return timeout, timeout
+
+
+class Deadline:
+    """
+    Expires 'seconds' after its creation
+    """
+    def __init__(self, seconds, clock=monotonic):
+        self.seconds = seconds
+        self.clock = clock
+        self.expires_at = clock() + seconds
+
+
+    def remaining(self):
+        """
+        Seconds left, 0 once expired
+        """
+        return max(self.expires_at - self.clock(), 0)
+
+
+    def expired(self):
+        return self.remaining() <= 0
+
+
+    def check(self, what=''):
+        """
+        Raise DeadlineExceeded once expired
+        """
+        if self.expired():
+            raise DeadlineExceeded("Deadline of {}s exceeded{}".format(
+                self.seconds, ' before ' + what if what else ''))
+
+
+    def timeout(self, timeout=None):
+        """
+        requests (connect, read) timeout bounded by the remaining time
+
+        timeout: the timeout to use without deadline, None for no limit
+        """
+        self.check('request')
+        remaining = self.remaining()
+        return tuple(
+            remaining if value is None else min(value, remaining)
+            for value in split_timeout(timeout)
+        )
+
+
+    def __repr__(self):
+        return '<Deadline {:.3f}s/{}s remaining>'.format(self.remaining(), self.seconds)
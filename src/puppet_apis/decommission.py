@@ -0,0 +1,105 @@
+"""
+Node decommission across PuppetCA and PuppetDB
+
+CA (revoke + delete) and PuppetDB (deactivate) steps run concurrently,
+each backend with its own bounded worker pool.
+An optional Deadline bounds the whole run.
+"""
+import logging
+
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+
+class Decommission:
+    """
+    Decommission many nodes in parallel
+
+    puppetca / puppetdb: PuppetCa and PuppetDb clients, None to skip a backend
+    ca_workers / db_workers: max requests in flight per backend,
+        clients 'pool_maxsize' should be at least as large to keep connections alive
+    """
+    def __init__(self, puppetca=None, puppetdb=None, ca_workers=10, db_workers=10):
+        self.logger = logging.getLogger()
+
+        self.puppetca = puppetca
+        self.puppetdb = puppetdb
+        self.ca_workers = ca_workers
+        self.db_workers = db_workers
+
+
+    def run(self, node_fqdns, deadline=None):
+        """
+        Decommission nodes, returns a report per node:
+
+            {
+                'node01.mydomain.com': {
+                    'revoke': True,
+                    'delete': True,
+                    'deactivate': '<PuppetDB command uuid>',
+                    'errors': []
+                },
+            }
+
+        deadline: puppet_apis.deadline.Deadline, each call gets at most the remaining time.
+            Steps not started when it expires are listed in the node 'skipped' entry.
+        """
+        report = {}
+        with ThreadPoolExecutor(max_workers=self.ca_workers) as ca_pool, \
+             ThreadPoolExecutor(max_workers=self.db_workers) as db_pool:
+
+            futures = {}
+            for node_fqdn in node_fqdns:
+                if node_fqdn in report:
+                    continue
+                report[node_fqdn] = {'errors': []}
+
+                if self.puppetca is not None:
+                    futures[ca_pool.submit(self._decommission_ca, node_fqdn, deadline)] = node_fqdn
+                if self.puppetdb is not None:
+                    futures[db_pool.submit(self._decommission_db, node_fqdn, deadline)] = node_fqdn
+
+            for future in as_completed(futures):
+                node_fqdn = futures[future]
+                try:
+                    result = future.result()
+                    skipped = result.pop('skipped', [])
+                    if skipped:
+                        report[node_fqdn].setdefault('skipped', []).extend(skipped)
+                    report[node_fqdn].update(result)
+                except Exception as e:
+                    self.logger.error("{}: {}: {}".format(__name__, node_fqdn, e))
+                    report[node_fqdn]['errors'].append(repr(e))
+
+        return report
+
+
+    def _decommission_ca(self, node_fqdn, deadline):
+        self.logger.debug("{}: CA revoke + delete {}".format(__name__, node_fqdn))
+        return self._steps(node_fqdn, deadline, [
+            ('revoke', self.puppetca.revoke),
+            ('delete', self.puppetca.delete),
+        ])
+
+
+    def _decommission_db(self, node_fqdn, deadline):
+        self.logger.debug("{}: PuppetDB deactivate {}".format(__name__, node_fqdn))
+        result = self._steps(node_fqdn, deadline, [
+            ('deactivate', self.puppetdb.deactivate),
+        ])
+        if 'deactivate' in result:
+            result['deactivate'] = result['deactivate'].get('uuid', False)
+        return result
+
+
+    @staticmethod
+    def _steps(node_fqdn, deadline, steps):
+        # Run steps in order, skipping the remaining ones once the deadline expired
+        result = {}
+        for name, call in steps:
+            if deadline is None:
+                result[name] = call(node_fqdn)
+            elif deadline.expired():
+                result.setdefault('skipped', []).append(name)
+            else:
+                result[name] = call(node_fqdn, timeout=deadline)
+        return result
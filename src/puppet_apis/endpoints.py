@@ -0,0 +1,172 @@
+"""
+Multi-endpoint routing
+
+A client 'server' can be a list of endpoints: 'host', 'host:port' or (host, port).
+The first one is the primary.
+
+* Reads ('read_prefixes', PuppetDB queries) are spread across endpoints: the one
+  with the lowest latency * in flight score out of two random picks
+* Other requests go to the primary. With 'failover' (CA calls), they go to the
+  next endpoint in order when it can not be reached; without (PuppetDB commands),
+  they only go to the primary
+* An endpoint failing with a connection error or a timeout is skipped for
+  'cooldown' seconds
+
+    puppetdb = PuppetDb(server=['puppetdb1', 'puppetdb2', 'puppetdb3'], port=8081, scheme='https')
+    puppetca = PuppetCa(server=['puppet', 'puppet-standby'])
+"""
+import random
+import threading
+
+from time import monotonic
+
+
+def parse_endpoints(servers, port):
+    """
+    [(host, port)] from a server name, or a list of 'host', 'host:port' or (host, port)
+    """
+    if isinstance(servers, str):
+        return [(servers, port)]
+
+    endpoints = []
+    for server in servers:
+        if isinstance(server, (tuple, list)):
+            host, server_port = server
+        elif server.count(':') == 1:
+            host, server_port = server.split(':')
+        else:
+            host, server_port = server, port
+        endpoints.append((host, int(server_port)))
+
+    if not endpoints:
+        raise ValueError("At least one server is required")
+    return endpoints
+
+
+class Endpoint:
+    """
+    One server of a pool, with its latency (EWMA, seconds) and health
+    """
+    def __init__(self, scheme, server, port):
+        self.server = server
+        self.port = port
+        self.uri = '{}://{}:{}'.format(scheme, server, port)
+        self.label = '{}:{}'.format(server, port)
+
+        self.latency = None
+        self.in_flight = 0
+        self.requests = 0
+        self.failures = 0
+        self.down_until = 0
+
+
+    def score(self):
+        # Endpoints never measured come first
+        return (self.latency or 0) * (self.in_flight + 1)
+
+
+    def __repr__(self):
+        return '<Endpoint {}>'.format(self.label)
+
+
+class EndpointPool:
+    """
+    Thread safe endpoint selection
+
+    read_prefixes: paths of requests spread across endpoints
+    read_primary: also send reads to the primary
+    failover: send other requests to the next endpoints when the primary is down
+    cooldown: seconds a failed endpoint is skipped
+    decay: weight of the last request in the latency average
+    """
+    def __init__(self, scheme, endpoints, read_prefixes=(), read_primary=True,
+                 failover=True, cooldown=30, decay=0.3, clock=monotonic, rng=None):
+        self.endpoints = [Endpoint(scheme, server, port) for server, port in endpoints]
+        self.read_prefixes = tuple(read_prefixes)
+        self.read_primary = read_primary
+        self.failover = failover
+        self.cooldown = cooldown
+        self.decay = decay
+        self.clock = clock
+        self.random = rng or random.Random()
+
+        # Counters
+        self.failovers = 0
+
+        self._lock = threading.Lock()
+
+
+    @property
+    def primary(self):
+        return self.endpoints[0]
+
+
+    def stats(self):
+        with self._lock:
+            return {
+                'failovers': self.failovers,
+                'endpoints': {
+                    endpoint.label: {
+                        'latency': endpoint.latency,
+                        'in_flight': endpoint.in_flight,
+                        'requests': endpoint.requests,
+                        'failures': endpoint.failures,
+                        'up': endpoint.down_until <= self.clock(),
+                    }
+                    for endpoint in self.endpoints
+                }
+            }
+
+
+    def is_read(self, path):
+        return path.startswith(self.read_prefixes) if self.read_prefixes else False
+
+
+    def candidates(self, path):
+        """
+        Endpoints to try in order for a request to 'path'
+        """
+        with self._lock:
+            now = self.clock()
+            up = [endpoint for endpoint in self.endpoints if endpoint.down_until <= now]
+            # Endpoints down are a last resort
+            down = [endpoint for endpoint in self.endpoints if endpoint.down_until > now]
+
+            if not self.is_read(path):
+                return up + down if self.failover else [self.primary]
+            if len(up) < 2:
+                return up + down
+
+            readers = up if self.read_primary or up[0] is not self.primary else up[1:]
+            others = [endpoint for endpoint in up if endpoint not in readers]
+            # Power of two choices: avoids sending every request to the same best endpoint
+            picks = self.random.sample(readers, min(2, len(readers)))
+            best = min(picks, key=Endpoint.score)
+            rest = sorted((endpoint for endpoint in readers if endpoint is not best), key=Endpoint.score)
+            return [best] + rest + others + down
+
+
+    def started(self, endpoint):
+        with self._lock:
+            endpoint.in_flight += 1
+            endpoint.requests += 1
+
+
+    def finished(self, endpoint, elapsed, failed=False):
+        with self._lock:
+            endpoint.in_flight -= 1
+            if failed:
+                endpoint.failures += 1
+                endpoint.down_until = self.clock() + self.cooldown
+                return
+
+            endpoint.down_until = 0
+            if endpoint.latency is None:
+                endpoint.latency = elapsed
+            else:
+                endpoint.latency += (elapsed - endpoint.latency) * self.decay
+
+
+    def failed_over(self):
+        with self._lock:
+            self.failovers += 1
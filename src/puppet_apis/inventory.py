@@ -0,0 +1,192 @@
+"""
+Local Puppet CA inventory index
+
+To be used on the CA host: reads the CA directory ('ssl/ca' or 'ca'),
+without going through the HTTP API.
+
+* inventory.txt: one line per signed certificate
+    0x0002 2018-04-23T15:56:16UTC 2023-04-23T15:56:16UTC /CN=puppet.mydomain.com
+* signed/: one '<certname>.pem' per signed certificate
+"""
+import mmap
+import os
+
+from bisect import bisect_left, insort
+from calendar import timegm
+from collections import namedtuple
+from datetime import datetime
+from time import time
+
+
+# Inventory line, dates as UTC epoch seconds
+InventoryEntry = namedtuple('InventoryEntry', ['serial', 'not_before', 'not_after', 'subject', 'cn'])
+
+
+def _parse_time(value):
+    # 2018-04-23T15:56:16UTC
+    return timegm((
+        int(value[0:4]), int(value[5:7]), int(value[8:10]),
+        int(value[11:13]), int(value[14:16]), int(value[17:19])
+    ))
+
+
+def _epoch(value):
+    if isinstance(value, datetime):
+        return value.timestamp()
+    return value
+
+
+def parse_inventory_line(line):
+    """
+    Parse an inventory.txt line (str) as an InventoryEntry
+    """
+    serial, not_before, not_after, subject = line.rstrip('\r\n').split(' ', 3)
+
+    cn = ''
+    for rdn in subject.split('/'):
+        if rdn.startswith('CN='):
+            cn = rdn[3:]
+
+    return InventoryEntry(int(serial, 16), _parse_time(not_before), _parse_time(not_after), subject, cn)
+
+
+class CaInventory:
+    """
+    Index of a CA inventory, by serial, CN and expiry date
+
+    refresh() only reads the lines appended since the previous call.
+    """
+    def __init__(self, ca_dir):
+        self.ca_dir = ca_dir
+        self.inventory_path = os.path.join(ca_dir, 'inventory.txt')
+        self.signed_dir = os.path.join(ca_dir, 'signed')
+
+        self._reset()
+        self.refresh()
+
+
+    def _reset(self):
+        self._offset = 0
+        self._by_serial = {}
+        self._by_cn = {}
+        # Sorted (not_after, serial) tuples
+        self._by_expiry = []
+        self._signed = set()
+
+
+    def refresh(self):
+        """
+        Read the inventory lines appended since the last refresh, and rescan signed/
+
+        Returns the number of new entries
+        """
+        try:
+            size = os.path.getsize(self.inventory_path)
+        except FileNotFoundError:
+            size = 0
+
+        # Truncated or replaced: start over
+        if size < self._offset:
+            self._reset()
+
+        entries = []
+        if size > self._offset:
+            with open(self.inventory_path, 'rb') as f, \
+                 mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                # Only complete lines, a partial one is read on next refresh
+                end = data.rfind(b'\n', self._offset) + 1
+                if end > self._offset:
+                    for line in data[self._offset:end].decode('utf-8').splitlines():
+                        if line.strip():
+                            entries.append(parse_inventory_line(line))
+                    self._offset = end
+
+        self._add(entries)
+        self._scan_signed()
+        return len(entries)
+
+
+    def _add(self, entries):
+        for entry in entries:
+            self._by_serial[entry.serial] = entry
+            self._by_cn.setdefault(entry.cn, []).append(entry)
+
+        # Initial load: one sort. Appended lines: insert
+        if len(entries) > len(self._by_expiry):
+            self._by_expiry.extend((entry.not_after, entry.serial) for entry in entries)
+            self._by_expiry.sort()
+        else:
+            for entry in entries:
+                insort(self._by_expiry, (entry.not_after, entry.serial))
+
+
+    def _scan_signed(self):
+        if not os.path.isdir(self.signed_dir):
+            self._signed = set()
+            return
+
+        with os.scandir(self.signed_dir) as it:
+            self._signed = set(
+                entry.name[:-4] for entry in it if entry.name.endswith('.pem')
+            )
+
+
+    # == Queries
+    #
+    def get(self, serial):
+        """
+        Entry for a serial number (int, or hex string as in inventory.txt), None if unknown
+        """
+        if isinstance(serial, str):
+            serial = int(serial, 16)
+        return self._by_serial.get(serial)
+
+
+    def find(self, cn):
+        """
+        All entries for a CN, oldest first
+        """
+        return list(self._by_cn.get(cn, []))
+
+
+    def latest(self, cn):
+        """
+        Latest entry issued for a CN, None if unknown
+        """
+        entries = self._by_cn.get(cn)
+        return entries[-1] if entries else None
+
+
+    def expiring(self, start, end):
+        """
+        Entries expiring in [start, end), as epoch seconds or datetimes, sorted by expiry
+        """
+        lo = bisect_left(self._by_expiry, (_epoch(start), -1))
+        hi = bisect_left(self._by_expiry, (_epoch(end), -1))
+        return [self._by_serial[serial] for _, serial in self._by_expiry[lo:hi]]
+
+
+    def expired(self, now=None):
+        """
+        Entries expired at 'now' (default: current time)
+        """
+        if now is None:
+            now = time()
+        return self.expiring(0, now)
+
+
+    def signed(self, cn):
+        """
+        Path to the signed certificate of a CN, None when not in signed/
+        """
+        if cn in self._signed:
+            return os.path.join(self.signed_dir, '{}.pem'.format(cn))
+        return None
+
+
+    def __contains__(self, serial):
+        return self.get(serial) is not None
+
+
+    def __len__(self):
+        return len(self._by_serial)
@@ -0,0 +1,90 @@
+"""
+Incremental JSON decoding
+
+Decode the items of a JSON array as the response body is received,
+without buffering the whole body.
+"""
+import codecs
+import json
+
+
+_WHITESPACE = ' \t\n\r'
+_DELIMITERS = ',]' + _WHITESPACE
+
+
+def _skip_whitespace(buffer, pos):
+    while pos < len(buffer) and buffer[pos] in _WHITESPACE:
+        pos += 1
+    return pos
+
+
+def iter_json_array(chunks, encoding='utf-8'):
+    """
+    Yield the items of a top level JSON array from an iterable of chunks
+
+    chunks: bytes or str, e.g. requests' response.iter_content()
+    """
+    decoder = json.JSONDecoder()
+    text_decoder = codecs.getincrementaldecoder(encoding)()
+
+    buffer = ''
+    # States: '[' expects the array start, 'value' expects a value or the array end,
+    # ',' expects a comma or the array end, 'end' once the array is closed
+    state = '['
+    eof = False
+    chunks = iter(chunks)
+
+    while state != 'end':
+        try:
+            chunk = next(chunks)
+        except StopIteration:
+            eof = True
+            chunk = b''
+        if isinstance(chunk, bytes):
+            chunk = text_decoder.decode(chunk, final=eof)
+        buffer += chunk
+
+        pos = 0
+        while True:
+            pos = _skip_whitespace(buffer, pos)
+            if pos == len(buffer):
+                break
+
+            if state == '[':
+                if buffer[pos] != '[':
+                    raise ValueError("Expecting a JSON array, got {!r}".format(buffer[pos:pos + 20]))
+                state = 'value'
+                pos += 1
+
+            elif buffer[pos] == ']':
+                state = 'end'
+                pos += 1
+                break
+
+            elif state == ',':
+                if buffer[pos] != ',':
+                    raise ValueError("Expecting ',' delimiter, got {!r}".format(buffer[pos:pos + 20]))
+                state = 'value'
+                pos += 1
+
+            else:
+                try:
+                    item, end = decoder.raw_decode(buffer, pos)
+                except json.JSONDecodeError:
+                    if eof:
+                        raise
+                    break
+
+                # Numbers and literals are not self delimited, they may continue in the next chunk:
+                # e.g. '-2500.' is decoded as -2500, until a delimiter follows
+                if not eof and not isinstance(item, (dict, list, str)) and \
+                        (end == len(buffer) or buffer[end] not in _DELIMITERS):
+                    break
+
+                yield item
+                state = ','
+                pos = end
+
+        buffer = buffer[pos:]
+        if eof and state != 'end':
+            raise ValueError("Truncated JSON array")
@@ -0,0 +1,174 @@
+"""
+Pre-generated private keys
+
+RSA key generation (prime search) is slow: a pool of worker processes
+generates keys in the background, up to a watermark, so they are ready
+when a CSR has to be generated.
+
+Keys are only kept in memory, in the process owning the pool.
+"""
+import logging
+import threading
+
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+from cryptography.hazmat.backends import default_backend
+from cryptography.hazmat.primitives.asymmetric import ec
+from OpenSSL import crypto
+
+
+# == Key algorithms
+#
+KEY_TYPES = {
+    'rsa': crypto.TYPE_RSA,
+    'ec': crypto.TYPE_EC,
+}
+
+EC_CURVES = {
+    'P-256': ec.SECP256R1,
+    'P-384': ec.SECP384R1,
+    'P-521': ec.SECP521R1,
+}
+EC_CURVE_ALIASES = {
+    '256': 'P-256', 'PRIME256V1': 'P-256', 'SECP256R1': 'P-256',
+    '384': 'P-384', 'SECP384R1': 'P-384',
+    '521': 'P-521', 'SECP521R1': 'P-521',
+}
+
+
+def key_spec(key_type='rsa', key_size=None):
+    """
+    Normalize a key algorithm:
+    * key_type: 'rsa', 'ec' (or crypto.TYPE_RSA, crypto.TYPE_EC)
+    * key_size: RSA bits (default 2048) or EC curve, 'P-256' (default), 'P-384', 'P-521'
+
+    Returns a (crypto.TYPE_*, bits or curve name) tuple
+    """
+    type = KEY_TYPES.get(str(key_type).lower(), key_type)
+
+    if type == crypto.TYPE_RSA:
+        return type, int(key_size or 2048)
+
+    if type == crypto.TYPE_EC:
+        curve = str(key_size or 'P-256').upper()
+        curve = EC_CURVE_ALIASES.get(curve, curve)
+        if curve not in EC_CURVES:
+            raise ValueError("Unsupported EC curve '{}', use one of {}".format(key_size, ', '.join(EC_CURVES)))
+        return type, curve
+
+    raise ValueError("Unsupported key type '{}', use one of {}".format(key_type, ', '.join(KEY_TYPES)))
+
+
+def generate_private_key(key_type='rsa', key_size=None):
+    """
+    Generate a private key (PKey), see key_spec() for the arguments
+    """
+    type, size = key_spec(key_type, key_size)
+
+    if type == crypto.TYPE_EC:
+        return crypto.PKey.from_cryptography_key(
+            ec.generate_private_key(EC_CURVES[size](), default_backend())
+        )
+
+    key = crypto.PKey()
+    key.generate_key(type, size)
+    return key
+
+
+def _generate_key_pem(type, bits):
+    # Runs in a worker process, PEM bytes can be sent back to the parent
+    key = generate_private_key(type, bits)
+    return crypto.dump_privatekey(crypto.FILETYPE_PEM, key)
+
+
+class KeyPool:
+    """
+    Reservoir of private keys, refilled in the background
+
+    type / bits: generated keys algorithm, see key_spec()
+    size: number of keys to keep ready
+    processes: worker processes, default to the number of CPUs
+    """
+    def __init__(self, type=crypto.TYPE_RSA, bits=2048, size=8, processes=None):
+        self.logger = logging.getLogger('puppet-ca-cli')
+
+        self.type, self.bits = key_spec(type, bits)
+        self.size = size
+
+        self._keys = deque()
+        self._pending = 0
+        self._lock = threading.Lock()
+        self._closed = False
+        self._executor = ProcessPoolExecutor(max_workers=processes)
+
+        self.fill()
+
+
+    def __len__(self):
+        return len(self._keys)
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+    def matches(self, type, bits):
+        """
+        Check if the pool generates this kind of keys
+        """
+        return key_spec(type, bits) == (self.type, self.bits)
+
+
+    def fill(self):
+        """
+        Start generating keys up to the watermark
+        """
+        with self._lock:
+            if self._closed:
+                return
+            missing = self.size - len(self._keys) - self._pending
+            self._pending += max(missing, 0)
+
+        for _ in range(missing):
+            future = self._executor.submit(_generate_key_pem, self.type, self.bits)
+            future.add_done_callback(self._add)
+
+
+    def _add(self, future):
+        with self._lock:
+            self._pending -= 1
+            if self._closed or future.cancelled():
+                return
+            if future.exception() is not None:
+                self.logger.error("{}: Key generation failed: {}".format(__name__, future.exception()))
+                return
+            self._keys.append(future.result())
+
+
+    def get(self):
+        """
+        Get a pre-generated key (PKey), None when the pool is empty
+        """
+        try:
+            pem = self._keys.popleft()
+        except IndexError:
+            return None
+        finally:
+            self.fill()
+
+        return crypto.load_privatekey(crypto.FILETYPE_PEM, pem)
+
+
+    def close(self):
+        """
+        Stop the workers and forget the keys not used yet
+        """
+        with self._lock:
+            self._closed = True
+            self._keys.clear()
+        self._executor.shutdown(wait=False)
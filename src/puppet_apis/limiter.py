@@ -0,0 +1,163 @@
+"""
+Adaptive concurrency limiter
+
+Protects a server (the Puppet CA) from bulk operations: requests wait for a
+slot before being sent.
+
+* Concurrency limit, adjusted by AIMD: +1 per 'limit' successful requests,
+  multiplied by 'backoff' on 429/503 answers, timeouts, or latency above 'latency_target'
+* Optional token bucket: at most 'rate' requests per second, bursts of 'burst'
+* Retry-After answers pause all requests
+
+One limiter can be shared by threads, asyncio tasks and clients:
+
+    limiter = AdaptiveLimiter(limit=20, max_limit=200, latency_target=0.5)
+    puppetca = PuppetCa(server='puppet', limiter=limiter)
+"""
+import threading
+
+from time import monotonic
+
+
+# Answers meaning the server is overloaded
+THROTTLE_STATUSES = frozenset([429, 503])
+
+# asyncio waiters poll for a free slot
+_ASYNC_POLL = 0.005
+
+
+class AdaptiveLimiter:
+    """
+    Thread safe AIMD concurrency limiter with a token bucket
+
+    limit / min_limit / max_limit: initial, min and max requests in flight
+    rate / burst: requests per second and bucket size, None for no rate limit
+    latency_target: seconds above which a request counts as overload, None to only use answers
+    backoff: limit multiplier on overload
+    max_pause: max seconds honoured from Retry-After
+    """
+    def __init__(self, limit=10, min_limit=1, max_limit=100,
+                 rate=None, burst=None, latency_target=None,
+                 backoff=0.5, max_pause=30, clock=monotonic):
+        self.limit = float(limit)
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.rate = rate
+        self.burst = burst or max(rate or 1, 1)
+        self.latency_target = latency_target
+        self.backoff = backoff
+        self.max_pause = max_pause
+        self.clock = clock
+
+        # Counters
+        self.in_flight = 0
+        self.overloads = 0
+        self.waits = 0
+
+        self._tokens = float(self.burst)
+        self._refilled_at = clock()
+        self._paused_until = 0
+        self._last_decrease = float('-inf')
+        self._cond = threading.Condition()
+
+
+    def stats(self):
+        with self._cond:
+            return {
+                'limit': int(self.limit),
+                'in_flight': self.in_flight,
+                'overloads': self.overloads,
+                'waits': self.waits,
+            }
+
+
+    # == Acquire
+    #
+    def _try_acquire(self):
+        # Returns 0 when acquired, else seconds to wait (None: until a release)
+        now = self.clock()
+        if now < self._paused_until:
+            return self._paused_until - now
+
+        if self.in_flight >= int(self.limit):
+            return None
+
+        if self.rate:
+            self._tokens = min(self.burst, self._tokens + (now - self._refilled_at) * self.rate)
+            self._refilled_at = now
+            if self._tokens < 1:
+                return (1 - self._tokens) / self.rate
+            self._tokens -= 1
+
+        self.in_flight += 1
+        return 0
+
+
+    def acquire(self):
+        """
+        Wait for a slot, from a thread
+        """
+        with self._cond:
+            wait = self._try_acquire()
+            if wait != 0:
+                self.waits += 1
+            while wait != 0:
+                self._cond.wait(wait)
+                wait = self._try_acquire()
+
+
+    async def acquire_async(self):
+        """
+        Wait for a slot, from a coroutine
+        """
+        import asyncio
+
+        with self._cond:
+            wait = self._try_acquire()
+            if wait != 0:
+                self.waits += 1
+        while wait != 0:
+            await asyncio.sleep(_ASYNC_POLL if wait is None else wait)
+            with self._cond:
+                wait = self._try_acquire()
+
+
+    # == Release
+    #
+    def release(self, elapsed, overloaded=False, retry_after=None):
+        """
+        Give back a slot, and adjust the limit
+
+        elapsed: request duration in seconds
+        overloaded: the server answered 429/503 or timed out
+        retry_after: Retry-After seconds of the answer, if any
+        """
+        with self._cond:
+            self.in_flight -= 1
+            now = self.clock()
+
+            if self.latency_target is not None and elapsed > self.latency_target:
+                overloaded = True
+
+            if overloaded:
+                self.overloads += 1
+                # Requests sent before the last decrease saw the previous limit: decrease once per round trip
+                if now - elapsed >= self._last_decrease:
+                    self.limit = max(self.min_limit, self.limit * self.backoff)
+                    self._last_decrease = now
+                if retry_after:
+                    self._paused_until = max(self._paused_until, now + min(retry_after, self.max_pause))
+            else:
+                self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+
+            self._cond.notify_all()
+
+
+def retry_after(value):
+    """
+    Retry-After header in seconds, None if missing or an HTTP date
+    """
+    try:
+        return max(float(value), 0)
+    except (TypeError, ValueError):
+        return None
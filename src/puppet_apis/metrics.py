@@ -0,0 +1,321 @@
+"""
+HTTP requests metrics
+
+A Metrics registry is passed to the clients (metrics=...), and can be shared
+between several PuppetCa / PuppetDb clients:
+
+    metrics = Metrics()
+    puppetca = PuppetCa(server='puppet', metrics=metrics)
+    puppetdb = PuppetDb(server='puppetdb', metrics=metrics)
+
+    metrics.subscribe(StatsdExporter('127.0.0.1', 8125))
+    serve_prometheus(metrics, port=9100)
+
+Every request is recorded as a RequestSample, labelled by server, method and
+endpoint (the URL path without the node name), then passed to the subscribers.
+"""
+import re
+import socket
+import threading
+
+from bisect import bisect_left
+from collections import namedtuple
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+# Latency histogram buckets, in seconds
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+RequestSample = namedtuple('RequestSample', [
+    'server', 'method', 'endpoint', 'status', 'elapsed',
+    'bytes_sent', 'bytes_received', 'retries', 'error'
+])
+RequestSample.__doc__ = """
+One HTTP request:
+* status: HTTP status, 0 when no answer was received
+* elapsed: seconds until the response is read (headers only for streamed responses) or the error
+* retries: retries done by the transport (urllib3 Retry)
+* error: exception class name, '' on answers
+"""
+
+_VERSION = re.compile(r'^v\d+$')
+
+
+def endpoint_label(path):
+    """
+    Endpoint name of an URL path: the path up to the segment after the API version
+
+        /puppet-ca/v1/certificate_status/node.mydomain.com -> puppet-ca/v1/certificate_status
+        /pdb/query/v4/nodes/node.mydomain.com/facts -> pdb/query/v4/nodes
+    """
+    segments = path.split('?', 1)[0].strip('/').split('/')
+    for i, segment in enumerate(segments):
+        if _VERSION.match(segment):
+            return '/'.join(segments[:i + 2])
+    return '/'.join(segments)
+
+
+class _Stats:
+    __slots__ = ('statuses', 'errors', 'buckets', 'count', 'sum', 'bytes_sent', 'bytes_received', 'retries')
+
+    def __init__(self):
+        self.statuses = {}
+        self.errors = {}
+        # One more bucket for +Inf
+        self.buckets = [0] * (len(BUCKETS) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self.retries = 0
+
+
+class Metrics:
+    """
+    Thread safe registry of HTTP requests metrics
+
+    Per (server, method, endpoint): requests by status, errors by type,
+    latency histogram, bytes sent and received, retries.
+    Per server: requests in flight.
+    """
+    def __init__(self):
+        self._stats = {}
+        self._in_flight = {}
+        self._subscribers = []
+        self._lock = threading.Lock()
+
+
+    def subscribe(self, callback):
+        """
+        Call 'callback(sample)' with the RequestSample of every request
+        """
+        self._subscribers.append(callback)
+
+
+    def unsubscribe(self, callback):
+        self._subscribers.remove(callback)
+
+
+    def started(self, server):
+        """
+        A request to 'server' is starting
+        """
+        with self._lock:
+            self._in_flight[server] = self._in_flight.get(server, 0) + 1
+
+
+    def record(self, sample):
+        """
+        A request started with started() is over
+        """
+        key = (sample.server, sample.method, sample.endpoint)
+        with self._lock:
+            self._in_flight[sample.server] = self._in_flight.get(sample.server, 1) - 1
+
+            stats = self._stats.get(key)
+            if stats is None:
+                stats = self._stats[key] = _Stats()
+
+            if sample.error:
+                stats.errors[sample.error] = stats.errors.get(sample.error, 0) + 1
+            else:
+                stats.statuses[sample.status] = stats.statuses.get(sample.status, 0) + 1
+            stats.buckets[bisect_left(BUCKETS, sample.elapsed)] += 1
+            stats.count += 1
+            stats.sum += sample.elapsed
+            stats.bytes_sent += sample.bytes_sent
+            stats.bytes_received += sample.bytes_received
+            stats.retries += sample.retries
+
+        for callback in list(self._subscribers):
+            callback(sample)
+
+
+    def in_flight(self, server=None):
+        """
+        Requests in flight to 'server', or to all servers
+        """
+        with self._lock:
+            if server is None:
+                return sum(self._in_flight.values())
+            return self._in_flight.get(server, 0)
+
+
+    def snapshot(self):
+        """
+        Current values, as a list of dicts (one per server, method and endpoint)
+        """
+        with self._lock:
+            return [
+                {
+                    'server': server,
+                    'method': method,
+                    'endpoint': endpoint,
+                    'count': stats.count,
+                    'statuses': dict(stats.statuses),
+                    'errors': dict(stats.errors),
+                    'buckets': list(zip(BUCKETS + (float('inf'),), stats.buckets)),
+                    'sum': stats.sum,
+                    'bytes_sent': stats.bytes_sent,
+                    'bytes_received': stats.bytes_received,
+                    'retries': stats.retries,
+                }
+                for (server, method, endpoint), stats in sorted(self._stats.items())
+            ]
+
+
+    def reset(self):
+        with self._lock:
+            self._stats.clear()
+
+
+    # == Prometheus
+    #
+    # https://prometheus.io/docs/instrumenting/exposition_formats/
+    #
+    def prometheus(self, prefix='puppet_apis'):
+        """
+        Metrics in the Prometheus text exposition format
+        """
+        snapshot = self.snapshot()
+        with self._lock:
+            in_flight = sorted(self._in_flight.items())
+
+        lines = []
+
+        def family(name, type, help):
+            lines.append('# HELP {}_{} {}'.format(prefix, name, help))
+            lines.append('# TYPE {}_{} {}'.format(prefix, name, type))
+
+        def sample(name, labels, value):
+            lines.append('{}_{}{{{}}} {}'.format(
+                prefix, name,
+                ','.join('{}="{}"'.format(k, _escape(v)) for k, v in labels),
+                _number(value)
+            ))
+
+        def labels(entry, *extra):
+            return (('server', entry['server']), ('method', entry['method']), ('endpoint', entry['endpoint'])) + extra
+
+        family('requests_total', 'counter', 'HTTP requests answered, by status')
+        for entry in snapshot:
+            for status, count in sorted(entry['statuses'].items()):
+                sample('requests_total', labels(entry, ('status', status)), count)
+
+        family('request_errors_total', 'counter', 'HTTP requests without answer, by error')
+        for entry in snapshot:
+            for error, count in sorted(entry['errors'].items()):
+                sample('request_errors_total', labels(entry, ('error', error)), count)
+
+        family('request_duration_seconds', 'histogram', 'HTTP requests latency')
+        for entry in snapshot:
+            cumulative = 0
+            for le, count in entry['buckets']:
+                cumulative += count
+                sample('request_duration_seconds_bucket', labels(entry, ('le', _number(le))), cumulative)
+            sample('request_duration_seconds_sum', labels(entry), entry['sum'])
+            sample('request_duration_seconds_count', labels(entry), entry['count'])
+
+        family('request_sent_bytes_total', 'counter', 'HTTP request bodies size')
+        for entry in snapshot:
+            sample('request_sent_bytes_total', labels(entry), entry['bytes_sent'])
+
+        family('response_received_bytes_total', 'counter', 'HTTP response bodies size')
+        for entry in snapshot:
+            sample('response_received_bytes_total', labels(entry), entry['bytes_received'])
+
+        family('request_retries_total', 'counter', 'HTTP requests retried by the transport')
+        for entry in snapshot:
+            sample('request_retries_total', labels(entry), entry['retries'])
+
+        family('requests_in_flight', 'gauge', 'HTTP requests waiting for an answer')
+        for server, count in in_flight:
+            sample('requests_in_flight', (('server', server),), count)
+
+        return '\n'.join(lines) + '\n'
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _number(value):
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, float):
+        return repr(value)
+    return str(value)
+
+
+def serve_prometheus(metrics, port=9100, host='', prefix='puppet_apis'):
+    """
+    Serve metrics.prometheus() on http://host:port/metrics, from a daemon thread
+
+    Returns the HTTP server, server.shutdown() to stop it
+    """
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split('?', 1)[0] != '/metrics':
+                self.send_error(404)
+                return
+            body = metrics.prometheus(prefix).encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name='puppet-apis-metrics', daemon=True).start()
+    return server
+
+
+# == StatsD
+#
+# https://github.com/statsd/statsd/blob/master/docs/metric_types.md
+#
+_STATSD_INVALID = re.compile(r'[^A-Za-z0-9_]+')
+
+
+class StatsdExporter:
+    """
+    Metrics subscriber sending every request to StatsD, over UDP
+
+        <prefix>.<server>.<endpoint>.<method>.duration:12.3|ms
+        <prefix>.<server>.<endpoint>.<method>.status.200:1|c
+        <prefix>.<server>.<endpoint>.<method>.error.ConnectionError:1|c
+        <prefix>.<server>.<endpoint>.<method>.retries:2|c
+    """
+    def __init__(self, host='127.0.0.1', port=8125, prefix='puppet_apis'):
+        self.address = (host, port)
+        self.prefix = prefix
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+
+    def __call__(self, sample):
+        name = '.'.join([self.prefix] + [
+            _STATSD_INVALID.sub('_', part).strip('_')
+            for part in (sample.server, sample.endpoint, sample.method)
+        ])
+
+        lines = ['{}.duration:{:.3f}|ms'.format(name, sample.elapsed * 1000)]
+        if sample.error:
+            lines.append('{}.error.{}:1|c'.format(name, sample.error))
+        else:
+            lines.append('{}.status.{}:1|c'.format(name, sample.status))
+        if sample.retries:
+            lines.append('{}.retries:{}|c'.format(name, sample.retries))
+
+        try:
+            self.socket.sendto('\n'.join(lines).encode(), self.address)
+        except OSError:
+            # Metrics must never break API calls
+            pass
+
+
+    def close(self):
+        self.socket.close()
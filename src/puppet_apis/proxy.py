@@ -0,0 +1,344 @@
+"""
+Local caching proxy for Puppet CA and PuppetDB
+
+An HTTP server in front of the CA and PuppetDB, for tools polling the same
+statuses: point their PuppetCa / PuppetDb clients (scheme='http') at it.
+
+* GET /puppet-ca/v1/certificate_status/<name> and GET /pdb/query/v4/nodes/<name>
+  are cached for 'ttl' seconds, and concurrent identical requests share one
+  upstream request
+* Other requests are forwarded as is. Writes (certificate status/request
+  changes, PuppetDB commands) invalidate the cached entries of their node.
+* GET /proxy/stats: cache and upstream counters
+
+    puppetca = PuppetCa(server='puppet', client_cert_path=..., client_key_path=...)
+    puppetdb = PuppetDb(server='puppetdb', client_cert_path=..., client_key_path=...)
+    with PuppetProxy(puppetca, puppetdb, ttl=5, port=8080) as proxy:
+        ...
+
+Or standalone: python -m puppet_apis.proxy --ca-server puppet --db-server puppetdb --cert ... --key ...
+"""
+import argparse
+import json
+import threading
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, unquote, urlparse
+
+from requests.exceptions import RequestException
+
+from .cache import TTLCache
+from .singleflight import SingleFlight
+
+
+# Upstream answers which can be cached
+CACHED_STATUSES = (200, 404)
+
+# Request and response headers passed through
+REQUEST_HEADERS = ('Accept', 'Content-Type', 'If-Modified-Since')
+RESPONSE_HEADERS = ('Content-Type', 'Last-Modified', 'Retry-After', 'X-Records')
+
+_CA_STATUS = '/puppet-ca/v1/certificate_status/'
+_CA_REQUEST = '/puppet-ca/v1/certificate_request/'
+_PDB_NODE = '/pdb/query/v4/nodes/'
+_PDB_COMMAND = '/pdb/cmd/v1'
+
+
+class ProxyResponse:
+    """
+    Upstream answer: status code, headers (dict) and body (bytes)
+    """
+    __slots__ = ('status', 'headers', 'body')
+
+    def __init__(self, status, headers, body):
+        self.status = status
+        self.headers = headers
+        self.body = body
+
+
+class PuppetProxy:
+    """
+    Caching and coalescing proxy server
+
+    puppetca / puppetdb: upstream clients, their session (TLS client certificate,
+        connection pool, retries, metrics) is used to forward requests. None to not proxy it.
+    ttl / maxsize: status cache
+    """
+    def __init__(self, puppetca=None, puppetdb=None, ttl=5, maxsize=65536, host='127.0.0.1', port=8080):
+        self.puppetca = puppetca
+        self.puppetdb = puppetdb
+        self.host = host
+        self.port = port
+
+        self.cache = TTLCache(ttl, maxsize)
+        self.flights = SingleFlight()
+        # Bumped by writes: reads started before a write are not cached
+        self._generation = 0
+        self._lock = threading.Lock()
+
+        # Counters
+        self.forwarded = 0
+        self.upstream_errors = 0
+
+        self.server = None
+        self.thread = None
+
+
+    # == Server
+    #
+    def start(self):
+        handler = type('PuppetProxyHandler', (PuppetProxyHandler,), {'proxy': self})
+        self.server = ThreadingHTTPServer((self.host, self.port), handler)
+        self.server.daemon_threads = True
+        self.server.request_queue_size = 1024
+        self.port = self.server.server_port
+
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+
+    def stop(self):
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+
+
+    def __enter__(self):
+        return self.start()
+
+
+    def __exit__(self, exc_type, exc, tb):
+        self.stop()
+
+
+    @property
+    def uri(self):
+        return 'http://{}:{}'.format(self.host, self.port)
+
+
+    def stats(self):
+        return {
+            'cache': self.cache.stats(),
+            'coalesced': self.flights.coalesced,
+            'forwarded': self.forwarded,
+            'upstream_errors': self.upstream_errors,
+        }
+
+
+    # == Routing
+    #
+    def upstream(self, path):
+        """
+        Client serving 'path', None if not proxied
+        """
+        if path.startswith('/puppet-ca/'):
+            return self.puppetca
+        if path.startswith('/pdb/'):
+            return self.puppetdb
+        return None
+
+
+    def handle(self, method, path, query, headers, body):
+        """
+        Answer a request, returns a ProxyResponse
+
+        Raises RequestException when the upstream can not be reached
+        """
+        key = self._cache_key(method, path)
+        if key is not None:
+            return self._cached(key, path, query, headers)
+
+        response = self._forward(method, path, query, headers, body)
+        if method != 'GET':
+            self.invalidate(*self._written(path, query, body))
+        return response
+
+
+    @staticmethod
+    def _cache_key(method, path):
+        if method != 'GET':
+            return None
+        for prefix in (_CA_STATUS, _PDB_NODE):
+            name = path[len(prefix):]
+            if path.startswith(prefix) and name and '/' not in name:
+                return (prefix, name)
+        return None
+
+
+    @staticmethod
+    def _written(path, query, body):
+        # Cache keys modified by a write
+        if path.startswith(_CA_STATUS) or path.startswith(_CA_REQUEST):
+            return [(_CA_STATUS, path.rsplit('/', 1)[-1])]
+
+        if path.startswith(_PDB_COMMAND):
+            certname = parse_qs(query).get('certname', [None])[0]
+            if certname is None:
+                # Commands with the certname in the payload
+                try:
+                    certname = json.loads(body)['payload']['certname']
+                except (ValueError, KeyError, TypeError):
+                    pass
+            if certname:
+                return [(_PDB_NODE, certname)]
+
+        return []
+
+
+    def invalidate(self, *keys):
+        """
+        Forget cached entries, and do not cache reads in flight
+        """
+        with self._lock:
+            self._generation += 1
+            for key in keys:
+                self.cache.invalidate(key)
+                self.flights.forget(key)
+
+
+    # == Upstream
+    #
+    def _cached(self, key, path, query, headers):
+        response = self.cache.get(key)
+        if response is not None:
+            return response
+
+        return self.flights.do(key, self._fetch, key, path, query, headers)
+
+
+    def _fetch(self, key, path, query, headers):
+        with self._lock:
+            generation = self._generation
+
+        response = self._forward('GET', path, query, headers, b'')
+        with self._lock:
+            if generation == self._generation and response.status in CACHED_STATUSES:
+                self.cache.set(key, response)
+        return response
+
+
+    def _forward(self, method, path, query, headers, body):
+        client = self.upstream(path)
+        url = '{}{}{}'.format(client.uri, path, '?' + query if query else '')
+
+        with self._lock:
+            self.forwarded += 1
+        try:
+            response = client.session.request(
+                method, url,
+                headers={name: value for name, value in headers.items() if name.title() in REQUEST_HEADERS},
+                data=body or None,
+                verify=False
+            )
+        except RequestException:
+            with self._lock:
+                self.upstream_errors += 1
+            raise
+
+        return ProxyResponse(
+            response.status_code,
+            {name: response.headers[name] for name in RESPONSE_HEADERS if name in response.headers},
+            response.content
+        )
+
+
+class PuppetProxyHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # Send headers and body in one segment: avoid delayed ACK stalls
+    wbufsize = -1
+    disable_nagle_algorithm = True
+
+    proxy = None
+
+    def log_message(self, *args):
+        pass
+
+
+    def _send(self, code, body, headers=None):
+        self.send_response(code)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+    def _handle(self, method):
+        url = urlparse(self.path)
+        path = unquote(url.path)
+        length = int(self.headers.get('Content-Length', 0))
+        body = self.rfile.read(length) if length else b''
+
+        if method == 'GET' and path == '/proxy/stats':
+            return self._send(200, json.dumps(self.proxy.stats()).encode(), {'Content-Type': 'application/json'})
+
+        if self.proxy.upstream(path) is None:
+            return self._send(404, b'Not Found', {'Content-Type': 'text/plain'})
+
+        try:
+            response = self.proxy.handle(method, path, url.query, self.headers, body)
+        except RequestException as e:
+            return self._send(502, str(e).encode(), {'Content-Type': 'text/plain'})
+        self._send(response.status, response.body, response.headers)
+
+
+    def do_GET(self):
+        self._handle('GET')
+
+
+    def do_PUT(self):
+        self._handle('PUT')
+
+
+    def do_POST(self):
+        self._handle('POST')
+
+
+    def do_DELETE(self):
+        self._handle('DELETE')
+
+
+# == Standalone
+#
+def main():
+    # Only needed standalone
+    from .puppetca import PuppetCa
+    from .puppetdb import PuppetDb
+
+    parser = argparse.ArgumentParser(description='Caching proxy for Puppet CA and PuppetDB reads')
+    parser.add_argument("--host", help="Listen address", default='127.0.0.1')
+    parser.add_argument("--port", help="Listen port", type=int, default=8080)
+    parser.add_argument("--ca-server", help="Puppet CA server address", default='')
+    parser.add_argument("--ca-port", help="Puppet CA server port", type=int, default=8140)
+    parser.add_argument("--db-server", help="PuppetDB server address", default='')
+    parser.add_argument("--db-port", help="PuppetDB server port", type=int, default=8081)
+    parser.add_argument("--scheme", help="Upstream scheme", default='https')
+    parser.add_argument("--cert", help="Client cert PKI file", default='')
+    parser.add_argument("--key", help="Client key PKI file", default='')
+    parser.add_argument("--ttl", help="Seconds statuses are cached", type=float, default=5)
+    parser.add_argument("--pool-maxsize", help="Upstream connections kept open", type=int, default=32)
+    args = parser.parse_args()
+
+    clients = {}
+    for name, cls, server, port in (('puppetca', PuppetCa, args.ca_server, args.ca_port),
+                                    ('puppetdb', PuppetDb, args.db_server, args.db_port)):
+        if server:
+            clients[name] = cls(server=server, port=port, scheme=args.scheme,
+                                client_cert_path=args.cert, client_key_path=args.key,
+                                pool_maxsize=args.pool_maxsize)
+    if not clients:
+        parser.error("--ca-server and/or --db-server is required")
+
+    proxy = PuppetProxy(ttl=args.ttl, host=args.host, port=args.port, **clients)
+    proxy.start()
+    print("Puppet proxy listening on {} ({})".format(proxy.uri, ', '.join(clients)))
+    try:
+        proxy.thread.join()
+    except KeyboardInterrupt:
+        proxy.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,371 @@
+"""
+Asyncio Puppet* HTTP API clients
+
+Same methods as PuppetCa and PuppetDb, as coroutines, on top of aiohttp.
+Clients can share one aiohttp.ClientSession (and its connection pool),
+from within a coroutine:
+
+    async with AsyncPuppetCa(server='puppet', ...) as ca:
+        db = AsyncPuppetDb(server='puppetdb', session=ca.session)
+        await asyncio.gather(ca.revoke(fqdn), db.deactivate(fqdn))
+"""
+import json
+import logging
+import ssl
+
+from time import perf_counter
+
+import aiohttp
+
+from .limiter import THROTTLE_STATUSES, retry_after
+from .puppetca import PuppetCaException
+from .puppetdb import PuppetDbException, producer_timestamp
+
+
+class AsyncPuppetBaseAPI:
+    """
+    Base Puppet* HTTP API asyncio client
+    """
+    def __init__(self, scheme, server, port,
+                 ca_cert_path='', client_cert_path='', client_key_path='',
+                 session=None, limit=1000, limit_per_host=0, metrics=None, limiter=None):
+        self.logger = logging.getLogger()
+
+        # Puppet Host
+        self.scheme = scheme
+        self.server = server
+        self.port = port
+        self.uri = '{scheme}://{server}:{port}'.format(
+            scheme=self.scheme,
+            server=self.server,
+            port=self.port
+        )
+
+        # Client side certificates
+        self.ca_cert_path = ca_cert_path
+
+        # Same behaviour as the sync client: 'verify=False'
+        # The SSL context is passed per request, so clients using different
+        # client certificates can still share a session
+        self.ssl = ssl.create_default_context()
+        self.ssl.check_hostname = False
+        self.ssl.verify_mode = ssl.CERT_NONE
+        if client_cert_path and client_key_path:
+            self.ssl.load_cert_chain(client_cert_path, client_key_path)
+
+        # Connection pool
+        # limit: max connections in flight, 0 for no limit
+        self.limit = limit
+        self.limit_per_host = limit_per_host
+        self._session = session
+        self._owns_session = session is None
+
+        # puppet_apis.metrics.Metrics registry, can be shared with sync clients
+        self.metrics = metrics
+        # puppet_apis.limiter.AdaptiveLimiter, can be shared with sync clients
+        self.limiter = limiter
+
+
+    @property
+    def session(self):
+        """
+        Shared aiohttp session, created on first use
+        """
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=self.limit,
+                limit_per_host=self.limit_per_host
+            )
+            self._session = aiohttp.ClientSession(
+                connector=connector,
+                headers={"Accept": "application/json"}
+            )
+            self._owns_session = True
+        return self._session
+
+
+    async def close(self):
+        """
+        Close the session if it was created by this client
+        """
+        if self._owns_session and self._session is not None:
+            await self._session.close()
+
+
+    async def __aenter__(self):
+        return self
+
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
+
+
+    async def _request(self, method, url, **kwargs):
+        """
+        Send a request and read the whole response, through the limiter if any
+
+        Returns a (status, text) tuple
+        """
+        if self.scheme == 'https':
+            kwargs.setdefault('ssl', self.ssl)
+
+        if self.limiter is None:
+            status, text, _ = await self._send(method, url, **kwargs)
+            return status, text
+
+        await self.limiter.acquire_async()
+        overloaded = False
+        pause = None
+        start = perf_counter()
+        try:
+            status, text, headers = await self._send(method, url, **kwargs)
+            overloaded = status in THROTTLE_STATUSES
+            if overloaded:
+                pause = retry_after(headers.get('Retry-After'))
+            return status, text
+        except Exception:
+            # Timeouts, connection errors: never an additive increase
+            overloaded = True
+            raise
+        finally:
+            self.limiter.release(perf_counter() - start, overloaded=overloaded, retry_after=pause)
+
+
+    async def _send(self, method, url, **kwargs):
+        # Returns a (status, text, headers) tuple
+        if self.metrics is None:
+            async with self.session.request(method, url, **kwargs) as response:
+                return response.status, await response.text(), response.headers
+
+        from .metrics import RequestSample, endpoint_label
+
+        server = '{}:{}'.format(self.server, self.port)
+        self.metrics.started(server)
+        status, text, error = 0, '', ''
+        start = perf_counter()
+        try:
+            async with self.session.request(method, url, **kwargs) as response:
+                status, text = response.status, await response.text()
+                return status, text, response.headers
+        except Exception as e:
+            error = type(e).__name__
+            raise
+        finally:
+            body = kwargs.get('data') or ''
+            self.metrics.record(RequestSample(
+                server=server,
+                method=method.upper(),
+                endpoint=endpoint_label(url[len(self.uri):]),
+                status=status,
+                elapsed=perf_counter() - start,
+                bytes_sent=len(body.encode() if isinstance(body, str) else body),
+                bytes_received=len(text.encode()),
+                retries=0,
+                error=error
+            ))
+
+
+class AsyncPuppetCa(AsyncPuppetBaseAPI):
+    """
+    Asyncio PuppetCA endpoint exposing methodes for node decommission.
+    """
+    def __init__(self, server,
+                 scheme='https', port=8140,
+                 ca_cert_path='', client_cert_path='', client_key_path='',
+                 **kwargs):
+        super().__init__(
+            server=server,
+            port=port,
+            scheme=scheme,
+            ca_cert_path=ca_cert_path,
+            client_cert_path=client_cert_path,
+            client_key_path=client_key_path,
+            **kwargs
+        )
+
+
+    # === Certifiate Status
+    #
+    # https://puppet.com/docs/puppet/4.10/http_api/http_certificate_status.html
+    #
+    async def delete(self, node_fqdn):
+        """
+        Delete a node certificate
+        """
+        url = '{}/puppet-ca/v1/certificate_status/{}'.format(self.uri, node_fqdn)
+        self.logger.debug("{}: URL={}".format(__name__, url))
+
+        status, _ = await self._request('DELETE', url)
+        return bool(status in [200, 202, 204,])
+
+
+    async def revoke(self, node_fqdn):
+        """
+        Revoke a node certificate
+        """
+        url = '{}/puppet-ca/v1/certificate_status/{}'.format(self.uri, node_fqdn)
+        self.logger.debug("{}: URL={}".format(__name__, url))
+
+        headers = {
+            'Content-Type': 'application/json'
+        }
+        data = '{"desired_state":"revoked"}'
+
+        status, _ = await self._request('PUT', url, headers=headers, data=data)
+        return bool(status in [200, 204,])
+
+
+    async def sign(self, node_fqdn):
+        """
+        Sign a node certificate request
+        """
+        url = '{}/puppet-ca/v1/certificate_status/{}'.format(self.uri, node_fqdn)
+        self.logger.debug("{}: URL={}".format(__name__, url))
+
+        headers = {
+            'Content-Type': 'application/json'
+        }
+        data = '{"desired_state":"signed"}'
+
+        status, _ = await self._request('PUT', url, headers=headers, data=data)
+        return bool(status in [200, 204,])
+
+
+    async def status(self, node_fqdn):
+        """
+        Get the status of a node certificate
+        """
+        url = '{}/puppet-ca/v1/certificate_status/{}'.format(self.uri, node_fqdn)
+        self.logger.debug("{}: URL={}".format(__name__, url))
+
+        try:
+            status, text = await self._request('GET', url)
+        except aiohttp.ClientConnectionError as e:
+            self.logger.error("{}: {}".format(__name__, e))
+            raise PuppetCaException
+
+        if status == 200:
+            return json.loads(text)
+        return {}
+
+
+    # === Certifiate
+    #
+    # https://puppet.com/docs/puppet/4.10/http_api/http_certificate.html
+    #
+    async def get_cert(self, node_fqdn):
+        """
+        Get a certificate
+        """
+        url = '{}/puppet-ca/v1/certificate/{}'.format(self.uri, node_fqdn)
+        self.logger.debug("{}: URL={}".format(__name__, url))
+
+        _, text = await self._request('GET', url)
+
+        # The returned certificate is always in the .pem format.
+        # Other messages are plain text
+        return text
+
+
+    # === Certifiate Requests
+    #
+    # https://puppet.com/docs/puppet/4.10/http_api/http_certificate_request.html
+    #
+    async def get_csr(self, node_fqdn):
+        """
+        Get a certificate request
+        """
+        url = '{}/puppet-ca/v1/certificate_request/{}'.format(self.uri, node_fqdn)
+        self.logger.debug("{}: URL={}".format(__name__, url))
+
+        _, text = await self._request('GET', url)
+        return text
+
+
+    async def submit_csr(self, node_fqdn, csr):
+        """
+        Submit a certificate request
+        """
+        url = '{}/puppet-ca/v1/certificate_request/{}'.format(self.uri, node_fqdn)
+        self.logger.debug("{}: URL={}".format(__name__, url))
+
+        headers = {
+            'Content-Type': 'text/plain'
+        }
+
+        status, text = await self._request('PUT', url, headers=headers, data=csr)
+        self.logger.debug("{}: response.code = {}".format(__name__, status))
+        self.logger.debug("{}: response.text = {}".format(__name__, text))
+        return bool(status in [200, 204,])
+
+
+    async def delete_csr(self, node_fqdn):
+        """
+        Delete a certificate request
+        """
+        url = '{}/puppet-ca/v1/certificate_request/{}'.format(self.uri, node_fqdn)
+        self.logger.debug("{}: URL={}".format(__name__, url))
+
+        _, text = await self._request('DELETE', url)
+        return text
+
+
+class AsyncPuppetDb(AsyncPuppetBaseAPI):
+    """
+    Asyncio PuppetDB endpoint exposing methodes for node decommission.
+    """
+    def __init__(self, server,
+                 scheme='http', port=8080,
+                 ca_cert_path='', client_cert_path='', client_key_path='',
+                 **kwargs):
+        super().__init__(
+            server=server,
+            port=port,
+            scheme=scheme,
+            ca_cert_path=ca_cert_path,
+            client_cert_path=client_cert_path,
+            client_key_path=client_key_path,
+            **kwargs
+        )
+
+
+    async def status(self, node_fqdn):
+        """
+        Get the status of a node certificate
+        """
+        url = '{}/pdb/query/v4/nodes/{}'.format(self.uri, node_fqdn)
+        self.logger.debug("{}: URL={}".format(__name__, url))
+
+        status, text = await self._request('GET', url)
+        # 404: PuppetDB error message, about the unknown node
+        if status not in (200, 404):
+            self.logger.error("{}: {} {}".format(__name__, status, text))
+            raise PuppetDbException(text)
+        return json.loads(text)
+
+
+    async def deactivate(self, node_fqdn):
+        """
+        Deactivate a node
+        """
+        url = '{}/pdb/cmd/v1'.format(self.uri)
+        self.logger.debug("{}: URL={}".format(__name__, url))
+
+        headers = {
+            'Content-Type': 'application/json'
+        }
+
+        tstamp = producer_timestamp()
+        self.logger.debug("{}: producer_timestamp={}".format(__name__, tstamp))
+
+        data = {
+          "command": "deactivate node",
+          "version": 3,
+          "payload": {
+              "certname": node_fqdn,
+              "producer_timestamp": tstamp
+          }
+        }
+
+        _, text = await self._request('POST', url, headers=headers, data=json.dumps(data))
+        return json.loads(text)
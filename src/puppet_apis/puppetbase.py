@@ -1,36 +1,265 @@
 import logging
 
+from time import perf_counter
+from urllib.parse import urlsplit, urlunsplit
+
 from certifi import where as certifi_where
 from requests import Session, exceptions
+from requests.exceptions import ConnectionError, Timeout
+from requests.adapters import HTTPAdapter
+from urllib3 import disable_warnings
+from urllib3.exceptions import InsecureRequestWarning
+from urllib3.util.retry import Retry
+
+from .deadline import Deadline
+from .endpoints import EndpointPool, parse_endpoints
+from .limiter import THROTTLE_STATUSES, retry_after
+from .singleflight import SingleFlight
+
+
+# Default (connect, read) timeouts, in seconds
+DEFAULT_TIMEOUT = (10, 60)
+
+# Verbs safe to retry: PuppetCA and PuppetDB PUT/DELETE calls are idempotent
+IDEMPOTENT_METHODS = frozenset(['GET', 'HEAD', 'OPTIONS', 'PUT', 'DELETE'])
+RETRY_STATUSES = frozenset([429, 502, 503, 504])
+
+
+def _body_size(body):
+    if isinstance(body, str):
+        return len(body.encode())
+    if isinstance(body, bytes):
+        return len(body)
+    # None, or streamed body
+    return 0
+
+
+class PuppetSession(Session):
+    """
+    requests Session with a default timeout, recording every request in a Metrics registry,
+    sending them through an AdaptiveLimiter, and routing them to an EndpointPool
+    """
+    def __init__(self, metrics=None, server='', timeout=DEFAULT_TIMEOUT, limiter=None, endpoints=None):
+        super().__init__()
+        self.logger = logging.getLogger()
+        self.metrics = metrics
+        self.server = server
+        self.timeout = timeout
+        self.limiter = limiter
+        self.endpoints = endpoints
+
+
+    def request(self, method, url, **kwargs):
+        # timeout: None for the default, or a Deadline
+        timeout = kwargs.get('timeout')
+        if timeout is None:
+            kwargs['timeout'] = self.timeout
+        elif isinstance(timeout, Deadline):
+            kwargs['timeout'] = timeout.timeout(self.timeout)
+        return super().request(method, url, **kwargs)
+
+
+    def send(self, request, **kwargs):
+        if self.endpoints is None:
+            return self._limited(request, self.server, **kwargs)
+
+        # Request built for the primary: send it to the endpoints in order, until one can be reached
+        url = urlsplit(request.url)
+        path = urlunsplit(('', '', url.path, url.query, ''))
+        retryable = request.method in IDEMPOTENT_METHODS or self.endpoints.is_read(url.path)
+        error = None
+        for endpoint in self.endpoints.candidates(url.path):
+            if error is not None:
+                self.endpoints.failed_over()
+                self.logger.warning("{}: {} failed ({}), trying {}".format(
+                    __name__, request.path_url, type(error).__name__, endpoint.label))
+
+            attempt = request.copy()
+            attempt.url = endpoint.uri + path
+            self.endpoints.started(endpoint)
+            failed = True
+            start = perf_counter()
+            try:
+                response = self._limited(attempt, endpoint.label, **kwargs)
+                failed = False
+                return response
+            except ConnectionError as e:
+                # Not sent
+                error = e
+            except Timeout as e:
+                # Maybe processed: only retry reads
+                if not retryable:
+                    raise
+                error = e
+            finally:
+                self.endpoints.finished(endpoint, perf_counter() - start, failed=failed)
+        raise error
+
+
+    def _limited(self, request, server, **kwargs):
+        if self.limiter is None:
+            return self._send(request, server, **kwargs)
+
+        self.limiter.acquire()
+        response = None
+        overloaded = False
+        start = perf_counter()
+        try:
+            response = self._send(request, server, **kwargs)
+            overloaded = response.status_code in THROTTLE_STATUSES
+            return response
+        except Exception:
+            # Timeouts, connection errors: never an additive increase
+            overloaded = True
+            raise
+        finally:
+            pause = None
+            if overloaded and response is not None:
+                pause = retry_after(response.headers.get('Retry-After'))
+            self.limiter.release(perf_counter() - start, overloaded=overloaded, retry_after=pause)
+
+
+    def _send(self, request, server, **kwargs):
+        if self.metrics is None:
+            return super().send(request, **kwargs)
+
+        # Imported here: only needed when metrics are enabled
+        from .metrics import RequestSample, endpoint_label
+
+        self.metrics.started(server)
+        status, received, retries, error = 0, 0, 0, ''
+        start = perf_counter()
+        try:
+            response = super().send(request, **kwargs)
+            status = response.status_code
+            if kwargs.get('stream'):
+                # Body not read yet
+                received = int(response.headers.get('Content-Length') or 0)
+            else:
+                received = len(response.content or b'')
+            history = getattr(getattr(response.raw, 'retries', None), 'history', None)
+            retries = len(history or ())
+            return response
+        except Exception as e:
+            error = type(e).__name__
+            raise
+        finally:
+            self.metrics.record(RequestSample(
+                server=server,
+                method=request.method,
+                endpoint=endpoint_label(request.path_url),
+                status=status,
+                elapsed=perf_counter() - start,
+                bytes_sent=_body_size(request.body),
+                bytes_received=received,
+                retries=retries,
+                error=error
+            ))
 
 
 class PuppetBaseAPI:
     """
     Base Puppet* HTTP API client
+
+    Transport:
+    * timeout: default (connect, read) timeout of every request, in seconds, or one value for both.
+      API methods accept a per call 'timeout', which can also be a puppet_apis.deadline.Deadline
+    * pool_connections: number of host connection pools to keep
+    * pool_maxsize: max connections kept open per host, set it to the number of threads using the client
+    * pool_block: wait for a free connection instead of opening (then dropping) an extra one
+    * keep_alive: reuse connections, and so TLS sessions, between requests
+    * retries: number of retries, or a urllib3 Retry, on connection errors and 429/502/503/504 answers.
+      Only idempotent verbs are retried.
+    * backoff_factor: sleep {backoff factor} * (2 ** ({retry number} - 1)) seconds between retries
+
+    Instrumentation:
+    * metrics: puppet_apis.metrics.Metrics registry recording every request, can be shared between clients
+
+    Coalescing:
+    * coalesce: concurrent identical status lookups (threads) share one request and its result
+
+    Load control:
+    * limiter: puppet_apis.limiter.AdaptiveLimiter, requests wait for a slot. Share it between
+      clients (sync and async) of the same server.
+
+    Endpoints:
+    * server: a server name, or a list of endpoints ('host', 'host:port' or (host, port)), the first one
+      being the primary. See puppet_apis.endpoints
+    * read_primary: also send reads spread across endpoints to the primary
+    * failover_cooldown: seconds an endpoint which can not be reached is skipped
     """
+    # Routing of the requests when 'server' is a list, see puppet_apis.endpoints.EndpointPool
+    READ_PREFIXES = ()
+    FAILOVER = True
+
     def __init__(self, scheme, server, port,
-                 ca_cert_path='', client_cert_path='', client_key_path=''):
+                 ca_cert_path='', client_cert_path='', client_key_path='',
+                 pool_connections=10, pool_maxsize=10, pool_block=False,
+                 keep_alive=True, retries=0, backoff_factor=0.5, timeout=DEFAULT_TIMEOUT,
+                 metrics=None, coalesce=True, limiter=None,
+                 read_primary=True, failover_cooldown=30):
         # Flask App
         self.logger = logging.getLogger()
         #logging.basicConfig(filename='puppet.log',level=logging.DEBUG)
         #self.logger = logging
 
-        # Puppet Host
+        # Puppet Host: the primary endpoint
+        endpoints = parse_endpoints(server, port)
         self.scheme = scheme
-        self.server = server
-        self.port = port
+        self.server, self.port = endpoints[0]
+
+        self.endpoints = None
+        if len(endpoints) > 1:
+            self.endpoints = EndpointPool(
+                scheme, endpoints,
+                read_prefixes=self.READ_PREFIXES,
+                read_primary=read_primary,
+                failover=self.FAILOVER,
+                cooldown=failover_cooldown
+            )
 
         # Client side certificates
         self.ca_cert_path = ca_cert_path
 
         #TODO: --tlsv1 \
-        self.session = Session()
+        self.metrics = metrics
+        self.timeout = timeout
+        self.limiter = limiter
+        self.session = PuppetSession(metrics, '{}:{}'.format(self.server, self.port), timeout, limiter, self.endpoints)
         self.session.headers.update({"Accept": "application/json"})
         self.session.verify = False
+        # Disable warning messages when 'verify=False'
+        disable_warnings(InsecureRequestWarning)
 
         if client_cert_path and client_key_path:
             self.session.cert = (client_cert_path, client_key_path)
 
+        # In flight status lookups
+        self.flights = SingleFlight() if coalesce else None
+
+        # Transport
+        if not isinstance(retries, Retry):
+            retries = Retry(
+                total=retries,
+                # Read timeouts are raised as requests' Timeout, not retried as connection errors
+                read=False,
+                backoff_factor=backoff_factor,
+                status_forcelist=RETRY_STATUSES,
+                allowed_methods=IDEMPOTENT_METHODS,
+                raise_on_status=False
+            )
+        self.adapter = HTTPAdapter(
+            pool_connections=pool_connections,
+            pool_maxsize=pool_maxsize,
+            pool_block=pool_block,
+            max_retries=retries
+        )
+        self.session.mount('http://', self.adapter)
+        self.session.mount('https://', self.adapter)
+
+        if not keep_alive:
+            self.session.headers.update({"Connection": "close"})
+
         # # PuppetServer CAcert
         # try:
         #     self.logger.debug("{}: Checking connection to {}...".format(__name__, server))
@@ -56,3 +285,21 @@ class PuppetBaseAPI:
             #     outfile.write(customca)
             #
             # self.logger.debug("{}: Custom cert sucessfully added".format(__name__))
+
+
+    def _coalesced(self, key, fn, *args):
+        """
+        Run fn(*args), sharing the call with concurrent callers using the same key
+
+        A caller passing a Deadline waits for a call in flight at most until it expires
+        """
+        if self.flights is None:
+            return fn(*args)
+        deadline = next((arg for arg in args if isinstance(arg, Deadline)), None)
+        return self.flights.do(key, fn, *args, deadline=deadline)
+
+
+    def _forget(self, key):
+        # A write makes calls in flight outdated
+        if self.flights is not None:
+            self.flights.forget(key)
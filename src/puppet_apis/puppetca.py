@@ -2,9 +2,15 @@
 DOC
 """
 import sys
+from datetime import timezone
+from email.utils import format_datetime
+
+from .cache import TTLCache
+from .crl import RevocationList
 from .puppetbase import PuppetBaseAPI
 from requests.exceptions import (
     ConnectionError,
+    Timeout,
 )
 
 
@@ -13,20 +19,105 @@ class PuppetCaException(Exception):
     pass
 
 
+class PuppetCaIndex:
+    """
+    In-memory index of certificate statuses, by name, state and fingerprint.
+
+    Built from 'certificate_statuses' results, lookups do not hit the CA.
+    """
+    def __init__(self, statuses=()):
+        self.by_name = {}
+        self.by_state = {}
+        self.by_fingerprint = {}
+        self.load(statuses)
+
+
+    def load(self, statuses):
+        """
+        Add or replace certificate statuses in the index
+        """
+        for status in statuses:
+            self.discard(status['name'])
+
+            self.by_name[status['name']] = status
+            self.by_state.setdefault(status.get('state'), {})[status['name']] = status
+            for fingerprint in self._fingerprints(status):
+                self.by_fingerprint[fingerprint] = status
+
+
+    def discard(self, node_fqdn):
+        """
+        Remove a certificate from the index, if present
+        """
+        status = self.by_name.pop(node_fqdn, None)
+        if status is None:
+            return
+
+        self.by_state.get(status.get('state'), {}).pop(node_fqdn, None)
+        for fingerprint in self._fingerprints(status):
+            self.by_fingerprint.pop(fingerprint, None)
+
+
+    def get(self, node_fqdn):
+        """
+        Status of a certificate, {} when unknown (same as PuppetCa.status)
+        """
+        return self.by_name.get(node_fqdn, {})
+
+
+    def state(self, state):
+        """
+        Statuses of certificates in the given state ('requested', 'signed', 'revoked')
+        """
+        return list(self.by_state.get(state, {}).values())
+
+
+    def fingerprint(self, fingerprint):
+        """
+        Status of the certificate matching a fingerprint (any digest), {} when unknown
+        """
+        return self.by_fingerprint.get(fingerprint.upper(), {})
+
+
+    def __contains__(self, node_fqdn):
+        return node_fqdn in self.by_name
+
+
+    def __len__(self):
+        return len(self.by_name)
+
+
+    @staticmethod
+    def _fingerprints(status):
+        fingerprints = set(status.get('fingerprints', {}).values())
+        if status.get('fingerprint'):
+            fingerprints.add(status['fingerprint'])
+        return fingerprints
+
+
 class PuppetCa(PuppetBaseAPI):
     """
     PuppetCA endpoint exposing methodes for node decommission.
+
+    status_cache_ttl: cache status() results for this many seconds, 0 to disable.
+        sign, revoke, delete and submit_csr invalidate the node entry.
+    status_cache_size: max number of cached statuses
+
+    With several servers, calls go to the first one which can be reached: the others are standbys.
     """
     def __init__(self, server,
                  scheme='https', port=8140,
-                 ca_cert_path='', client_cert_path='', client_key_path=''):
+                 ca_cert_path='', client_cert_path='', client_key_path='',
+                 status_cache_ttl=0, status_cache_size=1024,
+                 **kwargs):
         super().__init__(
             server=server,
             port=port,
             scheme=scheme,
             ca_cert_path=ca_cert_path,
             client_cert_path=client_cert_path,
-            client_key_path=client_key_path
+            client_key_path=client_key_path,
+            **kwargs
         )
         self.uri = '{scheme}://{server}:{port}'.format(
             scheme=self.scheme,
@@ -34,23 +125,37 @@ class PuppetCa(PuppetBaseAPI):
             port=self.port
         )
 
+        # Last downloaded CRL, see crl()
+        self.revocation_list = None
+
+        self.status_cache = None
+        if status_cache_ttl:
+            self.status_cache = TTLCache(ttl=status_cache_ttl, maxsize=status_cache_size)
+
+
+    def _invalidate(self, node_fqdn):
+        self._forget(('status', node_fqdn))
+        if self.status_cache is not None:
+            self.status_cache.invalidate(node_fqdn)
+
 
     # === Certifiate Status
     #
     # https://puppet.com/docs/puppet/4.10/http_api/http_certificate_status.html
     #
-    def delete(self, node_fqdn):
+    def delete(self, node_fqdn, timeout=None):
         """
         Delete a node certificate
         """
         url = '{}/puppet-ca/v1/certificate_status/{}'.format(self.uri, node_fqdn)
         self.logger.debug("{}: URL={}".format(__name__, url))
 
-        response = self.session.delete(url)
+        response = self.session.delete(url, timeout=timeout)
+        self._invalidate(node_fqdn)
         return bool(response.status_code in [200, 202, 204,])
 
 
-    def revoke(self, node_fqdn):
+    def revoke(self, node_fqdn, timeout=None):
         """
         Revoke a node certificate
         """
@@ -64,12 +169,13 @@ class PuppetCa(PuppetBaseAPI):
 
         response = self.session.put(
             url,
-            headers=headers, data=data
+            headers=headers, data=data, timeout=timeout
         )
+        self._invalidate(node_fqdn)
         return bool(response.status_code in [200, 204,])
 
 
-    def sign(self, node_fqdn):
+    def sign(self, node_fqdn, timeout=None):
         """
         Sign a node certificate request
         """
@@ -83,41 +189,101 @@ class PuppetCa(PuppetBaseAPI):
 
         response = self.session.put(
             url,
-            headers=headers, data=data
+            headers=headers, data=data, timeout=timeout
         )
+        self._invalidate(node_fqdn)
         return bool(response.status_code in [200, 204,])
 
 
-    def status(self, node_fqdn):
+    def status(self, node_fqdn, timeout=None):
         """
         Get the status of a node certificate
         """
+        if self.status_cache is not None:
+            status = self.status_cache.get(node_fqdn)
+            if status is not None:
+                return status
+
+        return self._coalesced(('status', node_fqdn), self._status, node_fqdn, timeout)
+
+
+    def _status(self, node_fqdn, timeout=None):
         url = '{}/puppet-ca/v1/certificate_status/{}'.format(self.uri, node_fqdn)
         self.logger.debug("{}: URL={}".format(__name__, url))
 
+        # Writes invalidating the node while the answer is in flight make it outdated
+        generation = self.status_cache.generation() if self.status_cache is not None else None
         try:
-            response = self.session.get(url, verify=False)
-        except ConnectionError as e:
+            response = self.session.get(url, verify=False, timeout=timeout)
+        except (ConnectionError, Timeout) as e:
             self.logger.error("{}: {}".format(__name__, e))
-            raise PuppetCaException
+            raise PuppetCaException(e)
 
+        status = {}
         if response.status_code == 200:
-            return response.json()
-        return {}
+            status = response.json()
+        elif response.status_code != 404:
+            # Do not cache server errors
+            return status
+
+        if self.status_cache is not None:
+            self.status_cache.set(node_fqdn, status, generation)
+        return status
+
+
+    def statuses(self, state=None, timeout=None):
+        """
+        Get the status of all certificates, in one request
+
+        state: optional server side filter ('requested', 'signed', 'revoked')
+        Raises PuppetCaException when the CA answers with an error
+        """
+        # The key is required by the API but ignored
+        url = '{}/puppet-ca/v1/certificate_statuses/any_key'.format(self.uri)
+        self.logger.debug("{}: URL={}".format(__name__, url))
+
+        params = {}
+        if state:
+            params['state'] = state
+
+        generation = self.status_cache.generation() if self.status_cache is not None else None
+        try:
+            response = self.session.get(url, params=params, verify=False, timeout=timeout)
+        except (ConnectionError, Timeout) as e:
+            self.logger.error("{}: {}".format(__name__, e))
+            raise PuppetCaException(e)
+
+        # An error must not look like an empty CA
+        if response.status_code != 200:
+            self.logger.error("{}: {} {}".format(__name__, response.status_code, response.text))
+            raise PuppetCaException
+
+        statuses = response.json()
+        if self.status_cache is not None:
+            for status in statuses:
+                self.status_cache.set(status['name'], status, generation)
+        return statuses
+
+
+    def index(self, state=None, timeout=None):
+        """
+        Get the status of all certificates as a PuppetCaIndex
+        """
+        return PuppetCaIndex(self.statuses(state=state, timeout=timeout))
 
 
     # === Certifiate
     #
     # https://puppet.com/docs/puppet/4.10/http_api/http_certificate.html
     #
-    def get_cert(self, node_fqdn):
+    def get_cert(self, node_fqdn, timeout=None):
         """
         Get a certificate
         """
         url = '{}/puppet-ca/v1/certificate/{}'.format(self.uri, node_fqdn)
         self.logger.debug("{}: URL={}".format(__name__, url))
 
-        response = self.session.get(url, verify=False)
+        response = self.session.get(url, verify=False, timeout=timeout)
 
         # The returned certificate is always in the .pem format.
         # Other messages are plain text
@@ -128,21 +294,21 @@ class PuppetCa(PuppetBaseAPI):
     #
     # https://puppet.com/docs/puppet/4.10/http_api/http_certificate_request.html
     #
-    def get_csr(self, node_fqdn):
+    def get_csr(self, node_fqdn, timeout=None):
         """
         Get a certificate request
         """
         url = '{}/puppet-ca/v1/certificate_request/{}'.format(self.uri, node_fqdn)
         self.logger.debug("{}: URL={}".format(__name__, url))
 
-        response = self.session.get(url, verify=False)
+        response = self.session.get(url, verify=False, timeout=timeout)
 
         # The returned certificate is always in the .pem format.
         # Other messages are plain text
         return response.text
 
 
-    def submit_csr(self, node_fqdn, csr):
+    def submit_csr(self, node_fqdn, csr, timeout=None):
         """
         Submit a certificate request
         """
@@ -155,22 +321,79 @@ class PuppetCa(PuppetBaseAPI):
 
         response = self.session.put(
             url,
-            headers=headers, data=csr
+            headers=headers, data=csr, timeout=timeout
         )
+        self._invalidate(node_fqdn)
         self.logger.debug("{}: response.code = {}".format(__name__, response.status_code))
         self.logger.debug("{}: response.text = {}".format(__name__, response.text))
         return bool(response.status_code in [200, 204,])
 
 
-    def delete_csr(self, node_fqdn):
+    def delete_csr(self, node_fqdn, timeout=None):
         """
         Delete a certificate request
         """
         url = '{}/puppet-ca/v1/certificate_request/{}'.format(self.uri, node_fqdn)
         self.logger.debug("{}: URL={}".format(__name__, url))
 
-        response = self.session.delete(url, verify=False)
+        response = self.session.delete(url, verify=False, timeout=timeout)
 
         # The returned certificate is always in the .pem format.
         # Other messages are plain text
         return response.text
+
+
+    # === Certificate Revocation List
+    #
+    # https://puppet.com/docs/puppet/4.10/http_api/http_certificate_revocation_list.html
+    #
+    def crl(self, refresh=True, timeout=None):
+        """
+        Get the CA CRL as a RevocationList
+
+        The CRL is only downloaded again when modified (If-Modified-Since),
+        refresh=False returns the last downloaded CRL without any request.
+        """
+        if self.revocation_list is not None and not refresh:
+            return self.revocation_list
+
+        url = '{}/puppet-ca/v1/certificate_revocation_list/ca'.format(self.uri)
+        self.logger.debug("{}: URL={}".format(__name__, url))
+
+        headers = {
+            'Accept': 'text/plain'
+        }
+        if self.revocation_list is not None and self.revocation_list.last_modified:
+            headers['If-Modified-Since'] = self.revocation_list.last_modified
+
+        try:
+            response = self.session.get(url, headers=headers, verify=False, timeout=timeout)
+        except (ConnectionError, Timeout) as e:
+            self.logger.error("{}: {}".format(__name__, e))
+            raise PuppetCaException(e)
+
+        if response.status_code == 304:
+            self.logger.debug("{}: CRL not modified".format(__name__))
+            return self.revocation_list
+
+        if response.status_code != 200:
+            self.logger.error("{}: {} {}".format(__name__, response.status_code, response.text))
+            raise PuppetCaException
+
+        revocation_list = RevocationList.from_pem(response.content)
+        revocation_list.last_modified = response.headers.get('Last-Modified') or format_datetime(
+            revocation_list.last_update.replace(tzinfo=timezone.utc), usegmt=True
+        )
+        self.revocation_list = revocation_list
+        return revocation_list
+
+
+    def is_revoked(self, serial_or_cert):
+        """
+        Check a serial number or certificate against the local CRL copy, without any request
+
+        The CRL is downloaded on first call, call crl() to refresh it.
+        """
+        if self.revocation_list is None:
+            self.crl()
+        return self.revocation_list.is_revoked(serial_or_cert)
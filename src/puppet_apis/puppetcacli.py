@@ -3,15 +3,17 @@ PuppetCaCli file
 """
 import logging
 import os
+import random
 import re
+import time
 #import sys
 
- # Disable warning messages when 'verify=False'
-import urllib3
-urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
 
 from OpenSSL import crypto, SSL
-from puppet_apis import PuppetCa, PuppetCaException
+from .puppetca import PuppetCa, PuppetCaException
+from .keypool import generate_private_key
 
 
 # == Helpers
@@ -21,16 +23,99 @@ class PuppetCaCliException(Exception):
     pass
 
 
+def create_csr(nodename, key, san=[]):
+    """
+    Create a CSR for 'nodename', signed with 'key'
+    """
+    req = crypto.X509Req()
+    req.get_subject().CN = nodename
+
+    # Add in extensions
+    # added bytearray to string
+    # before -> "keyUsage"
+    # after  -> b"keyUsage"
+    #
+    # base_constraints = ([
+    #     crypto.X509Extension(b"keyUsage", False, b"Digital Signature, Key Encipherment"),
+    #     crypto.X509Extension(b"extendedKeyUsage", False, b"TLS Web Server Authentication, TLS Web Client Authentication"),
+    #     crypto.X509Extension(b"basicConstraints", False, b"CA:FALSE"),
+    # ])
+
+    # Appends SAN to have 'DNS:'
+    ss = ", ".join("DNS: %s" % i for i in san)
+    # If there are SAN entries, append the base_constraints to include them.
+    if ss:
+        san_constraint = crypto.X509Extension(b"subjectAltName", False, ss.encode())
+        req.add_extensions([san_constraint])
+
+    req.set_pubkey(key)
+    req.sign(key, "sha256")
+    return req
+
+
+def _generate_csr_pem(nodename, san, key_type, key_size, key_pem=None):
+    # Runs in a worker process: key generation + CSR, as PEM bytes
+    if key_pem:
+        key = crypto.load_privatekey(crypto.FILETYPE_PEM, key_pem)
+    else:
+        key = generate_private_key(key_type, key_size)
+        key_pem = crypto.dump_privatekey(crypto.FILETYPE_PEM, key)
+
+    req = create_csr(nodename, key, san)
+    return key_pem, crypto.dump_certificate_request(crypto.FILETYPE_PEM, req)
+
+
+def read_hostnames(stream):
+    """
+    Parse hostnames from a file like object, one per line, followed by its SANs:
+
+        # hostname [san ...]
+        node01.mydomain.com node01 node01.otherdomain.com
+
+    Yields (hostname, [san, ...]) tuples
+    """
+    for line in stream:
+        line = line.split('#', 1)[0].split()
+        if line:
+            yield line[0], line[1:]
+
+
+# Commands accepted by PuppetCaCli.batch()
+BATCH_COMMANDS = ('status', 'sign', 'revoke', 'delete', 'get')
+
+
+def read_commands(stream):
+    """
+    Parse batch commands from a file like object, one per line:
+
+        # command hostname
+        sign node01.mydomain.com
+
+    Yields (line number, command, hostname) tuples, hostname is None when missing
+    """
+    for number, line in enumerate(stream, 1):
+        line = line.split('#', 1)[0].split()
+        if line:
+            yield number, line[0].lower(), (line[1] if len(line) > 1 else None)
+
+
 class PuppetCaCli:
-    def __init__(self, config):
+    def __init__(self, config, key_pool=None):
         self.logger = logging.getLogger('puppet-ca-cli')
 
+        # Optional KeyPool of pre-generated keys
+        self.key_pool = key_pool
+
         try:
             #self.cafile   = config['ssl']['ca_cert']
             self.certfile = config['ssl']['client_cert']
             self.keyfile  = config['ssl']['client_key']
             self.client_name  = config['ssl']['client_name']
 
+            # Key algorithm: 'rsa' or 'ec', and RSA bits or EC curve ('P-256', 'P-384')
+            self.key_type = config['ssl'].get('key_type') or 'rsa'
+            self.key_size = config['ssl'].get('key_size') or None
+
             self.server = config['puppetserver']['server']
             self.port = config['puppetserver']['port']
 
@@ -59,7 +144,7 @@ class PuppetCaCli:
      # == Helpers
      #
     # Generate Certificate Signing Request (CSR)
-    def generate_csr(self, nodename, san=[], ssl_dir=''):
+    def generate_csr(self, nodename, san=[], ssl_dir='', key_type=None, key_size=None):
         self.logger.info("---> Generating CSR file for {}".format(nodename))
 
         if ssl_dir:
@@ -87,45 +172,19 @@ class PuppetCaCli:
         # O  = 'Organization'
         # OU = 'Organizational Unit'
         #
-        TYPE_RSA = crypto.TYPE_RSA
+        key_type = key_type or self.key_type
+        key_size = key_size or self.key_size
 
-        req = crypto.X509Req()
         self.logger.info("    * Adding subject Name: {}".format(nodename))
-        req.get_subject().CN = nodename
-
-        # Add in extensions
-        # added bytearray to string
-        # before -> "keyUsage"
-        # after  -> b"keyUsage"
-        #
-        # logger.info("    * Adding constraints")
-        # base_constraints = ([
-        #     crypto.X509Extension(b"keyUsage", False, b"Digital Signature, Key Encipherment"),
-        #     crypto.X509Extension(b"extendedKeyUsage", False, b"TLS Web Server Authentication, TLS Web Client Authentication"),
-        #     crypto.X509Extension(b"basicConstraints", False, b"CA:FALSE"),
-        # ])
-        # x509_extensions = base_constraints
-
-        # Appends SAN to have 'DNS:'
-        ss = []
         for i in san:
             self.logger.info("     * Adding Alternate Name: {}".format(i))
-            ss.append("DNS: %s" % i)
-        ss = ", ".join(ss)
-        # If there are SAN entries, append the base_constraints to include them.
-        if ss:
-            san_constraint = crypto.X509Extension(b"subjectAltName", False, ss)
-            #x509_extensions.append(san_constraint)
-            req.add_extensions(san_constraint)
-        #req.add_extensions(x509_extensions)
 
         # Utilizes generate_key function to kick off key generation.
-        key = self.generate_key(TYPE_RSA, 2048)
+        key = self.generate_key(key_type, key_size)
         if not self.generate_files(key_file, key):
             return False
 
-        req.set_pubkey(key)
-        req.sign(key, "sha256")
+        req = create_csr(nodename, key, san)
         if not self.generate_files(csr_file, req):
             return False
 
@@ -133,11 +192,16 @@ class PuppetCaCli:
 
 
     # Generate Private Key
+    # type: 'rsa', 'ec' or crypto.TYPE_*, bits: RSA bits or EC curve
     def generate_key(self, type, bits):
+        if self.key_pool is not None and self.key_pool.matches(type, bits):
+            key = self.key_pool.get()
+            if key is not None:
+                self.logger.info("---> Using pre-generated Key")
+                return key
+
         self.logger.info("---> Generating Key")
-        key = crypto.PKey()
-        key.generate_key(type, bits)
-        return key
+        return generate_private_key(type, bits)
 
 
     # Generate files.
@@ -268,6 +332,62 @@ class PuppetCaCli:
             raise PuppetCaCliException
 
 
+    def wait_signed(self, hostnames, ssl_dir='', timeout=300, initial_delay=1, max_delay=30):
+        """
+        Wait for certificates to be signed, and download each one as soon as it is
+
+        Only the statuses of the hosts not signed yet are polled, with an exponential
+        backoff and jitter between rounds: the cost does not depend on the CA size.
+
+        Returns {hostname: True if downloaded, False if not signed before the timeout}
+        """
+        pending = set(hostnames)
+        results = dict.fromkeys(pending, False)
+        deadline = time.monotonic() + timeout
+        delay = initial_delay
+        ca_downloaded = False
+
+        self.logger.info("---> Waiting for {} certificate(s) to be signed (timeout: {}s)".format(len(pending), timeout))
+        while pending:
+            signed = self._signed(pending)
+            for hostname in sorted(signed):
+                if not ca_downloaded:
+                    self.logger.info("     * Downloading CA Certficate")
+                    ca_downloaded = self.download_cert('ca', ssl_dir=ssl_dir)
+
+                self.logger.info("     * Downloading client Certficate: {}".format(hostname))
+                results[hostname] = self.download_cert(hostname, ssl_dir=ssl_dir)
+                pending.discard(hostname)
+
+            remaining = deadline - time.monotonic()
+            if not pending or remaining <= 0:
+                break
+
+            self.logger.info("     * {} certificate(s) not yet signed, next check in {}s".format(len(pending), delay))
+            time.sleep(min(random.uniform(delay / 2, delay), remaining))
+            delay = min(delay * 2, max_delay)
+
+        for hostname in sorted(pending):
+            self.logger.warning("     * Certficiate is not yet signed: {}".format(hostname))
+        return results
+
+
+    def _signed(self, hostnames, workers=10):
+        # One status request per pending host, concurrent ones are coalesced by PuppetCa
+        hostnames = sorted(hostnames)
+        with ThreadPoolExecutor(max_workers=min(workers, len(hostnames))) as pool:
+            states = pool.map(self._state, hostnames)
+            return set(hostname for hostname, state in zip(hostnames, states) if state == 'signed')
+
+
+    def _state(self, hostname):
+        try:
+            return self.puppet_ca_client.status(hostname).get('state')
+        except PuppetCaException:
+            # Polled again next round
+            return None
+
+
     # == CLI Commands
     #
     # === Config
@@ -284,7 +404,13 @@ class PuppetCaCli:
         return True
 
 
-    def install(self, hostname):
+    def install(self, hostname, wait=False, timeout=300):
+        if wait:
+            if self.wait_signed([hostname], timeout=timeout)[hostname]:
+                return True
+            self.display_puppetserver_commands(hostname)
+            return False
+
         # Get status of certificate
         cert_status = self.status(hostname)
         if 'state' in cert_status and cert_status['state'] == 'signed':
@@ -316,10 +442,82 @@ class PuppetCaCli:
         return True
 
 
-    def get(self, hostname, ssldir):
+    def generate_bulk(self, hosts, ssldir, processes=None, workers=10):
+        """
+        Generate and submit CSRs for many hosts
+
+        hosts: iterable of (hostname, [san, ...]), see read_hostnames()
+        processes: key + CSR generation processes, default to the number of CPUs
+        workers: concurrent CSR submissions, on the PuppetCa connection pool
+
+        Yields one result per host, as soon as it is done:
+            {'hostname': 'node01.mydomain.com', 'generated': True, 'submitted': True, 'error': None}
+        """
+        with ProcessPoolExecutor(max_workers=processes) as process_pool, \
+             ThreadPoolExecutor(max_workers=workers) as submit_pool:
+
+            generating = {}
+            for hostname, san in hosts:
+                key_file = os.path.join(ssldir, "private_keys/{}.pem".format(hostname))
+
+                # Reuse an existing key, the CSR must match it
+                key_pem = None
+                if os.path.exists(key_file) and os.path.getsize(key_file) != 0:
+                    with open(key_file, "rb") as f:
+                        key_pem = f.read()
+
+                future = process_pool.submit(_generate_csr_pem, hostname, san,
+                                             self.key_type, self.key_size, key_pem)
+                generating[future] = hostname
+
+            submitting = {}
+            pending = set(generating)
+            while pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    # CSR submitted
+                    if future in submitting:
+                        result = submitting.pop(future)
+                        try:
+                            result['submitted'] = future.result()
+                        except Exception as e:
+                            self.logger.error("{}: CSR submission failed: {}".format(result['hostname'], e))
+                            result['error'] = repr(e)
+                        yield result
+                        continue
+
+                    # CSR generated
+                    hostname = generating.pop(future)
+                    result = {'hostname': hostname, 'generated': False, 'submitted': False, 'error': None}
+                    try:
+                        key_pem, csr_pem = future.result()
+                        key_file = os.path.join(ssldir, "private_keys/{}.pem".format(hostname))
+                        csr_file = os.path.join(ssldir, "certificate_request/{}.pem".format(hostname))
+                        result['generated'] = (
+                            self.generate_files(key_file, crypto.load_privatekey(crypto.FILETYPE_PEM, key_pem)) and
+                            self.generate_files(csr_file, crypto.load_certificate_request(crypto.FILETYPE_PEM, csr_pem))
+                        )
+                    except Exception as e:
+                        self.logger.error("{}: CSR generation failed: {}".format(hostname, e))
+                        result['error'] = repr(e)
+
+                    if not result['generated']:
+                        yield result
+                        continue
+
+                    # Submission is pipelined with the generation of the next CSRs
+                    submit = submit_pool.submit(self.puppet_ca_client.submit_csr, hostname, csr_pem.decode())
+                    submitting[submit] = result
+                    pending.add(submit)
+
+
+    def get(self, hostname, ssldir, wait=False, timeout=300, raise_errors=False):
+        if wait:
+            return self.wait_signed([hostname], ssl_dir=ssldir, timeout=timeout)[hostname]
+
         # Get status of certificate
-        cert_status = self.status(hostname)
-        if 'state' in cert_status and cert_status['state'] == 'signed':
+        cert_status = self.status(hostname, raise_errors=raise_errors)
+        if cert_status and cert_status.get('state') == 'signed':
             self.logger.info("     * Downloading CA Certficate")
             self.download_cert('ca', ssl_dir=ssldir)
 
@@ -333,9 +531,10 @@ class PuppetCaCli:
         return False
 
 
-    def sign(self, hostname):
-        cert_status = self.status(hostname)
-        if 'state' in cert_status and cert_status['state'] == 'pending':
+    def sign(self, hostname, raise_errors=False):
+        cert_status = self.status(hostname, raise_errors=raise_errors)
+        # Unknown hosts: False, CA errors: None
+        if cert_status and cert_status.get('state') == 'requested':
             self.logger.info("     * Signing certficate")
             return bool( self.puppet_ca_client.sign(hostname) )
 
@@ -343,7 +542,30 @@ class PuppetCaCli:
         return False
 
 
-    def status(self, hostname):
+    def revoke(self, hostname):
+        self.logger.info("---> Revoking certificate")
+        if self.puppet_ca_client.revoke(hostname):
+            self.logger.info("SUCCESS")
+            return True
+
+        self.logger.error("FAILED")
+        return False
+
+
+    def delete(self, hostname):
+        self.logger.info("---> Deleting certificate")
+        if self.puppet_ca_client.delete(hostname):
+            self.logger.info("SUCCESS")
+            return True
+
+        self.logger.error("FAILED")
+        return False
+
+
+    def status(self, hostname, raise_errors=False):
+        """
+        raise_errors: raise PuppetCaException when the CA can not be reached, instead of returning None
+        """
         self.logger.info("---> Checking certificate status")
 
         try:
@@ -357,4 +579,67 @@ class PuppetCaCli:
             return False
 
         except PuppetCaException:
-            pass
+            if raise_errors:
+                raise
+
+
+    # === Batch
+    #
+    def batch(self, commands, ssldir='', workers=1, deadline=None):
+        """
+        Run many commands over this instance, and its CA connection pool
+
+        commands: iterable of (line number, command, hostname), see read_commands(),
+            consumed as results are yielded: at most 'workers' * 2 commands are queued
+        workers: commands run concurrently, results are still yielded in order
+        deadline: puppet_apis.deadline.Deadline, commands not started when it expires
+            are not run, and reported with a 'DeadlineExceeded' error
+
+        Yields one result per command:
+            {'line': 1, 'command': 'sign', 'hostname': 'node01.mydomain.com', 'ok': True, 'result': True, 'error': None}
+        """
+        if workers <= 1:
+            # Lazy: commands can be streamed (stdin)
+            for command in commands:
+                yield self._batch_command(command, ssldir, deadline)
+            return
+
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            window = deque()
+            for command in commands:
+                window.append(pool.submit(self._batch_command, command, ssldir, deadline))
+                if len(window) >= workers * 2:
+                    yield window.popleft().result()
+            while window:
+                yield window.popleft().result()
+
+
+    def _batch_command(self, command, ssldir, deadline=None):
+        line, command, hostname = command
+        result = {'line': line, 'command': command, 'hostname': hostname, 'ok': False, 'result': None, 'error': None}
+
+        if command not in BATCH_COMMANDS:
+            result['error'] = "Unknown command '{}', use one of {}".format(command, ', '.join(BATCH_COMMANDS))
+            return result
+        if not hostname:
+            result['error'] = "Missing hostname"
+            return result
+
+        try:
+            if deadline is not None:
+                deadline.check(command)
+            # CA errors are reported, not taken for a missing certificate
+            if command == 'get':
+                value = self.get(hostname, ssldir, raise_errors=True)
+            elif command in ('status', 'sign'):
+                value = getattr(self, command)(hostname, raise_errors=True)
+            else:
+                value = getattr(self, command)(hostname)
+        except Exception as e:
+            self.logger.error("{}: {} failed: {}".format(hostname, command, e))
+            result['error'] = repr(e)
+            return result
+
+        result['ok'] = bool(value)
+        result['result'] = value or None
+        return result
@@ -3,23 +3,79 @@ import json
 from time import altzone, localtime, timezone
 from datetime import datetime, timedelta, timezone as dt_timezone
 
+from .backpressure import CommandBackpressure
+from .deadline import Deadline, split_timeout
 from .puppetbase import PuppetBaseAPI
+from .jsonstream import iter_json_array
+
+
+class PuppetDbException(Exception):
+    pass
+
+
+# Compact encoder for command payloads
+_command_encoder = json.JSONEncoder(separators=(',', ':'))
+
+# Max certnames, and their encoded size in bytes, per batched node lookup:
+# well under PuppetDB (Jetty) request size limits
+LOOKUP_CHUNK_SIZE = 1000
+LOOKUP_MAX_SIZE = 65536
+
+
+def chunk_certnames(certnames, chunk_size=LOOKUP_CHUNK_SIZE, max_size=LOOKUP_MAX_SIZE):
+    """
+    Split certnames in lists of at most 'chunk_size' names, and 'max_size' bytes once JSON encoded
+    """
+    chunk, size = [], 0
+    for certname in certnames:
+        # Quoted name and separator
+        length = len(_command_encoder.encode(certname)) + 1
+        if chunk and (len(chunk) >= chunk_size or size + length > max_size):
+            yield chunk
+            chunk, size = [], 0
+        chunk.append(certname)
+        size += length
+    if chunk:
+        yield chunk
+
+
+def producer_timestamp():
+    """
+    Local time as an ISO 8601 string, as expected by PuppetDB commands
+    """
+    # calculate the offset taking into account daylight saving time
+    utc_offset_sec = altzone if localtime().tm_isdst else timezone
+    offset = timedelta(seconds=utc_offset_sec)
+    tzinfo = dt_timezone(offset=offset)
+    return datetime.now().replace(tzinfo=tzinfo, microsecond=0).isoformat()
 
 
 class PuppetDb(PuppetBaseAPI):
     """
     A PuppetDB endpoint exposing methodes for node decommission.
+
+    max_queue_depth: pause command submission while PuppetDB command queue is deeper, None to disable.
+        Submission resumes below half of it. See puppet_apis.backpressure.CommandBackpressure
+    queue_check_interval: seconds between two queue depth readings
+
+    With several servers, queries are spread across them and commands go to the primary only.
     """
+    READ_PREFIXES = ('/pdb/query/',)
+    FAILOVER = False
+
     def __init__(self, server,
                  scheme='http', port=8080,
-                 ca_cert_path='', client_cert_path='', client_key_path=''):
+                 ca_cert_path='', client_cert_path='', client_key_path='',
+                 max_queue_depth=None, queue_check_interval=5,
+                 **kwargs):
         super().__init__(
             server=server,
             port=port,
             scheme=scheme,
             ca_cert_path=ca_cert_path,
             client_cert_path=client_cert_path,
-            client_key_path=client_key_path
+            client_key_path=client_key_path,
+            **kwargs
         )
         self.uri = '{scheme}://{server}:{port}'.format(
             scheme=self.scheme,
@@ -27,21 +83,191 @@ class PuppetDb(PuppetBaseAPI):
             port=self.port
         )
 
+        self.backpressure = None
+        if max_queue_depth is not None:
+            self.backpressure = CommandBackpressure(self, max_depth=max_queue_depth, interval=queue_check_interval)
 
-    def status(self, node_fqdn):
+
+    def status(self, node_fqdn, timeout=None):
         """
         Get the status of a node certificate
         """
+        return self._coalesced(('status', node_fqdn), self._status, node_fqdn, timeout)
+
+
+    def _status(self, node_fqdn, timeout=None):
         url = '{}/pdb/query/v4/nodes/{}'.format(self.uri, node_fqdn)
         self.logger.debug("{}: URL={}".format(__name__, url))
 
-        response = self.session.get(url, verify=False)
+        response = self.session.get(url, verify=False, timeout=timeout)
+        # 404: PuppetDB error message, about the unknown node
+        if response.status_code not in (200, 404):
+            self.logger.error("{}: {} {}".format(__name__, response.status_code, response.text))
+            raise PuppetDbException(response.text)
         return response.json()
 
 
-    def deactivate(self, node_fqdn):
+    def statuses(self, node_fqdns, chunk_size=LOOKUP_CHUNK_SIZE, max_size=LOOKUP_MAX_SIZE, timeout=None):
         """
-        Deactivate a node
+        Get many nodes in a few requests: certnames are looked up by chunks,
+        with ["in", "certname", ["array", [...]]] queries sent in the request body
+
+        chunk_size / max_size: max certnames, and their encoded size in bytes, per request
+
+        Returns {fqdn: node, or None when PuppetDB does not know the node}, deactivated nodes included
+        """
+        url = '{}/pdb/query/v4/nodes'.format(self.uri)
+        self.logger.debug("{}: URL={}".format(__name__, url))
+
+        # Without duplicates, in order
+        nodes = dict.fromkeys(node_fqdns)
+        for chunk in chunk_certnames(nodes, chunk_size, max_size):
+            query = ['and', ['=', 'node_state', 'any'], ['in', 'certname', ['array', chunk]]]
+            data = _command_encoder.encode({'query': query})
+            headers = {
+                'Content-Type': 'application/json'
+            }
+            with self.session.post(url, data=data, headers=headers, stream=True, verify=False,
+                                   timeout=timeout) as response:
+                if response.status_code != 200:
+                    self.logger.error("{}: {} {}".format(__name__, response.status_code, response.text))
+                    raise PuppetDbException(response.text)
+
+                for node in iter_json_array(response.iter_content(chunk_size=65536)):
+                    if node['certname'] in nodes:
+                        nodes[node['certname']] = node
+
+        self.logger.debug("{}: {} nodes, {} unknown".format(
+            __name__, len(nodes), sum(node is None for node in nodes.values())))
+        return nodes
+
+
+    # === Query
+    #
+    # https://puppet.com/docs/puppetdb/5.2/api/query/v4/paging.html
+    #
+    def query(self, endpoint, query=None, order_by=None, page_size=1000, timeout=None):
+        """
+        Iterate over the results of a PuppetDB query
+
+        Pages are fetched with limit/offset, and each page is decoded while
+        it is received: memory use does not depend on the number of results.
+
+        endpoint: 'nodes', 'facts', 'fact-contents', 'resources'...
+        query: AST query, e.g. ["=", "name", "os"]
+        order_by: list of fields, e.g. [{"field": "certname", "order": "asc"}].
+            Required for a stable paging.
+        page_size: results per request, None to fetch all results in one request
+        """
+        url = '{}/pdb/query/v4/{}'.format(self.uri, endpoint)
+        self.logger.debug("{}: URL={}".format(__name__, url))
+
+        params = {}
+        if query:
+            params['query'] = json.dumps(query)
+        if order_by:
+            params['order_by'] = json.dumps(order_by)
+
+        offset = 0
+        while True:
+            if page_size:
+                params['limit'] = page_size
+                params['offset'] = offset
+            self.logger.debug("{}: params={}".format(__name__, params))
+
+            count = 0
+            with self.session.get(url, params=params, stream=True, verify=False, timeout=timeout) as response:
+                if response.status_code != 200:
+                    self.logger.error("{}: {} {}".format(__name__, response.status_code, response.text))
+                    raise PuppetDbException(response.text)
+
+                for item in iter_json_array(response.iter_content(chunk_size=65536)):
+                    count += 1
+                    yield item
+
+            if not page_size or count < page_size:
+                return
+            offset += page_size
+
+
+    def query_nodes(self, query=None, order_by=None, page_size=1000, timeout=None):
+        """
+        Iterate over nodes
+        """
+        order_by = order_by or [{"field": "certname"}]
+        return self.query('nodes', query=query, order_by=order_by, page_size=page_size, timeout=timeout)
+
+
+    def query_facts(self, query=None, order_by=None, page_size=1000, timeout=None):
+        """
+        Iterate over facts
+        """
+        order_by = order_by or [{"field": "certname"}, {"field": "name"}]
+        return self.query('facts', query=query, order_by=order_by, page_size=page_size, timeout=timeout)
+
+
+    def query_fact_contents(self, query=None, order_by=None, page_size=1000, timeout=None):
+        """
+        Iterate over fact contents (structured facts leaves)
+        """
+        order_by = order_by or [{"field": "certname"}, {"field": "path"}]
+        return self.query('fact-contents', query=query, order_by=order_by, page_size=page_size, timeout=timeout)
+
+
+    def query_resources(self, query=None, order_by=None, page_size=1000, timeout=None):
+        """
+        Iterate over resources
+        """
+        order_by = order_by or [{"field": "certname"}, {"field": "type"}, {"field": "title"}]
+        return self.query('resources', query=query, order_by=order_by, page_size=page_size, timeout=timeout)
+
+
+    # === Server status
+    #
+    # https://puppet.com/docs/puppetdb/5.2/api/status/v1/status.html
+    # https://puppet.com/docs/puppetdb/5.2/api/metrics/v2/jolokia.html
+    #
+    def queue_depth(self, timeout=None):
+        """
+        Number of commands waiting in PuppetDB command queue
+        """
+        url = '{}/status/v1/services/puppetdb-status'.format(self.uri)
+        self.logger.debug("{}: URL={}".format(__name__, url))
+
+        response = self.session.get(url, verify=False, timeout=timeout)
+        if response.status_code != 200:
+            raise PuppetDbException(response.text)
+        return response.json()['status']['queue_depth']
+
+
+    def command_rate(self, timeout=None):
+        """
+        Commands processed per second, over the last minute
+        """
+        url = '{}/metrics/v2/read/puppetlabs.puppetdb.mq:name=global.processed'.format(self.uri)
+        self.logger.debug("{}: URL={}".format(__name__, url))
+
+        response = self.session.get(url, verify=False, timeout=timeout)
+        # Jolokia answers errors with a 200 and their own status
+        metric = response.json() if response.status_code == 200 else {}
+        if metric.get('status') != 200:
+            raise PuppetDbException(response.text)
+        return metric['value']['OneMinuteRate']
+
+
+    # === Commands
+    #
+    # https://puppet.com/docs/puppetdb/5.2/api/command/v1/commands.html
+    #
+    def submit_command(self, command, version, certname, payload, wait=None, timeout=None):
+        """
+        Submit a command, using the query parameters form: only the payload is sent in the body
+
+        command: e.g. 'deactivate node', 'replace facts', 'store report'
+        wait: seconds to wait for the command to be processed (secondsToWaitForCompletion),
+            added to the default read timeout
+
+        Returns PuppetDB answer, e.g. {"uuid": "..."}
         """
         url = '{}/pdb/cmd/v1'.format(self.uri)
         self.logger.debug("{}: URL={}".format(__name__, url))
@@ -49,25 +275,38 @@ class PuppetDb(PuppetBaseAPI):
         headers = {
             'Content-Type': 'application/json'
         }
-
-        # calculate the offset taking into account daylight saving time
-        utc_offset_sec = altzone if localtime().tm_isdst else timezone
-        offset = timedelta(seconds=utc_offset_sec)
-        tzinfo = dt_timezone(offset=offset)
-        tstamp = datetime.now().replace(tzinfo=tzinfo, microsecond=0).isoformat()
-        self.logger.debug("{}: producer_timestamp={}".format(__name__, tstamp))
-
-        data = {
-          "command": "deactivate node",
-          "version": 3,
-          "payload": {
-              "certname": node_fqdn,
-              "producer_timestamp": tstamp
-          }
+        params = {
+            'command': command.replace(' ', '_'),
+            'version': version,
+            'certname': certname,
         }
+        if wait:
+            params['secondsToWaitForCompletion'] = wait
+            if timeout is None and self.timeout is not None:
+                connect, read = split_timeout(self.timeout)
+                timeout = (connect, None if read is None else read + wait)
+
+        if self.backpressure is not None:
+            self.backpressure.wait(timeout if isinstance(timeout, Deadline) else None)
 
         response = self.session.post(
             url,
-            headers=headers, data=json.dumps(data)
+            params=params, headers=headers, data=_command_encoder.encode(payload),
+            timeout=timeout
         )
+        self._forget(('status', certname))
         return response.json()
+
+
+    def deactivate(self, node_fqdn, timeout=None):
+        """
+        Deactivate a node
+        """
+        tstamp = producer_timestamp()
+        self.logger.debug("{}: producer_timestamp={}".format(__name__, tstamp))
+
+        payload = {
+            "certname": node_fqdn,
+            "producer_timestamp": tstamp
+        }
+        return self.submit_command('deactivate node', 3, node_fqdn, payload, timeout=timeout)
@@ -0,0 +1,76 @@
+"""
+Request coalescing
+
+Concurrent identical calls share one execution: the first caller runs it,
+the others wait for its result, or its exception.
+"""
+import threading
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """
+    Thread safe: at most one call in flight per key
+
+    'coalesced' counts the calls which did not run, and got the result of another one.
+    Callers sharing a result share the same object: do not modify it.
+    """
+    def __init__(self):
+        self.coalesced = 0
+        self._calls = {}
+        self._lock = threading.Lock()
+
+
+    def do(self, key, fn, *args, deadline=None, **kwargs):
+        """
+        Run fn(*args, **kwargs), unless a call for 'key' is already in flight:
+        then wait for it, and return its result or raise its exception
+
+        deadline: puppet_apis.deadline.Deadline, raise DeadlineExceeded instead of waiting
+            for a call in flight past it
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+            else:
+                self.coalesced += 1
+
+        if not leader:
+            while not call.done.wait(None if deadline is None else deadline.remaining()):
+                deadline.check('coalesced call')
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn(*args, **kwargs)
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                if self._calls.get(key) is call:
+                    del self._calls[key]
+            call.done.set()
+
+
+    def forget(self, key):
+        """
+        Next calls for 'key' do not join the call in flight, if any (its result may be outdated)
+        """
+        with self._lock:
+            self._calls.pop(key, None)
+
+
+    def in_flight(self):
+        with self._lock:
+            return len(self._calls)
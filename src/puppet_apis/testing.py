@@ -0,0 +1,610 @@
+"""
+In-memory Puppet CA and PuppetDB emulator
+
+A lightweight HTTP server implementing the endpoints used by puppet_apis,
+for tests and load tests without the docker-compose stack:
+
+* /puppet-ca/v1/certificate_status(es), certificate, certificate_request
+* /pdb/query/v4/nodes, /pdb/cmd/v1
+* /status/v1/services/puppetdb-status, PuppetDB command metrics (queue depth and rate)
+
+Latency, error rate and 503 throttling are configurable:
+
+    with PuppetEmulator(latency=0.005, error_rate=0.01, max_concurrency=50) as emulator:
+        emulator.populate(100000)
+        puppetca = PuppetCa(server=emulator.host, port=emulator.port, scheme='http')
+
+Or standalone: python -m puppet_apis.testing --nodes 100000 --port 8140
+"""
+import argparse
+import hashlib
+import json
+import random
+import threading
+import time
+import uuid
+
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, unquote, urlparse
+
+
+def _now():
+    return datetime.now(timezone.utc).strftime('%Y-%m-%dT%H:%M:%S.%fZ')
+
+
+def _fingerprint(data, algorithm):
+    digest = hashlib.new(algorithm, data.encode()).hexdigest().upper()
+    return ':'.join(digest[i:i + 2] for i in range(0, len(digest), 2))
+
+
+# == PuppetDB query language, subset
+#
+# https://puppet.com/docs/puppetdb/5.2/api/query/v4/ast.html
+#
+def _match(query, record):
+    operator = query[0]
+    if operator == 'and':
+        return all(_match(q, record) for q in query[1:])
+    if operator == 'or':
+        return any(_match(q, record) for q in query[1:])
+    if operator == 'not':
+        return not _match(query[1], record)
+    if operator == '=':
+        return record.get(query[1]) == query[2]
+    if operator == 'in':
+        values = query[2]
+        if values and values[0] == 'array':
+            values = values[1]
+        return record.get(query[1]) in values
+    if operator == 'null?':
+        return (record.get(query[1]) is None) == query[2]
+    raise ValueError("Unsupported query operator '{}'".format(operator))
+
+
+def _node_state(query):
+    # node_state is a filter on the query, not a node field
+    if isinstance(query, list) and query:
+        if query[0] == '=' and query[1] == 'node_state':
+            return query[2]
+        for q in query[1:]:
+            state = _node_state(q)
+            if state:
+                return state
+    return None
+
+
+def _strip_node_state(query):
+    if not isinstance(query, list) or not query:
+        return query
+    if query[0] == '=' and query[1] == 'node_state':
+        return None
+    if query[0] in ('and', 'or'):
+        subqueries = [q for q in (_strip_node_state(q) for q in query[1:]) if q is not None]
+        return [query[0]] + subqueries if subqueries else None
+    return query
+
+
+class PuppetEmulator:
+    """
+    Puppet CA + PuppetDB emulator, state in memory
+
+    latency: seconds added to each request (+ random 0..latency_jitter)
+    error_rate: probability of answering 'error_status' (500)
+    max_concurrency: requests in flight above which 503 is answered, None for no limit
+    command_rate: PuppetDB commands processed per second, None to process them immediately.
+        Otherwise submitted commands wait in 'queue_depth'.
+    """
+    def __init__(self, host='127.0.0.1', port=0,
+                 latency=0.0, latency_jitter=0.0, error_rate=0.0, error_status=500,
+                 max_concurrency=None, command_rate=None, seed=None):
+        self.host = host
+        self.port = port
+
+        self.latency = latency
+        self.latency_jitter = latency_jitter
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.max_concurrency = max_concurrency
+        self.random = random.Random(seed)
+
+        # CA
+        self.certificates = {}
+        self.requests = {}
+        self.statuses = {}
+        self.serial = 1
+        # PuppetDB
+        self.nodes = {}
+        self.commands = []
+        self.command_rate = command_rate
+        self.queue_depth = 0
+        self._drained_at = time.monotonic()
+
+        # Counters
+        self.requests_count = 0
+        self.errors_count = 0
+        self.throttled_count = 0
+        self.in_flight = 0
+
+        self.lock = threading.RLock()
+        self.server = None
+        self.thread = None
+
+
+    # == Server
+    #
+    def start(self):
+        handler = type('PuppetEmulatorHandler', (PuppetEmulatorHandler,), {'emulator': self})
+        self.server = ThreadingHTTPServer((self.host, self.port), handler)
+        self.server.daemon_threads = True
+        self.server.request_queue_size = 1024
+        self.port = self.server.server_port
+
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+
+    def stop(self):
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+
+
+    def __enter__(self):
+        return self.start()
+
+
+    def __exit__(self, exc_type, exc, tb):
+        self.stop()
+
+
+    @property
+    def uri(self):
+        return 'http://{}:{}'.format(self.host, self.port)
+
+
+    # == State
+    #
+    def add_csr(self, name, csr=None):
+        """
+        Add a certificate request, state 'requested'
+        """
+        with self.lock:
+            self.requests[name] = csr or (
+                '-----BEGIN CERTIFICATE REQUEST-----\n{}\n-----END CERTIFICATE REQUEST-----\n'.format(name))
+            self.statuses[name] = {
+                'name': name,
+                'state': 'requested',
+                'dns_alt_names': [],
+                'fingerprint': _fingerprint(self.requests[name], 'sha256'),
+                'fingerprints': {
+                    'SHA1': _fingerprint(self.requests[name], 'sha1'),
+                    'SHA256': _fingerprint(self.requests[name], 'sha256'),
+                    'default': _fingerprint(self.requests[name], 'sha256'),
+                },
+            }
+
+
+    def sign(self, name):
+        """
+        Sign a certificate request
+        """
+        with self.lock:
+            if name not in self.requests:
+                self.add_csr(name)
+            self.requests.pop(name)
+
+            serial = self.serial
+            self.serial += 1
+            self.certificates[name] = (
+                '-----BEGIN CERTIFICATE-----\n{:04X} {}\n-----END CERTIFICATE-----\n'.format(serial, name))
+            fingerprint = _fingerprint(self.certificates[name], 'sha256')
+            self.statuses[name].update({
+                'state': 'signed',
+                'serial': serial,
+                'fingerprint': fingerprint,
+                'fingerprints': {
+                    'SHA1': _fingerprint(self.certificates[name], 'sha1'),
+                    'SHA256': fingerprint,
+                    'default': fingerprint,
+                },
+            })
+
+
+    def add_node(self, name, state='signed', puppetdb=True):
+        """
+        Add a node: certificate ('requested' or 'signed') and PuppetDB node
+        """
+        with self.lock:
+            if state == 'requested':
+                self.add_csr(name)
+            elif state == 'signed':
+                self.sign(name)
+
+            if puppetdb:
+                now = _now()
+                self.nodes[name] = {
+                    'certname': name,
+                    'deactivated': None,
+                    'expired': None,
+                    'catalog_timestamp': now,
+                    'facts_timestamp': now,
+                    'report_timestamp': now,
+                    'catalog_environment': 'production',
+                    'facts_environment': 'production',
+                    'report_environment': 'production',
+                    'latest_report_status': 'unchanged',
+                }
+
+
+    def populate(self, count, prefix='node', domain='mydomain.com', state='signed'):
+        """
+        Add 'count' synthetic nodes: node000001.mydomain.com...
+        """
+        for i in range(count):
+            self.add_node('{}{:06d}.{}'.format(prefix, i, domain), state=state)
+
+
+    def drain(self):
+        """
+        Process queued commands at 'command_rate', returns the queue depth
+        """
+        with self.lock:
+            if not self.command_rate:
+                return self.queue_depth
+
+            now = time.monotonic()
+            processed = int((now - self._drained_at) * self.command_rate)
+            if processed >= self.queue_depth:
+                self.queue_depth = 0
+                self._drained_at = now
+            else:
+                self.queue_depth -= processed
+                self._drained_at += processed / self.command_rate
+            return self.queue_depth
+
+
+    # == Faults
+    #
+    def fault(self):
+        """
+        Apply latency, and return the error code to answer, if any
+        """
+        delay = self.latency
+        if self.latency_jitter:
+            delay += self.random.uniform(0, self.latency_jitter)
+        if delay:
+            time.sleep(delay)
+
+        with self.lock:
+            if self.max_concurrency is not None and self.in_flight > self.max_concurrency:
+                self.throttled_count += 1
+                return 503
+            if self.error_rate and self.random.random() < self.error_rate:
+                self.errors_count += 1
+                return self.error_status
+        return None
+
+
+class PuppetEmulatorHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # Send headers and body in one segment: avoid delayed ACK stalls
+    wbufsize = -1
+    disable_nagle_algorithm = True
+
+    emulator = None
+
+    def log_message(self, *args):
+        pass
+
+
+    def _send(self, code, body='', content_type='application/json', headers=None):
+        if not isinstance(body, str):
+            body = json.dumps(body)
+        body = body.encode()
+
+        self.send_response(code)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+
+    def _body(self):
+        return self.rfile.read(int(self.headers.get('Content-Length', 0))).decode()
+
+
+    def _handle(self, method):
+        emulator = self.emulator
+        url = urlparse(self.path)
+        path = unquote(url.path)
+        params = {k: v[0] for k, v in parse_qs(url.query).items()}
+        body = self._body() if method in ('PUT', 'POST') else ''
+
+        with emulator.lock:
+            emulator.requests_count += 1
+            emulator.in_flight += 1
+        try:
+            code = emulator.fault()
+            if code == 503:
+                return self._send(503, 'Service Unavailable', 'text/plain', {'Retry-After': '1'})
+            if code:
+                return self._send(code, 'Server Error', 'text/plain')
+
+            for prefix, handler in (
+                ('/puppet-ca/v1/certificate_statuses/', self.ca_certificate_statuses),
+                ('/puppet-ca/v1/certificate_status/', self.ca_certificate_status),
+                ('/puppet-ca/v1/certificate_request/', self.ca_certificate_request),
+                ('/puppet-ca/v1/certificate/', self.ca_certificate),
+                ('/pdb/query/v4/nodes', self.pdb_nodes),
+                ('/pdb/cmd/v1', self.pdb_command),
+                ('/status/v1/services/', self.pdb_status),
+                ('/metrics/v2/read/', self.pdb_metrics),
+            ):
+                if path.startswith(prefix):
+                    return handler(method, path[len(prefix):].lstrip('/'), params, body)
+            return self._send(404, 'Not Found', 'text/plain')
+        finally:
+            with emulator.lock:
+                emulator.in_flight -= 1
+
+
+    def do_GET(self):
+        self._handle('GET')
+
+
+    def do_PUT(self):
+        self._handle('PUT')
+
+
+    def do_POST(self):
+        self._handle('POST')
+
+
+    def do_DELETE(self):
+        self._handle('DELETE')
+
+
+    # == Puppet CA
+    #
+    # State is read and changed under the emulator lock, answers are written outside of it:
+    # a slow client does not stall the other requests
+    #
+    def ca_certificate_statuses(self, method, name, params, body):
+        with self.emulator.lock:
+            statuses = [
+                dict(status) for status in self.emulator.statuses.values()
+                if 'state' not in params or status['state'] == params['state']
+            ]
+        return self._send(200, statuses)
+
+
+    def ca_certificate_status(self, method, name, params, body):
+        with self.emulator.lock:
+            response = self._ca_certificate_status(method, name, body)
+        return self._send(*response)
+
+
+    def _ca_certificate_status(self, method, name, body):
+        # Under the emulator lock, returns _send() arguments
+        emulator = self.emulator
+        status = emulator.statuses.get(name)
+        if status is None:
+            return 404, 'Not Found: Could not find certificate {}'.format(name), 'text/plain'
+
+        if method == 'GET':
+            return 200, dict(status)
+
+        if method == 'DELETE':
+            emulator.statuses.pop(name)
+            emulator.certificates.pop(name, None)
+            emulator.requests.pop(name, None)
+            return 204, ''
+
+        if method == 'PUT':
+            desired_state = json.loads(body or '{}').get('desired_state')
+            if desired_state == 'signed' and status['state'] == 'requested':
+                emulator.sign(name)
+                return 204, ''
+            if desired_state == 'revoked' and status['state'] == 'signed':
+                status['state'] = 'revoked'
+                return 204, ''
+            return 409, 'Conflict: can not change {} state to {}'.format(name, desired_state), 'text/plain'
+
+        return 405, 'Method Not Allowed', 'text/plain'
+
+
+    def ca_certificate(self, method, name, params, body):
+        with self.emulator.lock:
+            certificate = self.emulator.certificates.get(name)
+        if method != 'GET' or certificate is None:
+            return self._send(404, 'Not Found: Could not find certificate {}'.format(name), 'text/plain')
+        return self._send(200, certificate, 'text/plain')
+
+
+    def ca_certificate_request(self, method, name, params, body):
+        with self.emulator.lock:
+            response = self._ca_certificate_request(method, name, body)
+        return self._send(*response)
+
+
+    def _ca_certificate_request(self, method, name, body):
+        # Under the emulator lock, returns _send() arguments
+        emulator = self.emulator
+        if method == 'PUT':
+            if emulator.statuses.get(name, {}).get('state') == 'signed':
+                return 400, '{} already has a signed certificate'.format(name), 'text/plain'
+            emulator.add_csr(name, body)
+            return 200, ''
+
+        if name not in emulator.requests:
+            return 404, 'Not Found: Could not find certificate_request {}'.format(name), 'text/plain'
+
+        if method == 'GET':
+            return 200, emulator.requests[name], 'text/plain'
+        if method == 'DELETE':
+            emulator.requests.pop(name)
+            if emulator.statuses.get(name, {}).get('state') == 'requested':
+                emulator.statuses.pop(name)
+            return 204, 'Deleted certificate_request {}'.format(name), 'text/plain'
+
+        return 405, 'Method Not Allowed', 'text/plain'
+
+
+    # == PuppetDB
+    #
+    def pdb_nodes(self, method, name, params, body):
+        emulator = self.emulator
+
+        if name:
+            with emulator.lock:
+                node = emulator.nodes.get(name)
+                node = dict(node) if node is not None else None
+            if node is None:
+                return self._send(404, {'error': 'No information is known about node {}'.format(name)})
+            return self._send(200, node)
+
+        if method == 'POST':
+            params = dict(params, **json.loads(body or '{}'))
+        query = params.get('query')
+        if isinstance(query, str):
+            query = json.loads(query)
+
+        # Deactivated nodes are only returned on request
+        node_state = _node_state(query) or 'active'
+        query = _strip_node_state(query)
+
+        with emulator.lock:
+            nodes = [
+                dict(node) for node in emulator.nodes.values()
+                if (node_state == 'any' or (node['deactivated'] is None) == (node_state == 'active'))
+                and (not query or _match(query, node))
+            ]
+
+        order_by = params.get('order_by')
+        if isinstance(order_by, str):
+            order_by = json.loads(order_by)
+        for field in reversed(order_by or []):
+            nodes.sort(key=lambda node: node.get(field['field']) or '',
+                       reverse=field.get('order') == 'desc')
+
+        offset = int(params.get('offset', 0))
+        if 'limit' in params:
+            nodes = nodes[offset:offset + int(params['limit'])]
+        elif offset:
+            nodes = nodes[offset:]
+        return self._send(200, nodes)
+
+
+    def pdb_command(self, method, name, params, body):
+        emulator = self.emulator
+        if method != 'POST':
+            return self._send(405, 'Method Not Allowed', 'text/plain')
+
+        payload = json.loads(body or '{}')
+        if 'command' in params:
+            command = params['command'].replace('_', ' ')
+            certname = params.get('certname')
+        else:
+            command = payload.get('command')
+            payload = payload.get('payload', {})
+            certname = payload.get('certname')
+
+        command_uuid = str(uuid.uuid4())
+        with emulator.lock:
+            emulator.commands.append({'uuid': command_uuid, 'command': command, 'certname': certname})
+            if emulator.command_rate:
+                emulator.drain()
+                emulator.queue_depth += 1
+            now = _now()
+            if command == 'deactivate node':
+                if certname in emulator.nodes:
+                    emulator.nodes[certname]['deactivated'] = now
+            elif command in ('replace facts', 'replace catalog', 'store report'):
+                if certname not in emulator.nodes:
+                    emulator.add_node(certname, state=None)
+                node = emulator.nodes[certname]
+                node['deactivated'] = None
+                key = {'replace facts': 'facts_timestamp',
+                       'replace catalog': 'catalog_timestamp',
+                       'store report': 'report_timestamp'}[command]
+                node[key] = now
+
+        response = {'uuid': command_uuid}
+        if 'secondsToWaitForCompletion' in params:
+            response['processed'] = True
+        return self._send(200, response)
+
+
+    def pdb_status(self, method, name, params, body):
+        if name != 'puppetdb-status':
+            return self._send(404, 'Not Found', 'text/plain')
+        return self._send(200, {
+            'service_version': '5.2.0',
+            'service_status_version': 1,
+            'detail_level': 'info',
+            'state': 'running',
+            'status': {
+                'maintenance_mode?': False,
+                'queue_depth': self.emulator.drain(),
+                'read_db_up?': True,
+                'write_db_up?': True,
+            },
+        })
+
+
+    def pdb_metrics(self, method, name, params, body):
+        emulator = self.emulator
+        if name != 'puppetlabs.puppetdb.mq:name=global.processed':
+            return self._send(200, {
+                'status': 404,
+                'error_type': 'javax.management.InstanceNotFoundException',
+                'error': name,
+            })
+
+        with emulator.lock:
+            processed = len(emulator.commands) - emulator.drain()
+        return self._send(200, {
+            'request': {'mbean': name, 'type': 'read'},
+            'value': {'Count': processed, 'OneMinuteRate': float(emulator.command_rate or 0)},
+            'status': 200,
+        })
+
+
+# == Standalone
+#
+def main():
+    parser = argparse.ArgumentParser(description='Puppet CA and PuppetDB emulator')
+    parser.add_argument("--host", help="Listen address", default='127.0.0.1')
+    parser.add_argument("--port", help="Listen port", type=int, default=8140)
+    parser.add_argument("--nodes", help="Synthetic nodes to create", type=int, default=0)
+    parser.add_argument("--latency", help="Seconds added to each request", type=float, default=0.0)
+    parser.add_argument("--latency-jitter", help="Random seconds added to each request", type=float, default=0.0)
+    parser.add_argument("--error-rate", help="Probability of a 500 answer", type=float, default=0.0)
+    parser.add_argument("--max-concurrency", help="Answer 503 above this many requests in flight",
+                        type=int, default=None)
+    parser.add_argument("--command-rate", help="PuppetDB commands processed per second (queued until then)",
+                        type=float, default=None)
+    args = parser.parse_args()
+
+    emulator = PuppetEmulator(
+        host=args.host, port=args.port,
+        latency=args.latency, latency_jitter=args.latency_jitter,
+        error_rate=args.error_rate, max_concurrency=args.max_concurrency,
+        command_rate=args.command_rate
+    )
+    emulator.populate(args.nodes)
+    emulator.start()
+    print("Puppet emulator listening on {} ({} nodes)".format(emulator.uri, args.nodes))
+    try:
+        emulator.thread.join()
+    except KeyboardInterrupt:
+        emulator.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -48,15 +48,17 @@ setup(
         # Specify the Python versions you support here. In particular, ensure
         # that you indicate whether you support Python 2, Python 3 or both.
         'Programming Language :: Python :: 3',
-        'Programming Language :: Python :: 3.6',
+        'Programming Language :: Python :: 3.7',
     ],
     keywords='puppetserver puppetdb',
 
     # Setup
-    python_requires='>=3',
+    python_requires='>=3.7',
     install_requires=[
         'requests',
         'certifi',
+        # CRL checks (PuppetCa.crl) and CSR keys
+        'cryptography',
         # CLI only, hot to not make them as requirements
         'pyopenssl',
         'argparse',
@@ -64,6 +66,9 @@ setup(
         'colorlog',
         'pyyaml'
     ],
+    extras_require={
+        'async': ['aiohttp'],
+    },
     setup_requires=[
         'pytest-runner',
         'markdown'
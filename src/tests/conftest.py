@@ -5,6 +5,9 @@
 import os
 import pytest
 
+from puppet_apis import PuppetCa, PuppetCaCli
+from puppet_apis.testing import PuppetEmulator
+
 
 @pytest.fixture(scope='session')
 def docker_compose_file(pytestconfig):
@@ -13,3 +16,54 @@ def docker_compose_file(pytestconfig):
         '../tests',
         'docker-compose.yml'
     )
+
+
+# == Emulator
+#
+# Test modules override 'emulator_nodes' and 'emulator_options' (or parametrize them):
+#
+#     @pytest.fixture
+#     def emulator_nodes():
+#         return {NODE1: 'signed', NODE2: 'requested'}
+#
+@pytest.fixture
+def emulator_nodes():
+    """
+    Nodes added to the emulator: {certname: certificate state}
+    """
+    return {}
+
+
+@pytest.fixture
+def emulator_options():
+    """
+    PuppetEmulator arguments
+    """
+    return {}
+
+
+@pytest.fixture
+def emulator(emulator_nodes, emulator_options):
+    with PuppetEmulator(**emulator_options) as emulator:
+        for name, state in emulator_nodes.items():
+            emulator.add_node(name, state=state)
+        yield emulator
+
+
+@pytest.fixture
+def cli(emulator, tmp_path):
+    """
+    PuppetCaCli with an HTTP client of the emulator
+    """
+    config = {
+        'puppetserver': {'server': emulator.host, 'port': emulator.port},
+        'ssl': {
+            'client_name': 'admin.mydomain.com',
+            'client_cert': str(tmp_path / 'missing.pem'),
+            'client_key': str(tmp_path / 'missing.key'),
+        },
+    }
+    cli = PuppetCaCli(config)
+    # The emulator only speaks HTTP
+    cli.puppet_ca_client = PuppetCa(server=emulator.host, port=emulator.port, scheme='http')
+    return cli
@@ -0,0 +1,92 @@
+import asyncio
+
+import pytest
+
+# aiohttp is optional: pip install puppet_apis[async]
+pytest.importorskip('aiohttp')
+
+from puppet_apis import AsyncPuppetCa, AsyncPuppetDb, PuppetCaException  # noqa: E402
+from puppet_apis.metrics import Metrics  # noqa: E402
+from puppet_apis.testing import PuppetEmulator  # noqa: E402
+
+
+# == Config
+#
+NODE1='node01.mydomain.com'
+
+
+# == Fixtures
+#
+@pytest.fixture
+def emulator_nodes():
+    return {NODE1: 'signed'}
+
+
+def _client(cls, emulator, **kwargs):
+    return cls(server=emulator.host, port=emulator.port, scheme='http', **kwargs)
+
+
+# == Tests
+#
+def test_async_puppetca_lifecycle(emulator):
+    node = 'node02.mydomain.com'
+
+    async def main():
+        async with _client(AsyncPuppetCa, emulator) as puppetca:
+            assert await puppetca.status(node) == {}
+            assert await puppetca.submit_csr(node, 'CSR')
+            assert 'CSR' in await puppetca.get_csr(node)
+            assert (await puppetca.status(node))['state'] == 'requested'
+
+            assert await puppetca.sign(node)
+            assert 'BEGIN CERTIFICATE' in await puppetca.get_cert(node)
+            assert not await puppetca.sign(node)
+
+            assert await puppetca.revoke(node)
+            assert (await puppetca.status(node))['state'] == 'revoked'
+            assert await puppetca.delete(node)
+            assert await puppetca.status(node) == {}
+            assert not await puppetca.delete(node)
+
+    asyncio.run(main())
+    assert node not in emulator.statuses
+
+
+def test_async_decommission_shared_session(emulator):
+    emulator.populate(50)
+    fqdns = ['node{:06d}.mydomain.com'.format(i) for i in range(50)]
+    metrics = Metrics()
+
+    async def main():
+        async with _client(AsyncPuppetCa, emulator, limit=10, metrics=metrics) as puppetca:
+            puppetdb = _client(AsyncPuppetDb, emulator, session=puppetca.session)
+            assert (await puppetdb.status(fqdns[0]))['deactivated'] is None
+
+            uuids = await asyncio.gather(*[puppetdb.deactivate(fqdn) for fqdn in fqdns])
+            revoked = await asyncio.gather(*[puppetca.revoke(fqdn) for fqdn in fqdns])
+
+            # Closing a client does not close a session it does not own
+            await puppetdb.close()
+            assert not puppetca.session.closed
+            return uuids, revoked
+
+    uuids, revoked = asyncio.run(main())
+
+    assert all('uuid' in uuid for uuid in uuids)
+    assert all(revoked)
+    assert all(emulator.nodes[fqdn]['deactivated'] is not None for fqdn in fqdns)
+    assert all(emulator.statuses[fqdn]['state'] == 'revoked' for fqdn in fqdns)
+    # Only the CA client records metrics
+    assert [(m['method'], m['count'], m['statuses']) for m in metrics.snapshot()] == [('PUT', 50, {204: 50})]
+
+
+def test_async_connection_error():
+    emulator = PuppetEmulator().start()
+    emulator.stop()
+
+    async def main():
+        async with _client(AsyncPuppetCa, emulator) as puppetca:
+            with pytest.raises(PuppetCaException):
+                await puppetca.status(NODE1)
+
+    asyncio.run(main())
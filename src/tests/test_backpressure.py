@@ -0,0 +1,142 @@
+import threading
+
+import pytest
+
+from puppet_apis import PuppetDb, PuppetDbCommands
+from puppet_apis.backpressure import CommandBackpressure
+from puppet_apis.deadline import Deadline, DeadlineExceeded
+from puppet_apis.testing import PuppetEmulator
+
+
+# == Helpers
+#
+class FakeClock:
+    def __init__(self):
+        self.now = 100.0
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+class FakePuppetDb:
+    """
+    Queue draining at 'rate' commands per second of the fake clock
+    """
+    def __init__(self, clock, depth, rate=None):
+        self.clock = clock
+        self.depth = depth
+        self.rate = rate
+        self.start = clock()
+        self.reads = 0
+
+    def queue_depth(self):
+        self.reads += 1
+        return max(self.depth - int((self.clock() - self.start) * (self.rate or 0)), 0)
+
+    def command_rate(self):
+        if self.rate is None:
+            raise ConnectionError('metrics disabled')
+        return self.rate
+
+
+# == Tests
+#
+def test_backpressure_passes_below_threshold():
+    clock = FakeClock()
+    puppetdb = FakePuppetDb(clock, depth=10)
+    backpressure = CommandBackpressure(puppetdb, max_depth=100, clock=clock, sleep=clock.sleep)
+
+    assert backpressure.wait() == 0
+    assert backpressure.wait() == 0
+    # Cached reading
+    assert puppetdb.reads == 1
+
+
+def test_backpressure_pauses_until_drained():
+    clock = FakeClock()
+    puppetdb = FakePuppetDb(clock, depth=300, rate=20)
+    backpressure = CommandBackpressure(puppetdb, max_depth=100, interval=5, clock=clock, sleep=clock.sleep)
+
+    waited = backpressure.wait()
+    # Resumes below 50, draining 250 commands at 20/s
+    assert 12.5 <= waited <= 15
+    assert backpressure.stats()['pauses'] == 1
+    assert not backpressure.paused
+
+
+def test_backpressure_without_rate():
+    clock = FakeClock()
+    puppetdb = FakePuppetDb(clock, depth=300)
+    backpressure = CommandBackpressure(puppetdb, max_depth=100, interval=5, clock=clock, sleep=clock.sleep)
+
+    with pytest.raises(DeadlineExceeded):
+        backpressure.wait(deadline=Deadline(12, clock=clock))
+    assert backpressure.paused_seconds == 12
+
+
+def test_backpressure_fails_open():
+    class BrokenPuppetDb:
+        def queue_depth(self):
+            raise ConnectionError('PuppetDB is down')
+
+    backpressure = CommandBackpressure(BrokenPuppetDb(), max_depth=100)
+    assert backpressure.wait() == 0
+
+
+def test_puppetdb_queue_metrics():
+    with PuppetEmulator(command_rate=1000) as emulator:
+        emulator.queue_depth = 42
+        puppetdb = PuppetDb(server=emulator.host, port=emulator.port, scheme='http')
+
+        assert 0 <= puppetdb.queue_depth() <= 42
+        assert puppetdb.command_rate() == 1000
+
+
+def test_puppetdb_commands_yield_to_queue():
+    # Commands are processed at 100/s, pause above 10 queued
+    with PuppetEmulator(command_rate=100) as emulator:
+        emulator.populate(100)
+        puppetdb = PuppetDb(server=emulator.host, port=emulator.port, scheme='http',
+                            max_queue_depth=10, queue_check_interval=0.05)
+
+        depths = []
+        stop = threading.Event()
+
+        def watch():
+            while not stop.wait(0.01):
+                depths.append(emulator.drain())
+
+        watcher = threading.Thread(target=watch)
+        watcher.start()
+
+        commands = PuppetDbCommands(puppetdb, workers=4)
+        for i in range(100):
+            commands.deactivate('node{:06d}.mydomain.com'.format(i))
+        results = commands.submit()
+
+        stop.set()
+        watcher.join()
+
+    assert [r['outcome'] for r in results] == ['queued'] * 100
+    assert puppetdb.backpressure.pauses > 0
+    # Threshold + commands submitted between two readings, far from the 100 queued without pauses
+    assert max(depths) < 40
+
+
+def test_puppetdb_commands_held_until_deadline_are_skipped():
+    # Deep queue, slowly processed: commands are held by the backpressure
+    with PuppetEmulator(command_rate=1) as emulator:
+        emulator.queue_depth = 1000
+        puppetdb = PuppetDb(server=emulator.host, port=emulator.port, scheme='http',
+                            max_queue_depth=10, queue_check_interval=0.05)
+
+        commands = PuppetDbCommands(puppetdb, workers=2)
+        for i in range(3):
+            commands.deactivate('node{:06d}.mydomain.com'.format(i))
+        results = commands.submit(deadline=Deadline(0.5))
+
+    assert [(r['outcome'], r['error']) for r in results] == [('skipped', None)] * 3
+    assert not emulator.commands
@@ -0,0 +1,116 @@
+import io
+
+import pytest
+
+from puppet_apis import PuppetCa
+from puppet_apis.deadline import Deadline
+from puppet_apis.puppetcacli import read_commands
+from puppet_apis.testing import PuppetEmulator
+
+
+# == Config
+#
+NODE1='node01.mydomain.com'
+NODE2='node02.mydomain.com'
+NODE3='node03.mydomain.com'
+NODE4='node04.mydomain.com'
+
+
+# == Fixtures
+#
+@pytest.fixture
+def emulator_nodes():
+    return {NODE1: 'signed', NODE2: 'signed', NODE3: 'signed'}
+
+
+# == Tests
+#
+def test_read_commands():
+    stream = io.StringIO(
+        "# command hostname\nstatus node01.mydomain.com\n\nSIGN node02.mydomain.com # comment\ndelete\n")
+    assert list(read_commands(stream)) == [
+        (2, 'status', NODE1),
+        (4, 'sign', NODE2),
+        (5, 'delete', None),
+    ]
+
+
+@pytest.mark.parametrize('workers', [1, 4])
+def test_batch(cli, workers):
+    stream = io.StringIO("\n".join([
+        "status {}".format(NODE1),
+        "revoke {}".format(NODE2),
+        "delete {}".format(NODE3),
+        "status unknown.mydomain.com",
+        "reboot {}".format(NODE1),
+        "sign",
+    ]))
+    results = list(cli.batch(read_commands(stream), workers=workers))
+
+    assert [r['line'] for r in results] == [1, 2, 3, 4, 5, 6]
+    assert [r['ok'] for r in results] == [True, True, True, False, False, False]
+    assert results[0]['result']['state'] == 'signed'
+    assert results[3]['error'] is None
+    assert 'Unknown command' in results[4]['error']
+    assert results[5]['error'] == 'Missing hostname'
+
+
+def test_batch_sign(cli, emulator):
+    emulator.add_node(NODE4, state='requested')
+    results = list(cli.batch([(1, 'sign', NODE4), (2, 'sign', NODE1)]))
+
+    assert [r['ok'] for r in results] == [True, False]
+    assert emulator.statuses[NODE4]['state'] == 'signed'
+
+
+@pytest.mark.parametrize('command', ['status', 'sign', 'get'])
+def test_batch_unknown_host(cli, command, tmp_path):
+    result = list(cli.batch([(1, command, 'unknown.mydomain.com')], ssldir=str(tmp_path)))[0]
+
+    assert not result['ok']
+    assert result['error'] is None
+
+
+def test_batch_get(cli, tmp_path):
+    results = list(cli.batch([(1, 'get', NODE1)], ssldir=str(tmp_path)))
+
+    assert results[0]['ok']
+    assert (tmp_path / 'certs' / '{}.pem'.format(NODE1)).exists()
+    assert (tmp_path / 'certs' / 'ca.pem').exists()
+
+
+def test_batch_deadline(cli):
+    results = list(cli.batch([(1, 'status', NODE1), (2, 'sign', NODE2)], deadline=Deadline(0)))
+
+    assert [r['ok'] for r in results] == [False, False]
+    assert all('DeadlineExceeded' in r['error'] for r in results)
+
+
+def test_batch_streams_commands(cli):
+    consumed = []
+
+    def commands():
+        for i in range(100):
+            consumed.append(i)
+            yield (i + 1, 'status', NODE1)
+
+    results = cli.batch(commands(), workers=2)
+    assert next(results)['ok']
+    # Bounded submission window: stdin is not read ahead
+    assert len(consumed) <= 2 * 2 + 1
+
+    assert len(list(results)) == 99
+    assert len(consumed) == 100
+
+
+@pytest.mark.parametrize('command', ['status', 'sign', 'get'])
+def test_batch_reports_ca_errors(cli, command, tmp_path):
+    # Refused connections
+    emulator = PuppetEmulator().start()
+    emulator.stop()
+    cli.puppet_ca_client = PuppetCa(server=emulator.host, port=emulator.port, scheme='http')
+
+    result = list(cli.batch([(1, command, NODE1)], ssldir=str(tmp_path)))[0]
+    assert not result['ok']
+    assert 'PuppetCaException' in result['error']
+    assert 'ConnectionError' in result['error']
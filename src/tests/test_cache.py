@@ -0,0 +1,91 @@
+from puppet_apis import PuppetCa
+from puppet_apis.cache import TTLCache
+from puppet_apis.testing import PuppetEmulator
+
+
+# == Config
+#
+NODE='node01.mydomain.com'
+
+
+# == Helpers
+#
+class FakeClock:
+    def __init__(self):
+        self.now = 0
+
+    def __call__(self):
+        return self.now
+
+
+# == Tests
+#
+def test_cache_ttl():
+    clock = FakeClock()
+    cache = TTLCache(ttl=10, clock=clock)
+    cache.set('node01', {'state': 'signed'})
+
+    clock.now = 9
+    assert cache.get('node01') == {'state': 'signed'}
+
+    clock.now = 10
+    assert cache.get('node01') is None
+    assert cache.stats()['hits'] == 1
+    assert cache.stats()['misses'] == 1
+
+
+def test_cache_lru_eviction():
+    cache = TTLCache(ttl=10, maxsize=2)
+    cache.set('node01', 1)
+    cache.set('node02', 2)
+    cache.get('node01')
+    cache.set('node03', 3)
+
+    assert 'node01' in cache
+    assert 'node02' not in cache
+    assert len(cache) == 2
+
+
+def test_cache_invalidate():
+    cache = TTLCache(ttl=10)
+    cache.set('node01', 1)
+    cache.invalidate('node01')
+    cache.invalidate('node02')
+
+    assert cache.get('node01', 'missing') == 'missing'
+
+
+def test_cache_ignores_values_read_before_invalidation():
+    cache = TTLCache(ttl=10, maxsize=2)
+    generation = cache.generation()
+    cache.invalidate('node01')
+    cache.set('node01', 'outdated', generation)
+    assert 'node01' not in cache
+
+    # Other keys are not affected
+    cache.set('node02', 2, generation)
+    assert cache.get('node02') == 2
+
+    # Invalidations forgotten above maxsize
+    cache.invalidate('node03')
+    cache.invalidate('node04')
+    cache.set('node01', 'outdated', generation)
+    assert 'node01' not in cache
+
+    cache.set('node01', 1, cache.generation())
+    assert cache.get('node01') == 1
+
+
+def test_puppetca_status_cache_read_during_write():
+    with PuppetEmulator() as emulator:
+        emulator.add_node(NODE, state='requested')
+        puppetca = PuppetCa(server=emulator.host, port=emulator.port, scheme='http', status_cache_ttl=60)
+
+        # The node is signed after the CA answered the read, before it is cached
+        def sign_once(response, **kwargs):
+            if response.request.method == 'GET' and emulator.statuses[NODE]['state'] == 'requested':
+                assert puppetca.sign(NODE)
+        puppetca.session.hooks['response'].append(sign_once)
+
+        assert puppetca.status(NODE)['state'] == 'requested'
+        assert puppetca.status(NODE)['state'] == 'signed'
@@ -0,0 +1,123 @@
+import io
+import threading
+
+import pytest
+
+from OpenSSL import crypto
+
+from puppet_apis.keypool import generate_private_key
+from puppet_apis.puppetcacli import read_hostnames
+
+
+# == Config
+#
+NODE1='node01.mydomain.com'
+NODE2='node02.mydomain.com'
+
+
+# == Fixtures
+#
+@pytest.fixture
+def emulator_nodes():
+    return {NODE1: 'requested', NODE2: 'requested'}
+
+
+# == Helpers
+#
+def _read_csr(ssl_dir, hostname):
+    return crypto.load_certificate_request(
+        crypto.FILETYPE_PEM, (ssl_dir / 'certificate_request' / '{}.pem'.format(hostname)).read_bytes())
+
+
+def _read_key(ssl_dir, hostname):
+    return crypto.load_privatekey(
+        crypto.FILETYPE_PEM, (ssl_dir / 'private_keys' / '{}.pem'.format(hostname)).read_bytes())
+
+
+def _public_pem(key):
+    return crypto.dump_publickey(crypto.FILETYPE_PEM, key)
+
+
+# == Tests
+#
+# === Bulk generation
+#
+def test_read_hostnames():
+    stream = io.StringIO("# hostname [san ...]\nnode01.mydomain.com node01 node01.otherdomain.com\n\n"
+                         "node02.mydomain.com # comment\n")
+    assert list(read_hostnames(stream)) == [
+        ('node01.mydomain.com', ['node01', 'node01.otherdomain.com']),
+        ('node02.mydomain.com', []),
+    ]
+
+
+def test_generate_bulk(emulator, cli, tmp_path):
+    cli.key_size = 1024
+    hosts = [('bulk{:02d}.mydomain.com'.format(i), ['bulk{:02d}'.format(i)]) for i in range(10)]
+
+    # An existing key is reused
+    existing = generate_private_key('rsa', 1024)
+    (tmp_path / 'private_keys').mkdir()
+    (tmp_path / 'private_keys' / 'bulk00.mydomain.com.pem').write_bytes(
+        crypto.dump_privatekey(crypto.FILETYPE_PEM, existing))
+
+    results = list(cli.generate_bulk(hosts, str(tmp_path), processes=2, workers=4))
+
+    assert sorted(r['hostname'] for r in results) == [hostname for hostname, _ in hosts]
+    assert all(r['generated'] and r['submitted'] and r['error'] is None for r in results)
+    for hostname, san in hosts:
+        csr = _read_csr(tmp_path, hostname)
+        assert csr.get_subject().CN == hostname
+        assert csr.verify(csr.get_pubkey())
+        assert _public_pem(csr.get_pubkey()) == _public_pem(_read_key(tmp_path, hostname))
+        assert emulator.statuses[hostname]['state'] == 'requested'
+    assert _public_pem(_read_csr(tmp_path, 'bulk00.mydomain.com').get_pubkey()) == _public_pem(existing)
+
+
+def test_generate_bulk_ec(emulator, cli, tmp_path):
+    cli.key_type, cli.key_size = 'ec', 'P-256'
+    results = list(cli.generate_bulk([('ec.mydomain.com', [])], str(tmp_path), processes=1))
+
+    assert results[0]['submitted']
+    assert _read_key(tmp_path, 'ec.mydomain.com').type() == crypto.TYPE_EC
+    assert emulator.requests['ec.mydomain.com'] == \
+        (tmp_path / 'certificate_request' / 'ec.mydomain.com.pem').read_text()
+
+
+def test_generate_bulk_reports_submission_errors(emulator, cli, tmp_path):
+    cli.key_size = 1024
+    # Already signed: the CA refuses a new CSR
+    results = list(cli.generate_bulk([(NODE1, []), ('new.mydomain.com', [])], str(tmp_path), processes=1))
+    emulator.sign(NODE1)
+    results += list(cli.generate_bulk([(NODE1, [])], str(tmp_path), processes=1))
+
+    by_host = [(r['hostname'], r['generated'], r['submitted']) for r in results]
+    assert (NODE1, True, True) in by_host
+    assert ('new.mydomain.com', True, True) in by_host
+    assert by_host[-1] == (NODE1, True, False)
+
+
+# === Wait for signing
+#
+def test_wait_signed(emulator, cli, tmp_path):
+    # A large CA: only the pending hosts are polled
+    emulator.populate(500)
+    timer = threading.Timer(0.3, emulator.sign, args=(NODE1,))
+    timer.start()
+
+    count = emulator.requests_count
+    results = cli.wait_signed([NODE1, NODE2], ssl_dir=str(tmp_path), timeout=1.5, initial_delay=0.1, max_delay=0.2)
+    timer.join()
+
+    assert results == {NODE1: True, NODE2: False}
+    assert (tmp_path / 'certs' / '{}.pem'.format(NODE1)).exists()
+    assert (tmp_path / 'certs' / 'ca.pem').exists()
+    assert not (tmp_path / 'certs' / '{}.pem'.format(NODE2)).exists()
+    # A few rounds of 1 or 2 status requests, and 3 downloads (certificates, CSR deletion)
+    assert emulator.requests_count - count < 40
+
+
+def test_wait_signed_already_signed(emulator, cli, tmp_path):
+    emulator.sign(NODE1)
+    assert cli.get(NODE1, str(tmp_path), wait=True, timeout=1)
+    assert (tmp_path / 'certs' / '{}.pem'.format(NODE1)).exists()
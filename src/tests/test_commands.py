@@ -0,0 +1,50 @@
+from puppet_apis import PuppetDbCommands
+
+
+# == Helpers
+#
+class FakePuppetDb:
+    def __init__(self):
+        self.submitted = []
+
+    def submit_command(self, command, version, certname, payload, wait=None):
+        self.submitted.append((command, version, certname, wait))
+        if certname == 'broken.mydomain.com':
+            raise ConnectionError('PuppetDB is down')
+        if certname == 'slow.mydomain.com':
+            return {'uuid': 'uuid-slow', 'timed_out': True}
+        response = {'uuid': 'uuid-{}'.format(certname)}
+        if wait:
+            response['processed'] = True
+        return response
+
+
+# == Tests
+#
+def test_commands_submit():
+    puppetdb = FakePuppetDb()
+    commands = PuppetDbCommands(puppetdb, workers=4)
+    commands.deactivate('node01.mydomain.com')
+    commands.replace_facts('node02.mydomain.com', {'os': 'debian'})
+    commands.store_report('node03.mydomain.com', {'certname': 'node03.mydomain.com'})
+    assert len(commands) == 3
+
+    results = commands.submit()
+
+    assert len(commands) == 0
+    assert [r['outcome'] for r in results] == ['queued'] * 3
+    assert results[0]['uuid'] == 'uuid-node01.mydomain.com'
+    assert sorted(s[:2] for s in puppetdb.submitted) == [
+        ('deactivate node', 3), ('replace facts', 5), ('store report', 8)
+    ]
+
+
+def test_commands_submit_wait_outcomes():
+    commands = PuppetDbCommands(FakePuppetDb())
+    for certname in ['node01.mydomain.com', 'slow.mydomain.com', 'broken.mydomain.com']:
+        commands.deactivate(certname)
+
+    results = commands.submit(wait=10)
+
+    assert [r['outcome'] for r in results] == ['processed', 'timed_out', 'error']
+    assert 'PuppetDB is down' in results[2]['error']
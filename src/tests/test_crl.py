@@ -0,0 +1,68 @@
+import datetime
+import os
+
+from cryptography import x509
+from cryptography.hazmat.backends import default_backend
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import ec
+from cryptography.x509.oid import NameOID
+
+from puppet_apis import RevocationList
+from puppet_apis.inventory import InventoryEntry
+
+
+# == Config
+#
+test_dir = os.path.dirname(os.path.realpath(__file__))
+CRL_FILE = "{}/../../tests/docker-compose/puppetserver/ssl/ca/ca_crl.pem".format(test_dir)
+CERT_FILE = "{}/../../tests/docker-compose/puppetserver/ssl/ca/signed/admin1.mydomain.com.pem".format(test_dir)
+
+
+# == Helpers
+#
+def make_crl(serials):
+    key = ec.generate_private_key(ec.SECP256R1(), default_backend())
+    now = datetime.datetime(2018, 4, 24)
+    builder = x509.CertificateRevocationListBuilder() \
+        .issuer_name(x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, 'Puppet CA: puppet.mydomain.com')])) \
+        .last_update(now) \
+        .next_update(now + datetime.timedelta(days=1))
+    for serial in serials:
+        builder = builder.add_revoked_certificate(
+            x509.RevokedCertificateBuilder().serial_number(serial).revocation_date(now).build(default_backend())
+        )
+    crl = builder.sign(key, hashes.SHA256(), default_backend())
+    return crl.public_bytes(serialization.Encoding.PEM)
+
+
+# == Tests
+#
+def test_crl_from_puppetserver_fixture():
+    with open(CRL_FILE) as f:
+        revocation_list = RevocationList.from_pem(f.read())
+
+    assert len(revocation_list) == 0
+    assert revocation_list.last_update == datetime.datetime(2018, 4, 24, 15, 56, 11)
+    assert not revocation_list.is_revoked(4)
+
+
+def test_crl_is_revoked():
+    revocation_list = RevocationList.from_pem(make_crl([9, 4, 2]))
+
+    assert len(revocation_list) == 3
+    assert revocation_list.is_revoked(2)
+    assert not revocation_list.is_revoked(3)
+    assert revocation_list.is_revoked('0x0004')
+    assert revocation_list.is_revoked('00:09')
+    assert InventoryEntry(4, 0, 0, '/CN=admin1.mydomain.com', 'admin1.mydomain.com') in revocation_list
+
+    # admin1.mydomain.com serial is 4
+    with open(CERT_FILE) as f:
+        assert revocation_list.is_revoked(f.read())
+
+
+def test_crl_large_serials():
+    revocation_list = RevocationList([2 ** 70, 1])
+
+    assert revocation_list.is_revoked(2 ** 70)
+    assert not revocation_list.is_revoked(2 ** 64)
@@ -0,0 +1,111 @@
+import pytest
+from requests.exceptions import ReadTimeout
+
+from puppet_apis import Decommission, PuppetCa, PuppetCaException, PuppetDb, PuppetDbCommands
+from puppet_apis.deadline import Deadline, DeadlineExceeded
+
+
+# == Config
+#
+NODE1='node01.mydomain.com'
+NODE2='node02.mydomain.com'
+
+
+# == Helpers
+#
+class FakeClock:
+    def __init__(self):
+        self.now = 100.0
+
+    def __call__(self):
+        return self.now
+
+
+# == Fixtures
+#
+@pytest.fixture
+def emulator_nodes():
+    return {NODE1: 'signed', NODE2: 'signed'}
+
+
+@pytest.fixture
+def emulator_options():
+    return {'latency': 0.3}
+
+
+# == Tests
+#
+# === Deadline
+#
+def test_deadline():
+    clock = FakeClock()
+    deadline = Deadline(10, clock=clock)
+
+    assert deadline.remaining() == 10
+    assert deadline.timeout((5, 30)) == (5, 10)
+    assert deadline.timeout(None) == (10, 10)
+
+    clock.now += 8
+    assert deadline.timeout(3) == (2, 2)
+
+    clock.now += 2
+    assert deadline.expired()
+    with pytest.raises(DeadlineExceeded):
+        deadline.timeout((5, 30))
+
+
+# === Clients
+#
+def test_default_timeout(emulator):
+    puppetca = PuppetCa(server=emulator.host, port=emulator.port, scheme='http', timeout=(1, 0.1))
+    with pytest.raises(PuppetCaException):
+        puppetca.status(NODE1)
+
+    # Per call timeout
+    assert puppetca.status(NODE1, timeout=5)['state'] == 'signed'
+
+
+def test_get_read_timeout(emulator):
+    # Not a ConnectionError: the server was reached
+    for retries in (0, 2):
+        puppetdb = PuppetDb(server=emulator.host, port=emulator.port, scheme='http',
+                            timeout=(1, 0.1), retries=retries)
+        with pytest.raises(ReadTimeout):
+            puppetdb.status(NODE1)
+
+
+def test_deadline_as_timeout(emulator):
+    puppetdb = PuppetDb(server=emulator.host, port=emulator.port, scheme='http')
+
+    with pytest.raises(ReadTimeout):
+        puppetdb.deactivate(NODE1, timeout=Deadline(0.1))
+
+    deadline = Deadline(0)
+    with pytest.raises(DeadlineExceeded):
+        puppetdb.deactivate(NODE1, timeout=deadline)
+
+
+# === Batches
+#
+def test_decommission_deadline(emulator):
+    puppetca = PuppetCa(server=emulator.host, port=emulator.port, scheme='http')
+    puppetdb = PuppetDb(server=emulator.host, port=emulator.port, scheme='http')
+
+    # The first calls time out with the deadline, the next ones do not start
+    report = Decommission(puppetca, puppetdb, ca_workers=1, db_workers=1).run([NODE1, NODE2], deadline=Deadline(0.2))
+
+    assert len(report[NODE1]['errors']) == 2
+    assert 'skipped' not in report[NODE1]
+    assert sorted(report[NODE2]['skipped']) == ['deactivate', 'delete', 'revoke']
+    assert report[NODE2]['errors'] == []
+
+
+def test_commands_deadline(emulator):
+    puppetdb = PuppetDb(server=emulator.host, port=emulator.port, scheme='http')
+    commands = PuppetDbCommands(puppetdb, workers=1)
+    commands.deactivate(NODE1)
+    commands.deactivate(NODE2)
+
+    results = commands.submit(deadline=Deadline(0.2))
+    assert [r['outcome'] for r in results] == ['error', 'skipped']
+    assert 'timed out' in results[0]['error']
@@ -0,0 +1,61 @@
+import threading
+import time
+
+from puppet_apis import Decommission
+
+
+# == Helpers
+#
+class FakePuppetCa:
+    def __init__(self):
+        self.calls = []
+        self.lock = threading.Lock()
+
+    def revoke(self, node_fqdn):
+        time.sleep(0.01)
+        with self.lock:
+            self.calls.append(('revoke', node_fqdn))
+        return True
+
+    def delete(self, node_fqdn):
+        with self.lock:
+            self.calls.append(('delete', node_fqdn))
+        return node_fqdn != 'broken.mydomain.com'
+
+
+class FakePuppetDb:
+    def deactivate(self, node_fqdn):
+        if node_fqdn == 'broken.mydomain.com':
+            raise ConnectionError('PuppetDB is down')
+        time.sleep(0.01)
+        return {'uuid': 'uuid-{}'.format(node_fqdn)}
+
+
+# == Tests
+#
+def test_decommission_report():
+    nodes = ['node{:02d}.mydomain.com'.format(i) for i in range(20)]
+    puppetca = FakePuppetCa()
+
+    report = Decommission(puppetca, FakePuppetDb(), ca_workers=4, db_workers=4).run(nodes + nodes[:2])
+
+    assert sorted(report) == nodes
+    assert report['node01.mydomain.com'] == {
+        'revoke': True, 'delete': True, 'deactivate': 'uuid-node01.mydomain.com', 'errors': []
+    }
+    # revoke always happens before delete
+    assert puppetca.calls.index(('revoke', nodes[3])) < puppetca.calls.index(('delete', nodes[3]))
+
+
+def test_decommission_errors_are_reported_per_node():
+    report = Decommission(FakePuppetCa(), FakePuppetDb()).run(['broken.mydomain.com'])
+
+    result = report['broken.mydomain.com']
+    assert result['delete'] is False
+    assert 'deactivate' not in result
+    assert 'PuppetDB is down' in result['errors'][0]
+
+
+def test_decommission_ca_only():
+    report = Decommission(puppetca=FakePuppetCa()).run(['node01.mydomain.com'])
+    assert 'deactivate' not in report['node01.mydomain.com']
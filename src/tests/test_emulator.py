@@ -0,0 +1,133 @@
+import pytest
+
+from puppet_apis import Decommission, PuppetCa, PuppetDb, PuppetDbCommands, PuppetDbException
+from puppet_apis.puppetdb import chunk_certnames
+
+
+# == Config
+#
+NODE1='node01.mydomain.com'
+NODE2='node02.mydomain.com'
+
+
+# == Fixtures
+#
+@pytest.fixture
+def emulator_nodes():
+    return {NODE1: 'signed', NODE2: 'requested'}
+
+
+@pytest.fixture
+def puppetca_client(emulator):
+    return PuppetCa(server=emulator.host, port=emulator.port, scheme='http')
+
+
+@pytest.fixture
+def puppetdb_client(emulator):
+    return PuppetDb(server=emulator.host, port=emulator.port, scheme='http')
+
+
+# == Tests
+#
+# === PuppetCA
+#
+def test_emulator_puppetca_status(puppetca_client):
+    assert puppetca_client.status(NODE1)['state'] == 'signed'
+    assert puppetca_client.status(NODE2)['state'] == 'requested'
+    assert puppetca_client.status('unknown.mydomain.com') == {}
+    assert [s['name'] for s in puppetca_client.statuses(state='requested')] == [NODE2]
+
+
+def test_emulator_puppetca_lifecycle(puppetca_client):
+    node = 'node03.mydomain.com'
+    assert puppetca_client.submit_csr(node, 'CSR')
+    assert 'CSR' in puppetca_client.get_csr(node)
+
+    assert puppetca_client.sign(node)
+    assert 'BEGIN CERTIFICATE' in puppetca_client.get_cert(node)
+    assert not puppetca_client.sign(node)
+
+    assert puppetca_client.revoke(node)
+    assert puppetca_client.status(node)['state'] == 'revoked'
+    assert puppetca_client.delete(node)
+    assert puppetca_client.status(node) == {}
+    assert not puppetca_client.delete(node)
+
+
+# === PuppetDB
+#
+def test_emulator_puppetdb_deactivate(puppetdb_client):
+    assert 'error' in puppetdb_client.status('unknown.mydomain.com')
+    assert puppetdb_client.status(NODE1)['deactivated'] is None
+
+    assert 'uuid' in puppetdb_client.deactivate(NODE1)
+    assert puppetdb_client.status(NODE1)['deactivated'] is not None
+    assert [n['certname'] for n in puppetdb_client.query_nodes()] == [NODE2]
+
+
+def test_emulator_puppetdb_query_paging(emulator, puppetdb_client):
+    emulator.populate(25)
+
+    nodes = list(puppetdb_client.query_nodes(page_size=10))
+    assert len(nodes) == 27
+    assert [n['certname'] for n in nodes] == sorted(n['certname'] for n in nodes)
+
+
+def test_chunk_certnames():
+    names = ['node{:02d}.mydomain.com'.format(i) for i in range(10)]
+    assert [len(c) for c in chunk_certnames(names, chunk_size=4)] == [4, 4, 2]
+    # 22 bytes per name: 2 per chunk under 50 bytes
+    assert [len(c) for c in chunk_certnames(names, max_size=50)] == [2] * 5
+    assert sum(chunk_certnames(names, chunk_size=4, max_size=50), []) == names
+
+
+def test_emulator_puppetdb_statuses(emulator, puppetdb_client):
+    emulator.populate(25)
+    puppetdb_client.deactivate(NODE1)
+    fqdns = [NODE1, NODE2, 'unknown.mydomain.com'] + ['node{:06d}.mydomain.com'.format(i) for i in range(25)]
+
+    count = emulator.requests_count
+    nodes = puppetdb_client.statuses(fqdns + [NODE2], chunk_size=10)
+    assert emulator.requests_count - count == 3
+
+    assert list(nodes) == fqdns
+    assert nodes['unknown.mydomain.com'] is None
+    assert nodes[NODE1]['deactivated'] is not None
+    assert all(nodes[fqdn]['certname'] == fqdn for fqdn in fqdns if fqdn != 'unknown.mydomain.com')
+
+
+def test_emulator_decommission(emulator, puppetca_client, puppetdb_client):
+    commands = PuppetDbCommands(puppetdb_client)
+    commands.replace_facts('node04.mydomain.com', {'os': 'debian'})
+    assert commands.submit(wait=5)[0]['outcome'] == 'processed'
+
+    report = Decommission(puppetca_client, puppetdb_client).run([NODE1])
+
+    assert report[NODE1]['revoke'] and report[NODE1]['delete'] and report[NODE1]['deactivate']
+    assert puppetca_client.status(NODE1) == {}
+    assert emulator.nodes[NODE1]['deactivated'] is not None
+
+
+# === Faults
+#
+def test_emulator_errors_and_retries(emulator):
+    emulator.error_rate = 1.0
+    puppetca_client = PuppetCa(server=emulator.host, port=emulator.port, scheme='http')
+    assert puppetca_client.status(NODE1) == {}
+
+    emulator.error_rate = 0.5
+    emulator.error_status = 502
+    emulator.random.seed(1)
+    puppetca_client = PuppetCa(server=emulator.host, port=emulator.port, scheme='http',
+                               retries=10, backoff_factor=0)
+    assert all(puppetca_client.status(NODE1)['state'] == 'signed' for _ in range(10))
+    assert emulator.errors_count > 1
+
+
+def test_emulator_throttling(emulator):
+    emulator.max_concurrency = 0
+    puppetdb_client = PuppetDb(server=emulator.host, port=emulator.port, scheme='http')
+
+    with pytest.raises(PuppetDbException, match='Service Unavailable'):
+        puppetdb_client.status(NODE1)
+    assert emulator.throttled_count == 1
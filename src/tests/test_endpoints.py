@@ -0,0 +1,111 @@
+import pytest
+
+from requests.exceptions import ConnectionError
+
+from puppet_apis import PuppetCa, PuppetDb
+from puppet_apis.endpoints import EndpointPool, parse_endpoints
+from puppet_apis.testing import PuppetEmulator
+
+
+# == Helpers
+#
+class FakeClock:
+    def __init__(self):
+        self.now = 100.0
+
+    def __call__(self):
+        return self.now
+
+
+def _closed_port():
+    # Port of a stopped server: connections are refused
+    emulator = PuppetEmulator().start()
+    emulator.stop()
+    return emulator.port
+
+
+# == Tests
+#
+def test_parse_endpoints():
+    assert parse_endpoints('puppetdb', 8081) == [('puppetdb', 8081)]
+    assert parse_endpoints(['pdb1', 'pdb2:8082', ('pdb3', 8083)], 8081) == [
+        ('pdb1', 8081), ('pdb2', 8082), ('pdb3', 8083)]
+    with pytest.raises(ValueError):
+        parse_endpoints([], 8081)
+
+
+def test_pool_failover_and_cooldown():
+    clock = FakeClock()
+    pool = EndpointPool('http', [('ca1', 8140), ('ca2', 8140)], cooldown=30, clock=clock)
+    primary, standby = pool.endpoints
+    assert pool.candidates('/puppet-ca/v1/certificate_status/a') == [primary, standby]
+
+    pool.started(primary)
+    pool.finished(primary, 1.0, failed=True)
+    # Primary down: last resort
+    assert pool.candidates('/puppet-ca/v1/certificate_status/a') == [standby, primary]
+
+    clock.now += 31
+    assert pool.candidates('/puppet-ca/v1/certificate_status/a') == [primary, standby]
+
+
+def test_pool_reads_prefer_fast_endpoints():
+    pool = EndpointPool('http', [('pdb1', 8080), ('pdb2', 8080), ('pdb3', 8080)],
+                        read_prefixes=('/pdb/query/',), failover=False)
+    primary, replica1, replica2 = pool.endpoints
+    for endpoint, latency in ((primary, 0.5), (replica1, 0.01), (replica2, 0.02)):
+        pool.started(endpoint)
+        pool.finished(endpoint, latency)
+
+    picks = [pool.candidates('/pdb/query/v4/nodes')[0] for _ in range(100)]
+    # Out of two random picks, the slowest one never wins
+    assert primary not in picks
+    assert picks.count(replica1) > picks.count(replica2)
+
+    # Commands: primary only
+    assert pool.candidates('/pdb/cmd/v1') == [primary]
+
+
+def test_puppetdb_queries_spread_commands_to_primary():
+    with PuppetEmulator(latency=0.05) as primary, PuppetEmulator() as replica1, PuppetEmulator() as replica2:
+        for emulator in (primary, replica1, replica2):
+            emulator.populate(10)
+
+        puppetdb = PuppetDb(
+            server=[(emulator.host, emulator.port) for emulator in (primary, replica1, replica2)],
+            coalesce=False
+        )
+        assert puppetdb.uri == primary.uri
+
+        for _ in range(30):
+            assert puppetdb.status('node000001.mydomain.com')['certname'] == 'node000001.mydomain.com'
+        assert len(list(puppetdb.query_nodes())) == 10
+        # The slow primary is left to commands
+        assert primary.requests_count < 5
+        assert replica1.requests_count + replica2.requests_count > 25
+
+        puppetdb.deactivate('node000001.mydomain.com')
+        assert len(primary.commands) == 1
+        assert not replica1.commands and not replica2.commands
+
+
+def test_puppetdb_commands_do_not_fail_over():
+    with PuppetEmulator() as replica:
+        puppetdb = PuppetDb(server=[('127.0.0.1', _closed_port()), (replica.host, replica.port)])
+        with pytest.raises(ConnectionError):
+            puppetdb.deactivate('node000001.mydomain.com')
+        assert not replica.commands
+
+
+def test_puppetca_fails_over_to_standby():
+    with PuppetEmulator() as standby:
+        standby.add_node('node000001.mydomain.com')
+        puppetca = PuppetCa(server=[('127.0.0.1', _closed_port()), (standby.host, standby.port)],
+                            scheme='http', coalesce=False)
+
+        assert puppetca.status('node000001.mydomain.com')['state'] == 'signed'
+        assert puppetca.endpoints.failovers == 1
+        # Primary skipped while in cooldown
+        assert puppetca.status('node000001.mydomain.com')['state'] == 'signed'
+        assert puppetca.endpoints.failovers == 1
+        assert standby.requests_count == 2
@@ -0,0 +1,35 @@
+import importlib.util
+import subprocess
+import sys
+
+import pytest
+
+import puppet_apis
+
+
+# == Tests
+#
+def test_import_is_lazy():
+    # Fresh interpreter: modules already imported by other tests do not count
+    code = (
+        "import sys, puppet_apis\n"
+        "from puppet_apis import PuppetDb, PuppetCa\n"
+        "print(' '.join(m for m in ('OpenSSL', 'aiohttp', 'puppet_apis.puppetcacli') if m in sys.modules))\n"
+    )
+    output = subprocess.check_output([sys.executable, '-c', code])
+    assert output.decode().strip() == ''
+
+
+def test_exports():
+    # aiohttp is optional: pip install puppet_apis[async]
+    skipped = () if importlib.util.find_spec('aiohttp') else ('puppetasync',)
+    for name in puppet_apis.__all__:
+        if puppet_apis._EXPORTS[name] in skipped:
+            continue
+        assert getattr(puppet_apis, name).__name__ == name
+    assert 'PuppetCaCli' in dir(puppet_apis)
+
+
+def test_unknown_attribute():
+    with pytest.raises(AttributeError):
+        puppet_apis.Unknown
@@ -0,0 +1,73 @@
+import os
+import shutil
+import pytest
+
+from datetime import datetime, timezone
+
+from puppet_apis import CaInventory
+
+
+# == Config
+#
+test_dir = os.path.dirname(os.path.realpath(__file__))
+CA_DIR = "{}/../../tests/docker-compose/puppetserver/ssl/ca".format(test_dir)
+
+
+# == Fixtures
+#
+@pytest.fixture
+def ca_dir(tmp_path):
+    path = str(tmp_path / 'ca')
+    shutil.copytree(CA_DIR, path)
+    return path
+
+
+# == Tests
+#
+def test_inventory_queries():
+    inventory = CaInventory(CA_DIR)
+
+    assert len(inventory) == 4
+    assert inventory.get('0x0003').cn == 'puppetdb'
+    assert inventory.get(4).subject == '/CN=admin1.mydomain.com'
+    assert inventory.latest('puppet.mydomain.com').serial == 2
+    assert inventory.latest('unknown.mydomain.com') is None
+
+    start = datetime(2023, 4, 23, 15, 56, 15, tzinfo=timezone.utc)
+    end = datetime(2023, 4, 24, tzinfo=timezone.utc)
+    assert [e.serial for e in inventory.expiring(start, end)] == [2, 3, 4]
+    assert len(inventory.expired(now=end.timestamp())) == 4
+
+    assert inventory.signed('puppetdb').endswith('signed/puppetdb.pem')
+    assert inventory.signed('node01.mydomain.com') is None
+
+
+def test_inventory_incremental_refresh(ca_dir):
+    inventory = CaInventory(ca_dir)
+    assert inventory.refresh() == 0
+
+    with open(os.path.join(ca_dir, 'inventory.txt'), 'a') as f:
+        f.write("0x0005 2018-05-01T00:00:00UTC 2019-05-01T00:00:00UTC /CN=admin1.mydomain.com\n")
+        f.write("0x0006 2018-05-01T00:00:00UTC 2023")
+
+    assert inventory.refresh() == 1
+    assert inventory.latest('admin1.mydomain.com').serial == 5
+    assert [e.serial for e in inventory.find('admin1.mydomain.com')] == [4, 5]
+    assert inventory.expired(now=0) == []
+    assert inventory.expiring(0, 1600000000)[0].serial == 5
+
+    with open(os.path.join(ca_dir, 'inventory.txt'), 'a') as f:
+        f.write("-05-01T00:00:00UTC /CN=node01.mydomain.com\n")
+
+    assert inventory.refresh() == 1
+    assert 6 in inventory
+
+
+def test_inventory_truncated(ca_dir):
+    inventory = CaInventory(ca_dir)
+
+    with open(os.path.join(ca_dir, 'inventory.txt'), 'w') as f:
+        f.write("0x0001 2018-04-23T15:56:11UTC 2023-04-23T15:56:11UTC /CN=Puppet CA: puppet.mydomain.com\n")
+
+    inventory.refresh()
+    assert len(inventory) == 1
@@ -0,0 +1,50 @@
+import json
+import pytest
+
+from puppet_apis.jsonstream import iter_json_array
+
+
+# == Helpers
+#
+def chunked(data, size):
+    return [data[i:i + size] for i in range(0, len(data), size)]
+
+
+# == Tests
+#
+@pytest.mark.parametrize('size', [1, 3, 7, 4096])
+def test_iter_json_array_chunks(size):
+    items = [
+        {'certname': 'node{:02d}.mydomain.com'.format(i), 'deactivated': None, 'facts': {'é': [i, 1.5]}}
+        for i in range(50)
+    ] + [12345, "str", None, True, []]
+    data = json.dumps(items, indent=1).encode()
+
+    assert list(iter_json_array(chunked(data, size))) == items
+
+
+def test_iter_json_array_empty():
+    assert list(iter_json_array([b' [ ', b' ] '])) == []
+
+
+def test_iter_json_array_is_lazy():
+    def chunks():
+        yield b'[{"a": 1}, '
+        raise AssertionError("Read too far")
+
+    assert next(iter_json_array(chunks())) == {'a': 1}
+
+
+@pytest.mark.parametrize('data', [b'{"error": "x"}', b'[{"a": 1}, {"a":', b'[1 2]'])
+def test_iter_json_array_invalid(data):
+    with pytest.raises(ValueError):
+        list(iter_json_array([data]))
+
+
+@pytest.mark.parametrize('size', [1, 2, 3, 5])
+def test_iter_json_array_split_numbers(size):
+    items = [0, -2500.0, 1.5e-7, -3E+12, 2e5, 0.125, -0.0, 10, True, False, None]
+    data = json.dumps(items).replace(' ', '').encode()
+
+    assert list(iter_json_array(chunked(data, size))) == items
+    assert list(iter_json_array([b'[0', b', -2500.', b'0, 1', b'e', b'-', b'3]'])) == [0, -2500.0, 1e-3]
@@ -0,0 +1,133 @@
+import time
+
+import pytest
+
+from cryptography.hazmat.primitives.asymmetric import ec
+from OpenSSL import crypto
+
+from puppet_apis import KeyPool, PuppetCaCli
+from puppet_apis.keypool import generate_private_key, key_spec
+
+
+# == Helpers
+#
+def _wait_full(pool, timeout=30):
+    deadline = time.monotonic() + timeout
+    while len(pool) < pool.size and time.monotonic() < deadline:
+        time.sleep(0.05)
+    return len(pool)
+
+
+# == Tests
+#
+# === Key algorithms
+#
+def test_key_spec():
+    assert key_spec() == (crypto.TYPE_RSA, 2048)
+    assert key_spec('RSA', '4096') == (crypto.TYPE_RSA, 4096)
+    assert key_spec('ec') == (crypto.TYPE_EC, 'P-256')
+    assert key_spec('ec', 'prime256v1') == (crypto.TYPE_EC, 'P-256')
+    assert key_spec(crypto.TYPE_EC, 384) == (crypto.TYPE_EC, 'P-384')
+    assert key_spec('ec', 'secp521r1') == (crypto.TYPE_EC, 'P-521')
+
+    with pytest.raises(ValueError):
+        key_spec('ec', 'P-192')
+    with pytest.raises(ValueError):
+        key_spec('dsa')
+
+
+@pytest.mark.parametrize('curve, expected', [('P-256', ec.SECP256R1), ('384', ec.SECP384R1)])
+def test_generate_ec_key(curve, expected):
+    key = generate_private_key('ec', curve)
+    assert key.type() == crypto.TYPE_EC
+    assert isinstance(key.to_cryptography_key().curve, expected)
+
+
+def test_cli_generates_ec_csr(tmp_path):
+    config = {
+        'puppetserver': {'server': '127.0.0.1', 'port': 8140},
+        'ssl': {
+            'client_name': 'admin.mydomain.com',
+            'client_cert': str(tmp_path / 'missing.pem'),
+            'client_key': str(tmp_path / 'missing.key'),
+            'key_type': 'ec',
+            'key_size': 'P-384',
+        },
+    }
+    cli = PuppetCaCli(config)
+    assert cli.generate_csr('node01.mydomain.com', san=['node01'], ssl_dir=str(tmp_path))
+
+    key = crypto.load_privatekey(
+        crypto.FILETYPE_PEM, (tmp_path / 'private_keys' / 'node01.mydomain.com.pem').read_bytes())
+    csr = crypto.load_certificate_request(
+        crypto.FILETYPE_PEM, (tmp_path / 'certificate_request' / 'node01.mydomain.com.pem').read_bytes())
+    assert isinstance(key.to_cryptography_key().curve, ec.SECP384R1)
+    assert csr.verify(csr.get_pubkey())
+    assert b'node01' in csr.get_extensions()[0].get_data()
+
+
+def test_keypool_ec():
+    with KeyPool(type='ec', bits='P-256', size=2, processes=1) as pool:
+        assert pool.matches('ec', 'prime256v1')
+        assert not pool.matches('rsa', 2048)
+        assert _wait_full(pool) == 2
+        assert isinstance(pool.get().to_cryptography_key().curve, ec.SECP256R1)
+
+
+# === Key pool
+#
+def test_keypool_fills_and_refills():
+    with KeyPool(bits=1024, size=3, processes=2) as pool:
+        assert _wait_full(pool) == 3
+
+        keys = [pool.get() for _ in range(3)]
+        assert all(key.type() == crypto.TYPE_RSA and key.bits() == 1024 for key in keys)
+        assert keys[0].check()
+        # Distinct keys
+        pems = set(crypto.dump_privatekey(crypto.FILETYPE_PEM, key) for key in keys)
+        assert len(pems) == 3
+
+        # Refilled in the background
+        assert _wait_full(pool) == 3
+
+
+def test_keypool_empty_and_closed():
+    pool = KeyPool(bits=1024, size=1, processes=1)
+    assert pool.matches('rsa', 1024)
+    assert pool.matches(crypto.TYPE_RSA, '1024')
+    assert not pool.matches('rsa', 2048)
+    assert not pool.matches('ec', None)
+
+    pool.close()
+    assert len(pool) == 0
+    assert pool.get() is None
+
+
+def test_cli_uses_key_pool(tmp_path):
+    config = {
+        'puppetserver': {'server': '127.0.0.1', 'port': 8140},
+        'ssl': {
+            'client_name': 'admin.mydomain.com',
+            'client_cert': str(tmp_path / 'missing.pem'),
+            'client_key': str(tmp_path / 'missing.key'),
+            'key_size': 1024,
+        },
+    }
+    with KeyPool(bits=1024, size=1, processes=1) as pool:
+        assert _wait_full(pool) == 1
+        pooled = pool._keys[0]
+        cli = PuppetCaCli(config, key_pool=pool)
+
+        assert cli.generate_csr('node01.mydomain.com', ssl_dir=str(tmp_path))
+        # The pre-generated key is used
+        key_pem = (tmp_path / 'private_keys' / 'node01.mydomain.com.pem').read_bytes()
+        assert key_pem == pooled
+
+        key = crypto.load_privatekey(crypto.FILETYPE_PEM, key_pem)
+        csr = crypto.load_certificate_request(
+            crypto.FILETYPE_PEM, (tmp_path / 'certificate_request' / 'node01.mydomain.com.pem').read_bytes())
+        assert key.bits() == 1024
+        assert csr.get_subject().CN == 'node01.mydomain.com'
+        assert csr.verify(csr.get_pubkey())
+        assert crypto.dump_publickey(crypto.FILETYPE_PEM, csr.get_pubkey()) == \
+            crypto.dump_publickey(crypto.FILETYPE_PEM, key)
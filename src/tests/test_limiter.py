@@ -0,0 +1,196 @@
+import asyncio
+import threading
+
+import pytest
+
+from requests.exceptions import ConnectionError, ReadTimeout
+
+from puppet_apis import PuppetCa, PuppetDb
+from puppet_apis.limiter import AdaptiveLimiter, retry_after
+from puppet_apis.testing import PuppetEmulator
+
+
+# == Helpers
+#
+class FakeClock:
+    def __init__(self):
+        self.now = 100.0
+
+    def __call__(self):
+        return self.now
+
+
+# == Tests
+#
+# === AIMD
+#
+def test_limiter_additive_increase():
+    limiter = AdaptiveLimiter(limit=4, max_limit=5)
+    for _ in range(4):
+        limiter.acquire()
+        limiter.release(0.01)
+    assert 4.9 < limiter.limit < 5
+
+    for _ in range(100):
+        limiter.acquire()
+        limiter.release(0.01)
+    assert limiter.limit == 5
+
+
+def test_limiter_multiplicative_decrease_once_per_round_trip():
+    clock = FakeClock()
+    limiter = AdaptiveLimiter(limit=16, min_limit=2, clock=clock)
+    for _ in range(8):
+        limiter.acquire()
+
+    # A burst of 503s for requests sent together: one decrease
+    clock.now += 1
+    for _ in range(8):
+        limiter.release(1, overloaded=True)
+    assert limiter.limit == 8
+    assert limiter.overloads == 8
+
+    # Next round trip
+    for limit in (4, 2, 2):
+        limiter.acquire()
+        clock.now += 1
+        limiter.release(1, overloaded=True)
+        assert limiter.limit == limit
+
+
+def test_limiter_latency_target():
+    limiter = AdaptiveLimiter(limit=10, latency_target=0.5)
+    limiter.acquire()
+    limiter.release(2)
+    assert limiter.limit == 5
+
+
+def test_limiter_retry_after():
+    clock = FakeClock()
+    limiter = AdaptiveLimiter(limit=10, clock=clock)
+    limiter.acquire()
+    limiter.release(0.1, overloaded=True, retry_after=5)
+
+    assert limiter._try_acquire() == 5
+    clock.now += 5
+    assert limiter._try_acquire() == 0
+
+    assert retry_after('3') == 3
+    assert retry_after('Wed, 21 Oct 2015 07:28:00 GMT') is None
+    assert retry_after(None) is None
+
+
+def test_limiter_token_bucket():
+    clock = FakeClock()
+    limiter = AdaptiveLimiter(limit=100, rate=10, burst=2, clock=clock)
+
+    assert limiter._try_acquire() == 0
+    assert limiter._try_acquire() == 0
+    assert limiter._try_acquire() == pytest.approx(0.1)
+    clock.now += 0.11
+    assert limiter._try_acquire() == 0
+
+
+# === Concurrency
+#
+def test_limiter_bounds_concurrency():
+    limiter = AdaptiveLimiter(limit=3, max_limit=3)
+    peak = []
+    lock = threading.Lock()
+
+    def work():
+        limiter.acquire()
+        with lock:
+            peak.append(limiter.in_flight)
+        threading.Event().wait(0.01)
+        limiter.release(0.01)
+
+    threads = [threading.Thread(target=work) for _ in range(20)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert max(peak) == 3
+    assert limiter.in_flight == 0
+    assert limiter.waits > 0
+
+
+def test_limiter_async():
+    limiter = AdaptiveLimiter(limit=2, max_limit=2)
+    peak = []
+
+    async def work():
+        await limiter.acquire_async()
+        peak.append(limiter.in_flight)
+        await asyncio.sleep(0.01)
+        limiter.release(0.01)
+
+    async def main():
+        await asyncio.gather(*[work() for _ in range(10)])
+
+    asyncio.run(main())
+    assert max(peak) == 2
+    assert limiter.in_flight == 0
+
+
+def test_limiter_backs_off_on_503():
+    # The emulator answers 'Retry-After: 1', do not wait that long
+    limiter = AdaptiveLimiter(limit=16, max_pause=0.05)
+    with PuppetEmulator(latency=0.01, max_concurrency=4) as emulator:
+        emulator.populate(200)
+        puppetca = PuppetCa(server=emulator.host, port=emulator.port, scheme='http',
+                            pool_maxsize=16, coalesce=False, limiter=limiter)
+
+        def work(i):
+            for j in range(i, 200, 16):
+                puppetca.status('node{:06d}.mydomain.com'.format(j))
+
+        threads = [threading.Thread(target=work, args=(i,)) for i in range(16)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    assert limiter.overloads > 0
+    assert limiter.limit < 16
+    assert limiter.in_flight == 0
+
+
+def test_limiter_backs_off_on_errors():
+    limiter = AdaptiveLimiter(limit=8)
+    with PuppetEmulator(latency=0.3) as emulator:
+        emulator.add_node('node000001.mydomain.com')
+        puppetdb = PuppetDb(server=emulator.host, port=emulator.port, timeout=(1, 0.1), limiter=limiter)
+        with pytest.raises(ReadTimeout):
+            puppetdb.status('node000001.mydomain.com')
+    assert limiter.limit == 4
+
+    # Refused connection
+    with pytest.raises(ConnectionError):
+        puppetdb.status('node000001.mydomain.com')
+    assert limiter.limit == 2
+    assert limiter.overloads == 2
+    assert limiter.in_flight == 0
+
+
+def test_limiter_async_retry_after():
+    pytest.importorskip('aiohttp')
+    from puppet_apis import AsyncPuppetCa
+
+    limiter = AdaptiveLimiter(limit=16, max_pause=30)
+    with PuppetEmulator(latency=0.05, max_concurrency=1) as emulator:
+        emulator.populate(4)
+
+        async def main():
+            async with AsyncPuppetCa(server=emulator.host, port=emulator.port, scheme='http',
+                                     limiter=limiter) as puppetca:
+                await asyncio.gather(*[
+                    puppetca.status('node{:06d}.mydomain.com'.format(i)) for i in range(4)
+                ])
+
+        asyncio.run(main())
+
+    assert emulator.throttled_count > 0
+    # The emulator answers 'Retry-After: 1'
+    assert 0 < limiter._try_acquire() <= 1
@@ -0,0 +1,122 @@
+import socket
+
+import pytest
+from requests.exceptions import ConnectionError
+
+from puppet_apis import PuppetCa, PuppetDb
+from puppet_apis.metrics import Metrics, StatsdExporter, endpoint_label
+from puppet_apis.testing import PuppetEmulator
+
+
+# == Config
+#
+NODE1='node01.mydomain.com'
+
+
+# == Fixtures
+#
+@pytest.fixture
+def emulator_nodes():
+    return {NODE1: 'signed'}
+
+
+@pytest.fixture
+def metrics():
+    return Metrics()
+
+
+# == Tests
+#
+def test_endpoint_label():
+    assert endpoint_label('/puppet-ca/v1/certificate_status/node01.mydomain.com') == 'puppet-ca/v1/certificate_status'
+    assert endpoint_label('/pdb/query/v4/nodes/node01.mydomain.com/facts') == 'pdb/query/v4/nodes'
+    assert endpoint_label('/pdb/cmd/v1?command=deactivate_node') == 'pdb/cmd/v1'
+    assert endpoint_label('/status') == 'status'
+
+
+def test_metrics_records_requests(emulator, metrics):
+    puppetca = PuppetCa(server=emulator.host, port=emulator.port, scheme='http', metrics=metrics)
+    puppetdb = PuppetDb(server=emulator.host, port=emulator.port, scheme='http', metrics=metrics)
+
+    samples = []
+    metrics.subscribe(samples.append)
+
+    puppetca.status(NODE1)
+    puppetca.status('unknown.mydomain.com')
+    puppetdb.deactivate(NODE1)
+
+    assert [(s.method, s.endpoint, s.status) for s in samples] == [
+        ('GET', 'puppet-ca/v1/certificate_status', 200),
+        ('GET', 'puppet-ca/v1/certificate_status', 404),
+        ('POST', 'pdb/cmd/v1', 200),
+    ]
+    assert samples[0].bytes_received > 0
+    assert samples[2].bytes_sent > 0
+    assert metrics.in_flight() == 0
+
+    entries = {(e['method'], e['endpoint']): e for e in metrics.snapshot()}
+    status = entries[('GET', 'puppet-ca/v1/certificate_status')]
+    assert status['count'] == 2
+    assert status['statuses'] == {200: 1, 404: 1}
+    assert sum(count for _, count in status['buckets']) == 2
+
+
+def test_metrics_records_retries(metrics):
+    with PuppetEmulator(error_rate=1, error_status=502) as emulator:
+        emulator.add_node(NODE1)
+        puppetca = PuppetCa(server=emulator.host, port=emulator.port, scheme='http',
+                            retries=2, backoff_factor=0, metrics=metrics)
+        puppetca.status(NODE1)
+
+    entry, = metrics.snapshot()
+    assert entry['statuses'] == {502: 1}
+    assert entry['retries'] == 2
+
+
+def test_metrics_records_errors(metrics):
+    # Nothing listening on this port
+    sock = socket.socket()
+    sock.bind(('127.0.0.1', 0))
+    port = sock.getsockname()[1]
+    sock.close()
+
+    puppetca = PuppetCa(server='127.0.0.1', port=port, scheme='http', metrics=metrics)
+    with pytest.raises(Exception):
+        puppetca.status(NODE1)
+
+    entry, = metrics.snapshot()
+    assert entry['errors'] == {ConnectionError.__name__: 1}
+    assert metrics.in_flight() == 0
+
+
+def test_metrics_prometheus(emulator, metrics):
+    puppetca = PuppetCa(server=emulator.host, port=emulator.port, scheme='http', metrics=metrics)
+    puppetca.status(NODE1)
+
+    text = metrics.prometheus()
+    labels = 'server="{}:{}",method="GET",endpoint="puppet-ca/v1/certificate_status"'.format(
+        emulator.host, emulator.port)
+    assert 'puppet_apis_requests_total{{{},status="200"}} 1'.format(labels) in text
+    assert 'puppet_apis_request_duration_seconds_bucket{{{},le="+Inf"}} 1'.format(labels) in text
+    assert 'puppet_apis_request_duration_seconds_count{{{}}} 1'.format(labels) in text
+    assert '# TYPE puppet_apis_request_duration_seconds histogram' in text
+
+
+def test_metrics_statsd(emulator, metrics):
+    receiver = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    receiver.bind(('127.0.0.1', 0))
+    receiver.settimeout(5)
+
+    exporter = StatsdExporter('127.0.0.1', receiver.getsockname()[1], prefix='puppet')
+    metrics.subscribe(exporter)
+
+    puppetca = PuppetCa(server=emulator.host, port=emulator.port, scheme='http', metrics=metrics)
+    puppetca.status(NODE1)
+
+    lines = receiver.recv(65536).decode().split('\n')
+    name = 'puppet.127_0_0_1_{}.puppet_ca_v1_certificate_status.GET'.format(emulator.port)
+    assert lines[0].startswith(name + '.duration:')
+    assert lines[1] == name + '.status.200:1|c'
+
+    exporter.close()
+    receiver.close()
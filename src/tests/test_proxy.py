@@ -0,0 +1,96 @@
+import threading
+
+import pytest
+
+from puppet_apis import PuppetCa, PuppetCaException, PuppetDb
+from puppet_apis.proxy import PuppetProxy
+from puppet_apis.testing import PuppetEmulator
+
+
+# == Config
+#
+NODE1='node01.mydomain.com'
+NODE2='node02.mydomain.com'
+
+
+# == Fixtures
+#
+@pytest.fixture
+def emulator_nodes():
+    return {NODE1: 'signed', NODE2: 'requested'}
+
+
+@pytest.fixture
+def proxy(emulator):
+    upstream = dict(server=emulator.host, port=emulator.port, scheme='http')
+    with PuppetProxy(PuppetCa(**upstream), PuppetDb(**upstream), ttl=60, port=0) as proxy:
+        yield proxy
+
+
+@pytest.fixture
+def puppetca_client(proxy):
+    return PuppetCa(server=proxy.host, port=proxy.port, scheme='http')
+
+
+@pytest.fixture
+def puppetdb_client(proxy):
+    return PuppetDb(server=proxy.host, port=proxy.port, scheme='http')
+
+
+# == Tests
+#
+def test_proxy_caches_statuses(emulator, proxy, puppetca_client, puppetdb_client):
+    for _ in range(3):
+        assert puppetca_client.status(NODE1)['state'] == 'signed'
+        assert puppetca_client.status('unknown.mydomain.com') == {}
+        assert puppetdb_client.status(NODE1)['certname'] == NODE1
+
+    assert emulator.requests_count == 3
+    assert proxy.stats()['cache']['hits'] == 6
+
+
+def test_proxy_forwards_other_requests(emulator, proxy, puppetca_client):
+    assert [s['name'] for s in puppetca_client.statuses(state='requested')] == [NODE2]
+    assert 'BEGIN CERTIFICATE' in puppetca_client.get_cert(NODE1)
+    assert emulator.requests_count == 2
+
+
+def test_proxy_writes_invalidate(emulator, proxy, puppetca_client, puppetdb_client):
+    assert puppetca_client.status(NODE2)['state'] == 'requested'
+    assert puppetca_client.sign(NODE2)
+    assert puppetca_client.status(NODE2)['state'] == 'signed'
+
+    assert puppetdb_client.status(NODE1)['deactivated'] is None
+    assert puppetdb_client.deactivate(NODE1)
+    assert puppetdb_client.status(NODE1)['deactivated'] is not None
+
+
+def test_proxy_coalesces_requests():
+    with PuppetEmulator(latency=0.2) as emulator:
+        emulator.add_node(NODE1)
+        upstream = PuppetCa(server=emulator.host, port=emulator.port, scheme='http')
+        with PuppetProxy(upstream, ttl=60, port=0) as proxy:
+            # Not coalesced client side, so all requests reach the proxy
+            client = PuppetCa(server=proxy.host, port=proxy.port, scheme='http', pool_maxsize=8, coalesce=False)
+
+            results = []
+            threads = [threading.Thread(target=lambda: results.append(client.status(NODE1))) for _ in range(8)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+            assert [r['state'] for r in results] == ['signed'] * 8
+            assert emulator.requests_count == 1
+            assert proxy.stats()['coalesced'] == 7
+
+
+def test_proxy_upstream_down():
+    with PuppetEmulator() as emulator:
+        upstream = PuppetCa(server=emulator.host, port=emulator.port, scheme='http')
+    with PuppetProxy(upstream, port=0) as proxy:
+        client = PuppetCa(server=proxy.host, port=proxy.port, scheme='http')
+        # 502: not an empty CA
+        with pytest.raises(PuppetCaException):
+            client.statuses()
+        assert proxy.upstream_errors == 1
@@ -0,0 +1,73 @@
+import pytest
+
+from puppet_apis import PuppetCa, PuppetCaIndex
+from puppet_apis.puppetca import PuppetCaException
+from puppet_apis.testing import PuppetEmulator
+
+
+# == Config
+#
+NODE1='node01.mydomain.com'
+NODE2='node02.mydomain.com'
+
+STATUSES = [
+    {
+        'name': NODE1,
+        'state': 'signed',
+        'fingerprint': 'AA:01',
+        'fingerprints': {'SHA1': 'BB:01', 'SHA256': 'AA:01', 'default': 'AA:01'}
+    },
+    {
+        'name': NODE2,
+        'state': 'requested',
+        'fingerprint': 'AA:02',
+        'fingerprints': {'SHA1': 'BB:02', 'SHA256': 'AA:02', 'default': 'AA:02'}
+    },
+]
+
+
+# == Tests
+#
+def test_puppetca_index_lookups():
+    index = PuppetCaIndex(STATUSES)
+
+    assert len(index) == 2
+    assert NODE1 in index
+    assert index.get(NODE1)['state'] == 'signed'
+    assert index.get('unknown.mydomain.com') == {}
+    assert [s['name'] for s in index.state('requested')] == [NODE2]
+    assert index.fingerprint('bb:02')['name'] == NODE2
+
+
+def test_puppetca_index_reload_replaces_entry():
+    index = PuppetCaIndex(STATUSES)
+    index.load([dict(STATUSES[1], state='signed', fingerprint='AA:03', fingerprints={})])
+
+    assert index.state('requested') == []
+    assert len(index.state('signed')) == 2
+    assert index.fingerprint('AA:02') == {}
+    assert index.fingerprint('AA:03')['name'] == NODE2
+
+
+def test_puppetca_index_discard():
+    index = PuppetCaIndex(STATUSES)
+    index.discard(NODE1)
+    index.discard(NODE1)
+
+    assert NODE1 not in index
+    assert index.state('signed') == []
+    assert index.fingerprint('AA:01') == {}
+
+
+def test_puppetca_index_from_ca():
+    with PuppetEmulator() as emulator:
+        emulator.add_node(NODE1)
+        emulator.add_node(NODE2, state='requested')
+        puppetca = PuppetCa(server=emulator.host, port=emulator.port, scheme='http')
+
+        assert [s['name'] for s in puppetca.index().state('requested')] == [NODE2]
+
+        # Errors are not an empty CA
+        emulator.error_rate = 1.0
+        with pytest.raises(PuppetCaException):
+            puppetca.index()
@@ -0,0 +1,189 @@
+import threading
+import time
+
+import pytest
+
+from puppet_apis import PuppetCa, PuppetCaException, PuppetDb
+from puppet_apis.deadline import Deadline, DeadlineExceeded
+from puppet_apis.singleflight import SingleFlight
+from puppet_apis.testing import PuppetEmulator
+
+
+# == Config
+#
+NODE1='node01.mydomain.com'
+
+
+# == Helpers
+#
+def run_threads(fn, count=8):
+    results = []
+    errors = []
+
+    def target():
+        try:
+            results.append(fn())
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=target) for _ in range(count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results, errors
+
+
+# == Tests
+#
+# === SingleFlight
+#
+def test_singleflight_shares_result():
+    flights = SingleFlight()
+    release = threading.Event()
+    calls = []
+
+    def fn():
+        calls.append(1)
+        release.wait()
+        return {'state': 'signed'}
+
+    leader = threading.Thread(target=flights.do, args=('key', fn))
+    leader.start()
+    while not flights.in_flight():
+        pass
+
+    followers = [threading.Thread(target=flights.do, args=('key', fn)) for _ in range(4)]
+    for thread in followers:
+        thread.start()
+    while flights.coalesced < 4:
+        pass
+    release.set()
+    for thread in [leader] + followers:
+        thread.join()
+
+    assert len(calls) == 1
+    assert flights.in_flight() == 0
+    # Next call runs again
+    assert flights.do('key', lambda: 'new') == 'new'
+
+
+def test_singleflight_shares_error():
+    flights = SingleFlight()
+    release = threading.Event()
+
+    def fn():
+        release.wait()
+        raise ValueError('boom')
+
+    errors = []
+
+    def call():
+        try:
+            flights.do('key', fn)
+        except ValueError as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=call) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    while flights.coalesced < 3:
+        pass
+    release.set()
+    for thread in threads:
+        thread.join()
+
+    assert len(errors) == 4
+
+
+def test_singleflight_forget():
+    flights = SingleFlight()
+    release = threading.Event()
+
+    leader = threading.Thread(target=flights.do, args=('key', release.wait))
+    leader.start()
+    while not flights.in_flight():
+        pass
+
+    flights.forget('key')
+    assert flights.do('key', lambda: 'fresh') == 'fresh'
+    release.set()
+    leader.join()
+
+
+def test_singleflight_follower_deadline():
+    flights = SingleFlight()
+    started = threading.Event()
+
+    def slow():
+        started.set()
+        time.sleep(0.5)
+        return 'done'
+
+    leader = threading.Thread(target=flights.do, args=('key', slow))
+    leader.start()
+    started.wait()
+
+    start = time.monotonic()
+    with pytest.raises(DeadlineExceeded):
+        flights.do('key', slow, deadline=Deadline(0.05))
+    assert time.monotonic() - start < 0.3
+
+    # Enough time left: the result is shared
+    assert flights.do('key', slow, deadline=Deadline(5)) == 'done'
+    leader.join()
+    assert flights.coalesced == 2
+
+
+# === Clients
+#
+def test_clients_coalesce_status():
+    with PuppetEmulator(latency=0.2) as emulator:
+        emulator.add_node(NODE1)
+        puppetca = PuppetCa(server=emulator.host, port=emulator.port, scheme='http')
+        puppetdb = PuppetDb(server=emulator.host, port=emulator.port, scheme='http')
+
+        results, errors = run_threads(lambda: puppetca.status(NODE1))
+        assert [r['state'] for r in results] == ['signed'] * 8
+        assert emulator.requests_count == 1
+
+        results, errors = run_threads(lambda: puppetdb.status(NODE1))
+        assert [r['certname'] for r in results] == [NODE1] * 8
+        assert emulator.requests_count == 2
+
+
+def test_clients_coalesce_disabled():
+    with PuppetEmulator(latency=0.05) as emulator:
+        emulator.add_node(NODE1)
+        puppetca = PuppetCa(server=emulator.host, port=emulator.port, scheme='http', coalesce=False)
+
+        run_threads(lambda: puppetca.status(NODE1), count=4)
+        assert emulator.requests_count == 4
+
+
+def test_clients_coalesce_errors():
+    with PuppetEmulator() as emulator:
+        puppetca = PuppetCa(server=emulator.host, port=emulator.port, scheme='http')
+
+    results, errors = run_threads(lambda: puppetca.status(NODE1))
+    assert results == []
+    assert len(errors) == 8
+    assert all(isinstance(e, PuppetCaException) for e in errors)
+
+
+def test_clients_coalesce_deadline():
+    with PuppetEmulator(latency=0.5) as emulator:
+        emulator.add_node(NODE1)
+        puppetca = PuppetCa(server=emulator.host, port=emulator.port, scheme='http')
+
+        leader = threading.Thread(target=puppetca.status, args=(NODE1,))
+        leader.start()
+        while not emulator.in_flight:
+            time.sleep(0.01)
+
+        start = time.monotonic()
+        with pytest.raises(DeadlineExceeded):
+            puppetca.status(NODE1, timeout=Deadline(0.1))
+        assert time.monotonic() - start < 0.4
+        leader.join()
+        assert emulator.requests_count == 1